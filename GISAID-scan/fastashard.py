@@ -0,0 +1,92 @@
+"""Byte-level FASTA reader, with record-aligned shards for worker pools.
+
+The file is memory mapped and records are cut on '\\n>' boundaries, without
+building Seq objects. A shard is a (start, end) byte range holding whole
+records, so that each worker of a pool reads its own part of the file and the
+file is read once overall. fasta-2line files are read as they are; sequences
+on several lines (GISAID downloads) are joined.
+
+Usage:
+    python3 fastashard.py -i spikeprot0125.fasta -n 16
+prints the number of records and residues of each shard.
+"""
+import argparse
+import mmap
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def mapped(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def _first_record(mm, start=0, end=None):
+    if mm[start:start+1] == b'>':
+        return start
+    pos = mm.find(b'\n>', start, end)
+    return pos + 1 if pos >= 0 else -1
+
+
+def shards(path, n):
+    """Splits a FASTA file into at most n (start, end) byte ranges of whole records"""
+    with mapped(path) as mm:
+        size = len(mm)
+        first = _first_record(mm)
+        if first < 0:
+            return []
+        bounds = [first]
+        for i in range(1, n):
+            cut = mm.find(b'\n>', max(first, i * size // n))
+            if cut < 0:
+                break
+            if cut + 1 > bounds[-1]:
+                bounds.append(cut + 1)
+        bounds.append(size)
+        return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def read_records(path, start=0, end=None):
+    """Yields (id, description, sequence bytes) for each record starting in [start, end)"""
+    with mapped(path) as mm:
+        end = len(mm) if end is None else end
+        pos = _first_record(mm, start, end)
+        while 0 <= pos < end:
+            nl = mm.find(b'\n', pos)
+            if nl < 0:
+                nl = len(mm)
+            nxt = mm.find(b'\n>', nl, end)
+            stop = end if nxt < 0 else nxt + 1
+            description = mm[pos+1:nl].rstrip(b'\r').decode()
+            seq = mm[nl+1:stop].rstrip(b'\r\n')
+            if b'\n' in seq or b'\r' in seq: # multi-line record
+                seq = b''.join(seq.split())
+            yield (description.split(None, 1)[0] if description else ''), description, seq
+            pos = stop
+
+
+def read_shard(path, bounds):
+    return read_records(path, bounds[0], bounds[1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Split a FASTA file into record-aligned shards')
+    parser.add_argument('-i', '--input', required=True, help = 'FASTA file')
+    parser.add_argument('-n', '--shards', type=int, default=os.cpu_count(), help = 'Number of shards')
+    args = parser.parse_args()
+
+    for bounds in shards(args.input, args.shards):
+        nrec = 0
+        nres = 0
+        for rid, description, seq in read_shard(args.input, bounds):
+            nrec += 1
+            nres += len(seq)
+        print(str(bounds[0])+'\t'+str(bounds[1])+'\t'+str(nrec)+' records\t'+str(nres)+' residues')
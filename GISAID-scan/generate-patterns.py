@@ -1,13 +1,6 @@
 import sys
 
-def findnth(c,s):
-    count = 0
-    for i in range(len(s)-1,0,-1):
-        if s[i] == 'X': count +=1
-        if count == c:
-            return i
-
-pattern = "XX...........X...........................X.X.X...X.XX................X.XX.......X.XX.X...XXXX.X.XXXXXX"
+from motifs import pattern, findnth
 
 suffix_len = int(sys.argv[1])
 masterfile = sys.argv[2]
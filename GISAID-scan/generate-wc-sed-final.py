@@ -1,4 +1,4 @@
-pattern = "XX...........X...........................X.X.X...X.XX................X.XX.......X.XX.X...XXXX.X.XXXXXX"
+from motifs import pattern
 cX = 0
 
 for i ,c in enumerate(pattern):
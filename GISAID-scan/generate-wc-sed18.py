@@ -1,11 +1,4 @@
-def findnth(c,s):
-    count = 0
-    for i in range(len(s)-1,0,-1):
-        if s[i] == 'X': count +=1
-        if count == c:
-            return i
-
-pattern = "XX...........X...........................X.X.X...X.XX................X.XX.......X.XX.X...XXXX.X.XXXXXX"
+from motifs import pattern, findnth
 
 suffix_len = 18
 pattern = pattern[findnth(suffix_len,pattern):]
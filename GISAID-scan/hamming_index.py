@@ -0,0 +1,198 @@
+"""Hamming-distance search of predicted RBMs against GISAID windows.
+
+Instead of one wildcard pattern file (and one full regex scan) per position,
+the residues found at the gapped motif positions are extracted once from
+every GISAID window, at every offset, and deduplicated into an index of motif
+keys. A query finds all predicted RBMs within Hamming distance k of a key:
+for each set of at most k masked positions, keys and RBMs are joined on a
+hash of their remaining residues (sort + binary search), then candidates are
+checked on residues. k = 0, 1, 2 are answered in one query.
+
+Usage:
+    python3 hamming_index.py -r ddg_mono385_betterdg_noCYS.txt -f spike-1260.fasta2 -k 2 -o rbm-hits.tsv
+writes, for each (RBM, key) pair: RBM | GISAID motif | distance | mismatch positions | record ids.
+"""
+import argparse
+import os
+import sys
+from itertools import combinations
+
+import numpy as np
+
+import fastashard
+import multiscan
+import windowstore
+from motifs import pattern, residue_number
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+FIRST_RESIDUE = residue_number(0) # residue number of the first pattern position
+BATCH = 1 << 16
+
+
+def motif_positions(suffix_len=None):
+    """Positions of the motif residues in the pattern (the last suffix_len ones if given)"""
+    positions = np.array([i for i, c in enumerate(pattern) if c == 'X'], dtype=np.int64)
+    if suffix_len:
+        positions = positions[-suffix_len:]
+    return positions - positions[0]
+
+
+def _as_matrix(strings, width=None):
+    width = width or max((len(s) for s in strings), default=0)
+    raw = b''.join(s.encode()[:width].ljust(width, b'\0') for s in strings)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(len(strings), width)
+
+
+def _unique_rows(rows):
+    """np.unique on the rows of a uint8 matrix, returns (unique rows, inverse)"""
+    view = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.shape[1])))[:, 0]
+    uniq, inverse = np.unique(view, return_inverse=True)
+    return uniq.view(np.uint8).reshape(len(uniq), rows.shape[1]), inverse.ravel()
+
+
+class MotifIndex:
+    """Distinct motif keys found in a set of windows, with their occurrences"""
+
+    def __init__(self, positions):
+        self.positions = np.asarray(positions)
+        self.span = self.positions[-1] + 1
+        self.keys = np.zeros((0, len(self.positions)), dtype=np.uint8)
+        self.occ_key = np.zeros(0, dtype=np.int64) # key id of each occurrence
+        self.occ_window = np.zeros(0, dtype=np.int64) # window id of each occurrence
+        self._parts = []
+        self.nwindows = 0
+
+    def add(self, windows):
+        """Indexes the keys of a batch of windows at every offset"""
+        mat = _as_matrix(windows)
+        lengths = np.array([len(w) for w in windows])
+        for offset in range(mat.shape[1] - self.span + 1):
+            ok = np.flatnonzero(lengths >= offset + self.span)
+            keys, inverse = _unique_rows(mat[ok][:, offset + self.positions])
+            self._parts.append((keys, inverse, ok + self.nwindows))
+        self.nwindows += len(windows)
+
+    def finalize(self):
+        """Merges the keys of all batches"""
+        if not self._parts:
+            return self
+        keys, inverse = _unique_rows(np.concatenate([p[0] for p in self._parts]))
+        occ_key = []
+        start = 0
+        for part_keys, part_inverse, part_windows in self._parts:
+            occ_key.append(inverse[start:start+len(part_keys)][part_inverse])
+            start += len(part_keys)
+        self.occ_key = np.concatenate(occ_key)
+        self.occ_window = np.concatenate([p[2] for p in self._parts])
+        order = np.argsort(self.occ_key, kind='stable')
+        self.occ_key = self.occ_key[order]
+        self.occ_window = self.occ_window[order]
+        self.keys = keys
+        self._parts = []
+        return self
+
+    def windows_of(self, key):
+        lo, hi = np.searchsorted(self.occ_key, [key, key + 1])
+        return np.unique(self.occ_window[lo:hi])
+
+    def query(self, rbms, k=1, seed=0):
+        """Returns (rbm ids, key ids, distances) of all pairs within Hamming distance k.
+
+        The key hashes are sorted once per mask of k or fewer positions (379
+        masks for k = 2 on 27 positions), whatever the number of RBMs, so
+        all RBMs should be given in a single query rather than in batches.
+        """
+        length = len(self.positions)
+        weights = np.random.default_rng(seed).integers(1, 2**63, size=length, dtype=np.uint64) | np.uint64(1)
+        kh = self.keys.astype(np.uint64) @ weights
+        rh = rbms.astype(np.uint64) @ weights
+        lrbm = []
+        lkey = []
+        for masked in (m for d in range(k + 1) for m in combinations(range(length), d)):
+            masked = list(masked) # hash of the residues outside the masked positions
+            mkh = kh - self.keys[:, masked].astype(np.uint64) @ weights[masked]
+            mrh = rh - rbms[:, masked].astype(np.uint64) @ weights[masked]
+            order = np.argsort(mkh)
+            skh = mkh[order]
+            lo = np.searchsorted(skh, mrh, side='left')
+            hi = np.searchsorted(skh, mrh, side='right')
+            counts = hi - lo
+            rid = np.repeat(np.arange(len(rbms)), counts)
+            starts = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            lrbm.append(rid)
+            lkey.append(order[starts])
+        rid = np.concatenate(lrbm)
+        kid = np.concatenate(lkey)
+        pairs = np.unique(np.column_stack((rid, kid)), axis=0)
+        dist = (rbms[pairs[:, 0]] != self.keys[pairs[:, 1]]).sum(axis=1) # hash collisions are removed here
+        keep = dist <= k
+        return pairs[keep, 0], pairs[keep, 1], dist[keep]
+
+    def mismatches(self, rbm, key):
+        """Motif positions where an RBM and a key differ"""
+        return np.flatnonzero(rbm != self.keys[key])
+
+
+def read_rbms(filename, suffix_len=None):
+    """Distinct predicted RBMs (first 27 characters of each line, or their suffix)"""
+    rbms = []
+    with open(filename) as f:
+        for line in f:
+            rbm = line.split()[0][:27] if line.strip() else ''
+            if rbm:
+                rbms.append(rbm[-suffix_len:] if suffix_len else rbm)
+    return _unique_rows(_as_matrix(rbms))[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Find predicted RBMs within a given Hamming distance of GISAID sequences')
+    parser.add_argument('-r', '--rbms', required=True, help = 'Predicted RBMs (format : 27 residues motif | ...), e.g. ddg_mono385_betterdg_noCYS.txt')
+    parser.add_argument('-f', '--fasta', default='spike-1260.fasta2', help = 'GISAID spike sequences (fasta-2line) or window store directory (see windowstore.py)')
+    parser.add_argument('-w', '--window', default='380:515', help = 'Searched part of each sequence (python slice)')
+    parser.add_argument('-k', '--distance', type=int, default=1, help = 'Maximum Hamming distance')
+    parser.add_argument('-s', '--suffix', type=int, default=None, help = 'Only use the last residues of the motif (e.g. 18)')
+    parser.add_argument('-o', '--output', required=True, help = 'Output file (format : RBM | GISAID motif | distance | mismatch positions | record ids)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    window = multiscan.parse_window(args.window)
+    positions = motif_positions(args.suffix)
+    residue_numbers = FIRST_RESIDUE + np.array([i for i, c in enumerate(pattern) if c == 'X'])[-len(positions):]
+
+    profiler.start('index build')
+    index = MotifIndex(positions)
+    if windowstore.is_store(args.fasta): # distinct windows only
+        store = windowstore.WindowStore(args.fasta)
+        windows = store.windows(window)
+        for b in range(0, len(windows), BATCH):
+            index.add(windows[b:b+BATCH])
+        record_ids = store.record_ids
+    else:
+        ids = []
+        batch = []
+        for rid, description, seq in fastashard.read_records(args.fasta):
+            ids.append(rid)
+            batch.append(seq[window].decode())
+            if len(batch) == BATCH:
+                index.add(batch)
+                batch = []
+        if batch:
+            index.add(batch)
+        record_ids = lambda w: [ids[w]]
+    index.finalize()
+
+    profiler.start('search')
+    rbms = read_rbms(args.rbms, args.suffix)
+    rid, kid, dist = index.query(rbms, args.distance)
+    profiler.start('write')
+    order = np.lexsort((kid, dist, rid))
+    with open(args.output, 'w') as out:
+        for i in order:
+            rbm = rbms[rid[i]]
+            mism = ','.join(str(residue_numbers[p]) for p in index.mismatches(rbm, kid[i]))
+            records = ','.join(rec for w in index.windows_of(kid[i]) for rec in record_ids(w))
+            out.write(rbm.tobytes().decode()+'\t'+index.keys[kid[i]].tobytes().decode()+'\t'+str(dist[i])+'\t'+mism+'\t'+records+'\n')
+    print(str(len(np.unique(rid)))+' RBMs within distance '+str(args.distance)+' of '+str(len(np.unique(kid)))+' GISAID motifs')
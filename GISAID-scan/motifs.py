@@ -0,0 +1,157 @@
+"""In-memory generation of the motif pattern sets.
+
+The gapped motif mask (X: motif residue, '.': gap) ends at residue 505.
+Pattern sets are built from dense motifs (motif residues only, e.g. the
+last 18 residues of the predicted RBMs) without intermediate files:
+
+    gapped(dense, mask)         dense motifs placed on the mask (generate-patterns.py)
+    dense(patterns, mask)       gaps removed again (remove-gaps18.py)
+    wildcard(patterns, i)       position i replaced by '.' (sed s/././i+1 | sort | uniq)
+    wildcard_sets(patterns, m)  one wildcard set per motif position of the mask
+
+Duplicates are removed with hashing (unique). scan_sets() matches several
+sets in a single pass of multiscan.py, each pattern being scanned once even
+if it belongs to several sets.
+
+Usage:
+    python3 motifs.py -d last18 -s 18 --wildcard -f spike.windows -o wc18
+writes wc18.tsv (set | record id | pattern) with one set per wildcard
+residue number, e.g. the 18-500 ... 18-505 sets of the README.
+"""
+import argparse
+import os
+import sys
+from collections import defaultdict
+
+import fastashard
+import multiscan
+import windowstore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+pattern = "XX...........X...........................X.X.X...X.XX................X.XX.......X.XX.X...XXXX.X.XXXXXX"
+LAST_RESIDUE = 505
+
+
+def findnth(c, s):
+    """Index of the c-th X of s, counted from the end (None for the first character)"""
+    count = 0
+    for i in range(len(s)-1, 0, -1):
+        if s[i] == 'X': count += 1
+        if count == c:
+            return i
+
+
+def suffix_mask(suffix_len=None, mask=pattern):
+    """Part of the mask holding its last suffix_len motif positions"""
+    return mask[findnth(suffix_len, mask):] if suffix_len else mask
+
+
+def residue_number(i, mask=pattern):
+    """Residue number of position i of a mask ending at LAST_RESIDUE"""
+    return i + LAST_RESIDUE + 1 - len(mask)
+
+
+def motif_positions(mask=pattern):
+    return [i for i, c in enumerate(mask) if c == 'X']
+
+
+def unique(patterns):
+    """Patterns without duplicates, in first occurrence order"""
+    return list(dict.fromkeys(patterns))
+
+
+def gapped(motifs, mask=pattern):
+    """Dense motifs placed on the motif positions of mask, gaps as '.'"""
+    positions = motif_positions(mask)
+    out = []
+    for motif in motifs:
+        base = ['.'] * len(mask)
+        for i, c in zip(positions, motif[:len(positions)]):
+            base[i] = c
+        out.append(''.join(base))
+    return out
+
+
+def dense(patterns, mask=pattern):
+    """Residues at the motif positions of mask"""
+    positions = motif_positions(mask)
+    return [''.join(pat[i] for i in positions) for pat in patterns]
+
+
+def wildcard(patterns, i):
+    """Patterns with position i replaced by '.', without duplicates"""
+    return unique(pat[:i]+'.'+pat[i+1:] for pat in patterns)
+
+
+def wildcard_sets(patterns, mask=pattern, min_count=0):
+    """{residue number: wildcard set} for each motif position after the first min_count ones"""
+    return {residue_number(i, mask): wildcard(patterns, i) for i in motif_positions(mask)[min_count:]}
+
+
+def read_motifs(filename, suffix_len=None):
+    """Dense motifs (first word of each line, or its suffix_len last residues)"""
+    motifs = []
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                motif = line.split()[0]
+                motifs.append(motif[-suffix_len:] if suffix_len else motif)
+    return motifs
+
+
+def scan_sets(sets, fasta, window, jobs=1):
+    """Yields (set name, record id, pattern) for each hit of the named pattern sets, in one scan"""
+    patterns = unique(pat for pats in sets.values() for pat in pats)
+    owners = defaultdict(list) # sets of each distinct pattern
+    index = {pat: i for i, pat in enumerate(patterns)}
+    for name, pats in sets.items():
+        for pat in pats:
+            owners[index[pat]].append(name)
+    patset = multiscan.PatternSet(patterns)
+    if windowstore.is_store(fasta):
+        store = windowstore.WindowStore(fasta)
+        for w, ids in multiscan.scan_windows(store.windows(window), patset):
+            for rid in store.record_ids(w):
+                for i in ids:
+                    for name in owners[i]:
+                        yield name, rid, patterns[i]
+    else:
+        for (rid, description, seq), ids in multiscan.scan_fasta(fasta, patset, window, jobs):
+            for i in ids:
+                for name in owners[i]:
+                    yield name, rid, patterns[i]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate gapped or wildcard motif pattern sets and scan them against GISAID sequences')
+    parser.add_argument('-d', '--dense', required=True, help = 'Dense motifs (format : motif | ...), e.g. last18')
+    parser.add_argument('-s', '--suffix', type=int, default=18, help = 'Number of motif positions (last residues of the mask)')
+    parser.add_argument('--wildcard', action='store_true', help = 'One set per motif position, with that position replaced by a wildcard')
+    parser.add_argument('--min-count', type=int, default=0, help = 'Only make wildcard sets for the motif positions after the first min-count ones')
+    parser.add_argument('-f', '--fasta', default='spike-1260.fasta2', help = 'GISAID spike sequences (fasta-2line) or window store directory (see windowstore.py)')
+    parser.add_argument('-w', '--window', default='380:515', help = 'Searched part of each sequence (python slice)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help = 'Number of worker processes for FASTA files')
+    parser.add_argument('-o', '--output', required=True, help = 'Output prefix (.tsv : set | record id | pattern)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    profiler.start('parse')
+    mask = suffix_mask(args.suffix)
+    base = unique(gapped(read_motifs(args.dense, args.suffix), mask))
+    if args.wildcard:
+        sets = {str(args.suffix)+'-'+str(r): pats for r, pats in wildcard_sets(base, mask, args.min_count).items()}
+    else:
+        sets = {str(args.suffix): base}
+
+    profiler.start('search') # hits are written as they are found
+    nhits = defaultdict(int)
+    with open(args.output+'.tsv', 'w') as out:
+        for name, rid, pat in scan_sets(sets, args.fasta, multiscan.parse_window(args.window), args.jobs):
+            nhits[name] += 1
+            out.write(name+'\t'+rid+'\t'+pat+'\n')
+    profiler.stop()
+    for name, pats in sets.items():
+        print(name+'\t'+str(len(pats))+' patterns\t'+str(nhits[name])+' hits')
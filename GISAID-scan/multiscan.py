@@ -0,0 +1,249 @@
+"""Pattern-attributing scan of GISAID spike sequences.
+
+find-disjunct*.py compile all patterns into one disjunction, which only tells
+whether a record matched. Here all patterns are compiled into one pattern set
+that reports which patterns match each record, in a single pass.
+
+Patterns made of residues and '.' gaps (all patterns of this workflow) are
+grouped by gap mask: at each offset of the window, the residues at the
+non-gap positions of a group are hashed and looked up among the hashes of
+its patterns, for many records at once. Other regular expressions go through
+an RE2 set when available, or the re module.
+
+Usage:
+    python3 multiscan.py -p last18.pats -f spike-1260.fasta2 -w 450:520 -o last18
+writes last18.hits.tsv (record id | pattern index | pattern),
+last18.matched.pats (patterns with at least one hit) and, for FASTA input,
+last18.hits (matched records, fasta-2line). With a window store
+(windowstore.py) instead of a FASTA file, each distinct window is scanned
+once; the store has no full sequences, so no .hits file is written.
+FASTA files are read with fastashard.py; with -j, the file is split into
+record-aligned shards scanned by a pool of workers, in one read of the file.
+-j does not apply to window stores, which are scanned by a single process.
+With -c, results are cached (scancache.py): scanning a new release only scans
+the windows that were never scanned with the same patterns.
+"""
+import argparse
+import os
+import re
+import sys
+from collections import defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+
+import fastashard
+import windowstore
+from scancache import ScanCache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+SIMPLE_PATTERN = re.compile(r'^[A-Z.]+$')
+BATCH = 1 << 16
+SHARDS_PER_JOB = 4
+
+_shard_scan = None
+
+
+def read_patterns(filename):
+    with open(filename) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class PatternSet:
+    """Set of patterns compiled once, matched against batches of windows"""
+
+    def __init__(self, patterns, seed=0):
+        self.patterns = list(patterns)
+        self.groups = []
+        self.others = []
+        bymask = defaultdict(list)
+        for i, pat in enumerate(self.patterns):
+            if SIMPLE_PATTERN.match(pat) and pat.strip('.'):
+                mask = tuple(j for j, c in enumerate(pat) if c != '.')
+                bymask[(len(pat), mask)].append(i)
+            else:
+                self.others.append(i)
+        rng = np.random.default_rng(seed)
+        for (length, mask), ids in bymask.items():
+            positions = np.array(mask, dtype=np.int64)
+            literals = np.frombuffer(''.join(self.patterns[i][j] for i in ids for j in mask).encode(), dtype=np.uint8).reshape(len(ids), len(mask))
+            weights = rng.integers(1, 2**63, size=len(mask), dtype=np.uint64) | np.uint64(1)
+            hashes = literals.astype(np.uint64) @ weights
+            order = np.argsort(hashes, kind='stable')
+            self.groups.append((length, positions, weights, hashes[order], np.array(ids)[order], literals[order]))
+        self._regex = None
+        if self.others:
+            if re2 is not None and hasattr(re2, 'Set'):
+                self._regex = re2.Set.SearchSet(re2.Options())
+                for i in self.others:
+                    self._regex.Add(self.patterns[i])
+                self._regex.Compile()
+            else:
+                self._regex = [re.compile(self.patterns[i]) for i in self.others]
+
+    def scan(self, windows):
+        """Matches a list of window strings, returns (window index, pattern index) arrays"""
+        width = max((len(w) for w in windows), default=0)
+        lengths = np.array([len(w) for w in windows], dtype=np.int64)
+        mat = np.zeros((len(windows), width), dtype=np.uint8) # short windows are padded with 0, never matched
+        if len(windows):
+            mat[:] = np.frombuffer(b''.join(w.encode().ljust(width, b'\0') for w in windows), dtype=np.uint8).reshape(len(windows), width)
+        lwin = []
+        lpat = []
+        for length, positions, weights, hashes, ids, literals in self.groups:
+            for offset in range(width - length + 1):
+                sub = mat[:, offset + positions]
+                h = sub.astype(np.uint64) @ weights
+                lo = np.searchsorted(hashes, h)
+                found = np.flatnonzero((lo < len(hashes)) & (hashes[np.minimum(lo, len(hashes) - 1)] == h) & (lengths >= offset + length))
+                for w in found:
+                    k = lo[w]
+                    while k < len(hashes) and hashes[k] == h[w]: # same hash: check residues
+                        if np.array_equal(literals[k], sub[w]):
+                            lwin.append(w)
+                            lpat.append(ids[k])
+                        k += 1
+        if self._regex is not None:
+            for w, window in enumerate(windows):
+                for k in self._match_others(window):
+                    lwin.append(w)
+                    lpat.append(self.others[k])
+        if not lwin:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # one (window, pattern) pair even if the pattern matches at several offsets
+        pairs = np.unique(np.column_stack((lwin, lpat)).astype(np.int64), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def _match_others(self, window):
+        if isinstance(self._regex, list):
+            return [k for k, r in enumerate(self._regex) if r.search(window)]
+        return self._regex.Match(window) or []
+
+
+def parse_window(window):
+    """'450:520' -> slice(450, 520)"""
+    start, end = window.split(':')
+    return slice(int(start) if start else None, int(end) if end else None)
+
+
+def scan_windows(windows, patset, batch=BATCH, cache=None):
+    """Yields (window index, matched pattern indices) for each window with at least one hit.
+
+    With a ScanCache, windows already scanned with this pattern set are not scanned again.
+    """
+    buffer = []
+    start = 0
+    for w in windows:
+        buffer.append(w)
+        if len(buffer) == batch:
+            yield from _scan_batch(buffer, start, patset, cache)
+            start += len(buffer)
+            buffer = []
+    if buffer:
+        yield from _scan_batch(buffer, start, patset, cache)
+
+
+def _scan_batch(windows, start, patset, cache=None):
+    wins, pats = cache.scan(windows, patset) if cache else patset.scan(windows)
+    bounds = np.flatnonzero(np.diff(wins)) + 1
+    for ws, ps in zip(np.split(wins, bounds), np.split(pats, bounds)):
+        if len(ws):
+            yield start + ws[0], ps.tolist()
+
+
+def scan_records(records, patset, window, batch=BATCH, cache=None):
+    """Yields (record, matched pattern indices) for each record with at least one hit.
+
+    Records are (id, description, sequence bytes) tuples, as read by fastashard.
+    """
+    buffer = []
+    for r in records:
+        buffer.append(r)
+        if len(buffer) == batch:
+            for i, ids in scan_windows([b[2][window].decode() for b in buffer], patset, batch, cache):
+                yield buffer[i], ids
+            buffer = []
+    for i, ids in scan_windows([b[2][window].decode() for b in buffer], patset, batch, cache):
+        yield buffer[i], ids
+
+
+def _init_shard_scan(fasta, patset, window, batch, cache):
+    global _shard_scan
+    _shard_scan = (fasta, patset, window, batch, cache)
+
+
+def _scan_shard(bounds):
+    fasta, patset, window, batch, cache = _shard_scan
+    hits = list(scan_records(fastashard.read_shard(fasta, bounds), patset, window, batch, cache))
+    return hits, cache.pop_new() if cache else {}
+
+
+def scan_fasta(fasta, patset, window, jobs=1, batch=BATCH, cache=None):
+    """Yields (record, matched pattern indices) for each record with at least one hit, in file order.
+
+    With jobs > 1, record-aligned shards of the file are scanned by a pool of
+    workers (forked, they inherit the compiled pattern set and the cache).
+    """
+    if jobs <= 1:
+        yield from scan_records(fastashard.read_records(fasta), patset, window, batch, cache)
+        return
+    with Pool(jobs, initializer=_init_shard_scan, initargs=(fasta, patset, window, batch, cache)) as pool:
+        for hits, new in pool.imap(_scan_shard, fastashard.shards(fasta, jobs * SHARDS_PER_JOB)):
+            if cache:
+                cache.merge(new)
+            yield from hits
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Report which patterns match each GISAID record')
+    parser.add_argument('-p', '--patterns', required=True, help = 'Pattern file (one pattern per line)')
+    parser.add_argument('-f', '--fasta', default='spike-1260.fasta2', help = 'GISAID spike sequences (fasta-2line) or window store directory (see windowstore.py)')
+    parser.add_argument('-w', '--window', default='380:515', help = 'Searched part of each sequence (python slice, e.g. 450:520)')
+    parser.add_argument('-o', '--output', required=True, help = 'Output prefix (.hits.tsv, .matched.pats, and .hits fasta of the matched records for FASTA input)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help = 'Number of worker processes (FASTA input only, a window store is scanned by one process)')
+    parser.add_argument('-c', '--cache', default=None, help = 'Directory of cached scan results: windows already scanned with the same patterns are not scanned again')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    profiler.start('parse')
+    patterns = read_patterns(args.patterns)
+    patset = PatternSet(patterns)
+    window = parse_window(args.window)
+    cache = ScanCache(args.cache, patterns, window) if args.cache else None
+
+    profiler.start('search') # hits are written as they are found
+    matched = set()
+    nhits = 0
+    with open(args.output+'.hits.tsv', 'w') as out:
+        if windowstore.is_store(args.fasta):
+            # each distinct window is scanned once, hits are reported for all its records
+            store = windowstore.WindowStore(args.fasta)
+            for w, ids in scan_windows(store.windows(window), patset, cache=cache):
+                matched.update(ids)
+                for rid in store.record_ids(w):
+                    nhits += 1
+                    for i in ids:
+                        out.write(rid+'\t'+str(i)+'\t'+patterns[i]+'\n')
+        else:
+            with open(args.output+'.hits', 'w') as fasta_out: # fasta-2line
+                for (rid, description, seq), ids in scan_fasta(args.fasta, patset, window, args.jobs, cache=cache):
+                    nhits += 1
+                    matched.update(ids)
+                    fasta_out.write('>'+description+'\n'+seq.decode()+'\n')
+                    for i in ids:
+                        out.write(rid+'\t'+str(i)+'\t'+patterns[i]+'\n')
+    with open(args.output+'.matched.pats', 'w') as out:
+        for i in sorted(matched):
+            out.write(patterns[i]+'\n')
+    print(str(nhits)+' records matched by '+str(len(matched))+' patterns')
+    if cache:
+        cache.save()
+        print(str(cache.nscanned)+' new windows scanned, results cached in '+cache.file)
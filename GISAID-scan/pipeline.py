@@ -0,0 +1,308 @@
+"""Resumable runner of the GISAID search workflow (replaces the shell steps of Readme.txt).
+
+Stages, and the Readme.txt steps they replace:
+
+    filter      window store of the complete sequences of the release (filter1260.py, windowstore.py)
+    patterns    last 18 residues of the RBMs, gapped (cut | sort | uniq, generate-patterns.py)
+    scan        patterns with GISAID hits (split, find-disjunct.py, iter2, iter3)
+    refine-A    RBMs matching on their last 18 residues, scanned with a
+                wildcard on each of their 9 first positions (category A)
+    refine-B    last 18 patterns with a wildcard on each position (category B)
+    collect     summary of the hits of every set, final files
+
+Each stage writes its outputs in a directory of the cache named after a hash
+of its parameters, of the contents of its input files and of the hashes of
+the stages it depends on. Stages whose directory exists are skipped, so a
+run that failed (or a run with new parameters) only runs the stages that
+are missing. A stage is written in a temporary directory renamed once it is
+complete; the temporary directories of killed runs are removed by the next
+run. Stages whose inputs are ready run concurrently, in separate
+processes, as long as the cores they use stay within the budget (-j).
+
+Usage:
+    python3 pipeline.py -i spikeprot0125.fasta -r ddg_mono385_betterdg_noCYS.txt -c pipeline-cache -o results -j 48
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import defaultdict
+from multiprocessing.connection import wait
+
+import motifs
+import multiscan
+import windowstore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+VERSION = 1 # to be increased when the outputs of a stage change
+SUFFIX = 18
+SCAN_WINDOW = '450:520' # find-disjunct.py
+REFINE_WINDOW = '380:515' # find-disjunctA.py, find-disjunctB-*.py
+
+
+class Stage:
+    """A named step: run(outdir, inputs, params, jobs), inputs being the output directories of the stages it depends on.
+
+    files are named input files, given to run with the params but hashed by content (not by path).
+    """
+
+    def __init__(self, name, run, inputs=(), params=None, files=None, jobs=1):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.params = params or {}
+        self.files = files or {}
+        self.jobs = jobs
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        f.writelines(line+'\n' for line in lines)
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_set_hits(path, sets, store_path, window):
+    """Scans named pattern sets (motifs.scan_sets), writes set | record id | pattern"""
+    with open(path, 'w') as out:
+        for name, rid, pat in motifs.scan_sets(sets, store_path, multiscan.parse_window(window)):
+            out.write(name+'\t'+rid+'\t'+pat+'\n')
+
+
+def run_filter(outdir, inputs, params, jobs):
+    windowstore.ingest(params['release'], os.path.join(outdir, 'spike.windows'), params['min_length'], jobs=jobs)
+
+
+def run_patterns(outdir, inputs, params, jobs):
+    last = sorted(set(motifs.read_motifs(params['rbms'], SUFFIX)))
+    write_lines(os.path.join(outdir, 'last18'), last)
+    write_lines(os.path.join(outdir, 'last18.pats'), motifs.unique(motifs.gapped(last, motifs.suffix_mask(SUFFIX))))
+
+
+def run_scan(outdir, inputs, params, jobs):
+    patterns = read_lines(os.path.join(inputs['patterns'], 'last18.pats'))
+    store = windowstore.WindowStore(os.path.join(inputs['filter'], 'spike.windows'))
+    matched = set()
+    with open(os.path.join(outdir, 'last18.hits.tsv'), 'w') as out:
+        for w, ids in multiscan.scan_windows(store.windows(multiscan.parse_window(params['window'])), multiscan.PatternSet(patterns)):
+            matched.update(ids)
+            for rid in store.record_ids(w):
+                for i in ids:
+                    out.write(rid+'\t'+str(i)+'\t'+patterns[i]+'\n')
+    write_lines(os.path.join(outdir, 'last18-match'), [patterns[i] for i in sorted(matched)])
+
+
+def run_refine_a(outdir, inputs, params, jobs):
+    matched = set(motifs.dense(read_lines(os.path.join(inputs['scan'], 'last18-match')), motifs.suffix_mask(SUFFIX)))
+    rbms = motifs.unique(m[:27] for m in motifs.read_motifs(params['rbms']) if m[:27][-SUFFIX:] in matched)
+    write_lines(os.path.join(outdir, 'last18-matches'), rbms)
+    full = motifs.unique(motifs.gapped(rbms))
+    sets = {'A-'+str(motifs.residue_number(i)): motifs.wildcard(full, i) for i in motifs.motif_positions()[:27 - SUFFIX]}
+    write_set_hits(os.path.join(outdir, 'A.tsv'), sets, os.path.join(inputs['filter'], 'spike.windows'), params['window'])
+
+
+def run_refine_b(outdir, inputs, params, jobs):
+    patterns = read_lines(os.path.join(inputs['patterns'], 'last18.pats'))
+    sets = {str(SUFFIX)+'-'+str(r): pats for r, pats in motifs.wildcard_sets(patterns, motifs.suffix_mask(SUFFIX)).items()}
+    write_set_hits(os.path.join(outdir, 'B.tsv'), sets, os.path.join(inputs['filter'], 'spike.windows'), params['window'])
+
+
+def run_collect(outdir, inputs, params, jobs):
+    for stage, name in [('scan', 'last18-match'), ('scan', 'last18.hits.tsv'), ('refine-A', 'last18-matches'), ('refine-A', 'A.tsv'), ('refine-B', 'B.tsv')]:
+        shutil.copy(os.path.join(inputs[stage], name), os.path.join(outdir, name))
+    patterns = defaultdict(set)
+    records = defaultdict(set)
+    with open(os.path.join(inputs['scan'], 'last18.hits.tsv')) as f:
+        for line in f:
+            rid, i, pat = line.rstrip('\n').split('\t')
+            patterns['last18'].add(pat)
+            records['last18'].add(rid)
+    for name in ('A.tsv', 'B.tsv'):
+        with open(os.path.join(outdir, name)) as f:
+            for line in f:
+                s, rid, pat = line.rstrip('\n').split('\t')
+                patterns[s].add(pat)
+                records[s].add(rid)
+    with open(os.path.join(outdir, 'summary.tsv'), 'w') as out:
+        out.write('set\tpatterns with hits\trecords\n')
+        for s in sorted(patterns):
+            out.write(s+'\t'+str(len(patterns[s]))+'\t'+str(len(records[s]))+'\n')
+
+
+def workflow(release, rbms, min_length=windowstore.MIN_LENGTH, jobs=1):
+    """The stages of the GISAID search, in dependency order"""
+    return [
+        Stage('filter', run_filter, params={'min_length': min_length}, files={'release': os.path.abspath(release)}, jobs=jobs),
+        Stage('patterns', run_patterns, files={'rbms': os.path.abspath(rbms)}),
+        Stage('scan', run_scan, ['filter', 'patterns'], {'window': SCAN_WINDOW}),
+        Stage('refine-A', run_refine_a, ['filter', 'scan'], {'window': REFINE_WINDOW}, files={'rbms': os.path.abspath(rbms)}),
+        Stage('refine-B', run_refine_b, ['filter', 'patterns'], {'window': REFINE_WINDOW}),
+        Stage('collect', run_collect, ['scan', 'refine-A', 'refine-B']),
+    ]
+
+
+def file_digest(path, cachedir):
+    """sha1 of a file content, remembered in the cache while the file size and modification time do not change"""
+    memo_file = os.path.join(cachedir, 'digests.json')
+    memo = {}
+    if os.path.isfile(memo_file):
+        with open(memo_file) as f:
+            memo = json.load(f)
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    if key in memo and memo[key][:2] == [st.st_size, st.st_mtime_ns]:
+        return memo[key][2]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            h.update(block)
+    memo[key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    with open(memo_file+'.tmp', 'w') as f:
+        json.dump(memo, f, indent=1)
+    os.replace(memo_file+'.tmp', memo_file)
+    return h.hexdigest()
+
+
+def stage_keys(stages, cachedir):
+    """Hash of each stage: version, name, parameters, input file contents and hashes of the stages it depends on"""
+    keys = {}
+    for stage in stages:
+        h = hashlib.sha1((str(VERSION)+stage.name).encode())
+        h.update(json.dumps(stage.params, sort_keys=True).encode())
+        for name, path in sorted(stage.files.items()):
+            h.update((name+file_digest(path, cachedir)).encode())
+        for name in stage.inputs:
+            h.update(keys[name].encode())
+        keys[stage.name] = h.hexdigest()[:16]
+    return keys
+
+
+def stage_dir(cachedir, name, key):
+    return os.path.join(cachedir, name+'-'+key)
+
+
+def remove_stale(cachedir):
+    """Removes the temporary stage directories left by runs that were killed"""
+    for name in os.listdir(cachedir):
+        stem, sep, pid = name.rpartition('.tmp-')
+        if not sep or not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError: # not a running stage of another run
+            shutil.rmtree(os.path.join(cachedir, name), ignore_errors=True)
+            print('removed '+name, flush=True)
+        except PermissionError:
+            pass
+
+
+def _run_stage(stage, outdir, inputs, jobs):
+    """Runs a stage in a temporary directory, renamed to outdir when complete (child process)"""
+    tmp = outdir+'.tmp-'+str(os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    start = time.time()
+    try:
+        stage.run(tmp, inputs, dict(stage.params, **stage.files), jobs)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    with open(os.path.join(tmp, 'stage.json'), 'w') as f:
+        json.dump({'stage': stage.name, 'params': stage.params, 'files': stage.files, 'inputs': inputs, 'seconds': time.time() - start}, f, indent=1)
+    os.replace(tmp, outdir)
+
+
+def run(stages, cachedir, cores=1, force=(), dry_run=False):
+    """Runs the stages missing from the cache within a budget of cores, returns the output directory of each stage.
+
+    force lists stages to run again (with the stages depending on them).
+    On failure, running stages are completed (and cached) before raising.
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    keys = stage_keys(stages, cachedir)
+    dirs = {s.name: stage_dir(cachedir, s.name, keys[s.name]) for s in stages}
+    done = set()
+    for s in stages:
+        if os.path.isdir(dirs[s.name]) and s.name not in force and all(i in done for i in s.inputs):
+            done.add(s.name)
+            print('cached  '+s.name.ljust(10)+dirs[s.name], flush=True)
+    pending = [s for s in stages if s.name not in done]
+    if dry_run:
+        for s in pending:
+            print('to run  '+s.name.ljust(10)+dirs[s.name])
+        return dirs
+    remove_stale(cachedir)
+    for s in pending:
+        shutil.rmtree(dirs[s.name], ignore_errors=True) # forced stages
+    ctx = multiprocessing.get_context('fork') # stages may start their own pools
+    running = {}
+    free = cores
+    failed = []
+    while pending or running:
+        for s in list(pending):
+            used = min(s.jobs, cores)
+            if not failed and all(i in done for i in s.inputs) and (used <= free or not running):
+                proc = ctx.Process(target=_run_stage, args=(s, dirs[s.name], {i: dirs[i] for i in s.inputs}, used), name=s.name)
+                proc.start()
+                running[proc.sentinel] = (proc, s, used, time.time())
+                free -= used
+                pending.remove(s)
+                print('start   '+s.name.ljust(10)+str(used)+' core(s)', flush=True)
+        if not running:
+            break
+        for sentinel in wait(list(running)):
+            proc, s, used, start = running.pop(sentinel)
+            proc.join()
+            free += used
+            if proc.exitcode == 0:
+                done.add(s.name)
+                print('done    '+s.name.ljust(10)+'%.1f s  ' % (time.time() - start)+dirs[s.name], flush=True)
+            else:
+                failed.append(s.name)
+                print('FAILED  '+s.name.ljust(10)+'exit code '+str(proc.exitcode), flush=True)
+    if failed:
+        raise RuntimeError('stages failed: '+', '.join(failed)+' (completed stages are cached, run again to resume)')
+    return dirs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run the GISAID search stages, reusing the cached ones')
+    parser.add_argument('-i', '--input', required=True, help = 'GISAID spike release (FASTA), e.g. spikeprot0125.fasta')
+    parser.add_argument('-r', '--rbms', required=True, help = 'Predicted RBMs (format : 27 residues motif | ...), e.g. ddg_mono385_betterdg_noCYS.txt')
+    parser.add_argument('-c', '--cache', default='pipeline-cache', help = 'Cache directory (one sub-directory per stage and hash)')
+    parser.add_argument('-o', '--output', default=None, help = 'Directory receiving the collected results')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help = 'Number of cores shared by the running stages')
+    parser.add_argument('-l', '--min-length', type=int, default=windowstore.MIN_LENGTH, help = 'Minimal length of kept sequences')
+    parser.add_argument('-f', '--force', default='', help = 'Comma separated stages to run again')
+    parser.add_argument('-n', '--dry-run', action='store_true', help = 'Only list the cached stages and the stages to run')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+    for option, path in (('-i/--input', args.input), ('-r/--rbms', args.rbms)):
+        if not os.path.isfile(path):
+            parser.error(option+': no such file: '+path)
+
+    with profiler.stage('input hashes'):
+        stages = workflow(args.input, args.rbms, args.min_length, args.jobs)
+    force = set(args.force.split(',')) - {''}
+    unknown = force - {s.name for s in stages}
+    if unknown:
+        parser.error('unknown stages: '+', '.join(sorted(unknown)))
+    try:
+        with profiler.stage('stages'): # run in child processes, see children_max_rss_mb
+            dirs = run(stages, args.cache, args.jobs, force, args.dry_run)
+    except RuntimeError as e:
+        parser.exit(1, str(e)+'\n')
+    if args.output and not args.dry_run:
+        with profiler.stage('collect'):
+            shutil.copytree(dirs['collect'], args.output, dirs_exist_ok=True)
+        print('results in '+args.output)
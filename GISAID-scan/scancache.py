@@ -0,0 +1,98 @@
+"""Persistent results of pattern scans, for incremental re-scans of new releases.
+
+Results are kept per pattern set fingerprint (patterns and scanned window):
+the digests of all the windows already scanned, and the patterns matching
+each of them. Scanning a new release then only scans the windows never seen
+before, and takes the hits of the others from the cache.
+
+    cachedir/<fingerprint>.npz    seen window digests, hit digests and patterns
+    cachedir/<fingerprint>.pats   the pattern set (for reference)
+"""
+import hashlib
+import os
+
+import numpy as np
+
+DIGEST_SIZE = 16
+
+
+def fingerprint(patterns, window):
+    h = hashlib.sha1((str(window.start)+':'+str(window.stop)+'\n').encode())
+    for pat in patterns:
+        h.update(pat.encode()+b'\n')
+    return h.hexdigest()
+
+
+def window_digest(window):
+    return hashlib.blake2b(window.encode(), digest_size=DIGEST_SIZE).digest()
+
+
+class ScanCache:
+    """Scan results of one pattern set, loaded from and saved to cachedir"""
+
+    def __init__(self, cachedir, patterns, window):
+        self.patterns = list(patterns)
+        self.key = fingerprint(self.patterns, window)
+        self.file = os.path.join(cachedir, self.key+'.npz')
+        os.makedirs(cachedir, exist_ok=True)
+        self.seen = set()
+        self.hits = {}
+        self.new = {} # windows scanned since loading, with their hits
+        self.nscanned = 0
+        if os.path.isfile(self.file):
+            with np.load(self.file) as data:
+                self.seen = set(bytes(d) for d in data['seen'])
+                for d, p in zip(data['hit_window'], data['hit_pattern']):
+                    self.hits.setdefault(bytes(d), []).append(int(p))
+        else:
+            with open(os.path.join(cachedir, self.key+'.pats'), 'w') as f:
+                f.write(''.join(pat+'\n' for pat in self.patterns))
+
+    def scan(self, windows, patset):
+        """Same as patset.scan, but only windows not in the cache are scanned"""
+        digests = [window_digest(w) for w in windows]
+        new = {}
+        for i, d in enumerate(digests):
+            if d not in self.seen and d not in new:
+                new[d] = i
+        if new:
+            first = list(new.values())
+            wins, pats = patset.scan([windows[i] for i in first])
+            for d in new:
+                self.new[d] = []
+            for w, p in zip(wins.tolist(), pats.tolist()):
+                self.hits.setdefault(digests[first[w]], []).append(p)
+                self.new[digests[first[w]]].append(p)
+            self.seen.update(new)
+            self.nscanned += len(new)
+        lwin = []
+        lpat = []
+        for i, d in enumerate(digests):
+            for p in self.hits.get(d, ()):
+                lwin.append(i)
+                lpat.append(p)
+        return np.array(lwin, dtype=np.int64), np.array(lpat, dtype=np.int64)
+
+    def pop_new(self):
+        """Windows scanned since the last call and their hits (to send them from a worker)"""
+        new = self.new
+        self.new = {}
+        return new
+
+    def merge(self, new):
+        """Adds the windows scanned by a worker"""
+        for d, pats in new.items():
+            if d not in self.seen:
+                self.seen.add(d)
+                self.nscanned += 1
+                if pats:
+                    self.hits[d] = pats
+
+    def save(self):
+        def digests(ds):
+            return np.frombuffer(b''.join(ds), dtype=np.uint8).reshape(len(ds), DIGEST_SIZE)
+        hit_window = [d for d, ps in self.hits.items() for p in ps]
+        hit_pattern = [p for d, ps in self.hits.items() for p in ps]
+        tmp = self.file+'.tmp.npz'
+        np.savez(tmp, seen=digests(list(self.seen)), hit_window=digests(hit_window), hit_pattern=np.array(hit_pattern, dtype=np.int64))
+        os.replace(tmp, self.file)
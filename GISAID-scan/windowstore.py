@@ -0,0 +1,150 @@
+"""Deduplicated store of the RBD windows of a GISAID spike release.
+
+Most GISAID spike sequences are identical in the RBD region. Ingestion
+streams the release once, keeps complete sequences (length >= 1260, as
+filter1260.py) and stores each distinct window (residues 380 to 520 by
+default, covering the [380:515] and [450:520] scan windows) only once, with
+its number of occurrences and the ids of the records where it occurs.
+
+A store is a directory holding:
+
+    windows.npy          uint8 M x W matrix of distinct windows (0 padded)
+    lengths.npy          length of each window
+    counts.npy           number of records of each window
+    records.txt          id of each kept record, in release order
+    record_window.npy    window of each kept record
+    meta.json            window bounds, minimal length, source file
+
+Usage:
+    python3 windowstore.py -i spikeprot0125.fasta -o spike.windows
+"""
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+
+import fastashard
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+MIN_LENGTH = 1260
+START = 380
+END = 520
+SHARDS_PER_JOB = 4
+
+
+def _ingest_shard(args):
+    """Distinct windows of one shard: (record ids, windows, window of each record)"""
+    fasta, bounds, min_length, start, end = args
+    index = {}
+    ids = []
+    record_window = []
+    for rid, description, seq in fastashard.read_shard(fasta, bounds):
+        if len(seq) < min_length:
+            continue
+        record_window.append(index.setdefault(seq[start:end].decode(), len(index)))
+        ids.append(rid)
+    return ids, list(index), np.array(record_window, dtype=np.int64)
+
+
+def ingest(fasta, outdir, min_length=MIN_LENGTH, start=START, end=END, jobs=1):
+    """Streams a spike release into a window store, returns the store.
+
+    With jobs > 1, record-aligned shards of the release are read by a pool of
+    workers and their windows are merged in file order.
+    """
+    index = {}
+    record_window = []
+    tasks = [(fasta, bounds, min_length, start, end) for bounds in fastashard.shards(fasta, max(jobs, 1) * SHARDS_PER_JOB)]
+    pool = Pool(jobs) if jobs > 1 else None
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, 'records.txt'), 'w') as out:
+        for ids, windows, shard_window in (pool.imap(_ingest_shard, tasks) if pool else map(_ingest_shard, tasks)):
+            remap = np.array([index.setdefault(w, len(index)) for w in windows], dtype=np.int64)
+            record_window.append(remap[shard_window])
+            out.write(''.join(rid+'\n' for rid in ids))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    record_window = np.concatenate(record_window) if record_window else np.zeros(0, dtype=np.int64)
+    save(outdir, list(index), record_window,
+         {'start': start, 'end': end, 'min_length': min_length, 'source': os.path.abspath(fasta)})
+    return WindowStore(outdir)
+
+
+def save(outdir, windows, record_window, meta):
+    width = meta['end'] - meta['start']
+    mat = np.zeros((len(windows), width), dtype=np.uint8)
+    if windows:
+        mat[:] = np.frombuffer(b''.join(w.encode().ljust(width, b'\0') for w in windows), dtype=np.uint8).reshape(len(windows), width)
+    np.save(os.path.join(outdir, 'windows.npy'), mat)
+    np.save(os.path.join(outdir, 'lengths.npy'), np.array([len(w) for w in windows], dtype=np.int64))
+    np.save(os.path.join(outdir, 'counts.npy'), np.bincount(record_window, minlength=len(windows)))
+    np.save(os.path.join(outdir, 'record_window.npy'), record_window)
+    meta = dict(meta, nwindows=len(windows), nrecords=len(record_window))
+    with open(os.path.join(outdir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, 'windows.npy'))
+
+
+class WindowStore:
+    """Read access to a window store"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.matrix = np.load(os.path.join(path, 'windows.npy'), mmap_mode='r')
+        self.lengths = np.load(os.path.join(path, 'lengths.npy'))
+        self.counts = np.load(os.path.join(path, 'counts.npy'))
+        self.record_window = np.load(os.path.join(path, 'record_window.npy'), mmap_mode='r')
+        self._ids = None
+        self._order = None
+        self._bounds = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def windows(self, window=None):
+        """Distinct windows as strings, restricted to window (a slice in spike coordinates, open ends are the stored ones)"""
+        start, end = self.meta['start'], self.meta['end']
+        if window is None:
+            window = slice(start, end)
+        window = slice(start if window.start is None else window.start, end if window.stop is None else window.stop)
+        if window.start < start or window.stop > end:
+            raise ValueError('window '+str(window.start)+':'+str(window.stop)+' is not within the stored window '+str(start)+':'+str(end))
+        a, b = window.start - start, window.stop - start
+        return [row[a:min(b, n)].tobytes().decode() for row, n in zip(self.matrix, self.lengths)]
+
+    def record_ids(self, w):
+        """Ids of the records having window w"""
+        if self._order is None:
+            with open(os.path.join(self.path, 'records.txt')) as f:
+                self._ids = f.read().splitlines()
+            self._order = np.argsort(self.record_window, kind='stable')
+            self._bounds = np.searchsorted(self.record_window[self._order], np.arange(len(self) + 1))
+        return [self._ids[i] for i in self._order[self._bounds[w]:self._bounds[w+1]]]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Store the distinct RBD windows of a GISAID spike release')
+    parser.add_argument('-i', '--input', required=True, help = 'GISAID spike release (FASTA), e.g. spikeprot0125.fasta')
+    parser.add_argument('-o', '--output', required=True, help = 'Output store directory')
+    parser.add_argument('-l', '--min-length', type=int, default=MIN_LENGTH, help = 'Minimal length of kept sequences')
+    parser.add_argument('-w', '--window', default=str(START)+':'+str(END), help = 'Stored part of each sequence (python slice)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help = 'Number of worker processes')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    start, end = args.window.split(':')
+    profiler.start('parse')
+    store = ingest(args.input, args.output, args.min_length, int(start), int(end), args.jobs)
+    print(str(store.meta['nrecords'])+' records, '+str(len(store))+' distinct windows')
@@ -0,0 +1,138 @@
+"""Load test of the landscape query service (scripts/landscape_server.py).
+
+The service is started on the synthetic inputs of run.py (store and graph
+built by the seqstore and neighbors cases, made here if missing), or an
+already running one is used (-u). Client threads, each with its own
+connection, then send batches of random queries of each operation, and
+the throughput and request latency percentiles are reported per operation:
+
+    python3 loadtest.py -s small -t 8 -n 500 -b 16 -o load.json
+
+Path queries join random pairs of sequences: without a distance limit (-l)
+each one explores the whole graph, which is the worst case of the service.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+import run as bench
+
+sys.path.insert(0, bench.SCRIPTS)
+from landscape_client import Client
+
+OPS = ['lookup', 'sequence', 'neighbors', 'community', 'path', 'hamming']
+
+
+def start_server(datadir, communities=None):
+    """Starts the service on the inputs of datadir, returns (process, url)"""
+    work = lambda name: os.path.join(datadir, 'work', name)
+    os.makedirs(work(''), exist_ok=True)
+    py = sys.executable
+    if not os.path.isdir(work('enum.store')):
+        subprocess.run([py, os.path.join(bench.SCRIPTS, 'seqstore.py'), '-i', os.path.join(datadir, 'enum.txt'), '-o', work('enum.store')], check=True, stdout=subprocess.DEVNULL)
+    if not os.path.isdir(work('enum.graph')):
+        subprocess.run([py, os.path.join(bench.SCRIPTS, 'neighbors.py'), '-s', work('enum.store'), '-o', work('enum.graph')], check=True, stdout=subprocess.DEVNULL)
+    command = [py, os.path.join(bench.SCRIPTS, 'landscape_server.py'), '-s', work('enum.store'), '-g', work('enum.graph'),
+               '-m', os.path.join(datadir, 'a2a.energy'), '-p', '0'] + (['-c', communities] if communities else [])
+    proc = subprocess.Popen(command, cwd=bench.SCRIPTS, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline() # 'loaded in ... s, serving on URL'
+    if not line:
+        raise RuntimeError('the service did not start: '+' '.join(command))
+    return proc, line.split()[-1]
+
+
+def make_query(op, rng, n, sequences, k, limit=None):
+    """One random query of op"""
+    if op == 'lookup':
+        return {'op': op, 'sequence': sequences[rng.integers(len(sequences))]}
+    if op == 'hamming':
+        return {'op': op, 'sequence': sequences[rng.integers(len(sequences))], 'k': k}
+    if op == 'path':
+        query = {'op': op, 'id': int(rng.integers(n)), 'target': int(rng.integers(n))}
+        if limit is not None:
+            query['limit'] = limit
+        return query
+    return {'op': op, 'id': int(rng.integers(n))}
+
+
+def client_loop(url, op, requests, batch, n, sequences, k, limit, seed, latencies, errors):
+    rng = np.random.default_rng(seed)
+    client = Client(url)
+    for _ in range(requests):
+        queries = [make_query(op, rng, n, sequences, k, limit) for _ in range(batch)]
+        start = time.perf_counter()
+        results = client.query(queries)
+        latencies.append(time.perf_counter() - start)
+        errors.append(sum('error' in r for r in results))
+    client.close()
+
+
+def load(url, ops, threads, requests, batch, k=2, limit=None, seed=0):
+    """Per operation: requests, queries per second and request latency percentiles (ms)"""
+    client = Client(url)
+    info = client.info()
+    n = info['sequences']
+    rng = np.random.default_rng(seed)
+    sequences = [r['sequence'] for r in client.sequences(rng.integers(n, size=min(n, 1000)))]
+    client.close()
+    results = {}
+    for op in ops:
+        if op == 'community' and info['communities'] is None or op in ('neighbors', 'path') and info['edges'] is None:
+            print(op.ljust(10)+'  skipped (not loaded by the service)')
+            continue
+        latencies, errors = [], []
+        workers = [threading.Thread(target=client_loop, args=(url, op, requests, batch, n, sequences, k, limit, seed + t, latencies, errors))
+                   for t in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        seconds = time.perf_counter() - start
+        ms = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        results[op] = {'requests': len(ms), 'queries': len(ms) * batch, 'errors': int(sum(errors)), 'seconds': seconds,
+                       'qps': len(ms) * batch / seconds, 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+        print(op.ljust(10)+'%10.0f q/s %9.2f %9.2f %9.2f ms' % (results[op]['qps'], p50, p95, p99)
+              + ('  '+str(results[op]['errors'])+' errors' if results[op]['errors'] else ''), flush=True)
+    return info, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Load test of the landscape query service')
+    parser.add_argument('-u', '--url', default=None, help = 'URL of a running service (default : start one on the synthetic inputs)')
+    parser.add_argument('-s', '--size', choices=list(bench.SIZES), default='small', help = 'Input sizes of the started service')
+    parser.add_argument('-d', '--data', default=os.path.join(bench.HERE, 'data'), help = 'Directory of the generated inputs (one sub-directory per size)')
+    parser.add_argument('-c', '--communities', default=None, help = 'Community file given to the started service (see landscape_server.py -c)')
+    parser.add_argument('-t', '--threads', type=int, default=4, help = 'Number of concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, default=200, help = 'Requests per client and operation')
+    parser.add_argument('-b', '--batch', type=int, default=16, help = 'Queries per request')
+    parser.add_argument('-k', type=int, default=2, help = 'Distance of the Hamming ball queries')
+    parser.add_argument('-l', '--limit', type=float, default=None, help = 'Distance limit of the path queries (default : none, each one searches the whole graph)')
+    parser.add_argument('--ops', default=','.join(OPS), help = 'Comma separated operations to test')
+    parser.add_argument('-o', '--output', default=None, help = 'Results file (JSON)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    proc, url = None, args.url
+    if url is None:
+        datadir = os.path.join(args.data, args.size)
+        bench.generate(datadir, bench.SIZES[args.size], args.seed)
+        proc, url = start_server(datadir, args.communities)
+    try:
+        print('op'.ljust(10)+'throughput'.rjust(14)+'p50'.rjust(10)+'p95'.rjust(10)+'p99'.rjust(10))
+        info, results = load(url, args.ops.split(','), args.threads, args.requests, args.batch, args.k, args.limit, args.seed)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    if args.output:
+        report = {'environment': bench.environment(), 'service': info, 'threads': args.threads, 'batch': args.batch, 'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
@@ -0,0 +1,199 @@
+"""Benchmarks of the pipeline stages on synthetic data.
+
+Each case runs one script of the repository as a child process, on inputs
+made by synthetic.py (generated once per size in the data directory). Wall
+time and peak resident memory (largest process, workers included) are
+measured with wait4, and saved as JSON with the environment, so that runs
+can be compared:
+
+    python3 run.py -s small -o before.json
+    python3 run.py -s small -o after.json
+    python3 run.py --compare before.json after.json
+
+Cases: seqstore (enumeration to store), neighbors (graph), landscape (local
+optima and basins), dijkstra (shortest_mutpaths.py path sweep), leiden
+(load and partition, sweep mode with a single run), windowstore,
+gisaid_scan (multiscan.py), hamming (hamming_index.py) and clustermap
+(t-SNE embedding).
+"""
+import argparse
+import datetime
+import glob
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import synthetic
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+SCRIPTS = os.path.join(ROOT, 'scripts')
+COMMUNITIES = os.path.join(ROOT, 'sequence-community-graph')
+GISAID = os.path.join(ROOT, 'GISAID-scan')
+
+SIZES = {
+    'small': {'sequences': 20000, 'records': 20000, 'variants': 1000, 'rbms': 500, 'local_optima': 1000},
+    'medium': {'sequences': 500000, 'records': 500000, 'variants': 10000, 'rbms': 5000, 'local_optima': 5000},
+    'large': {'sequences': 4500000, 'records': 5000000, 'variants': 100000, 'rbms': 50000, 'local_optima': 30000},
+}
+
+# modules imported by the scripts of some cases, which are skipped without them
+REQUIRES = {
+    'leiden': ['igraph', 'leidenalg', 'matplotlib'],
+    'clustermap': ['igraph', 'leidenalg', 'matplotlib', 'sklearn'],
+}
+
+
+def missing_modules(name):
+    return [m for m in REQUIRES.get(name, []) if importlib.util.find_spec(m) is None]
+
+
+def generate(datadir, sizes, seed=0):
+    """Synthetic inputs of the given sizes, generated once in datadir"""
+    os.makedirs(datadir, exist_ok=True)
+    def path(name):
+        return os.path.join(datadir, name)
+    steps = [
+        ('enum.txt', lambda: synthetic.enumeration(path('enum.txt'), sizes['sequences'], seed=seed)),
+        ('a2a.energy', lambda: synthetic.a2a(path('a2a.energy'), path('a2a.proba'), seed)),
+        ('leiden.edges', lambda: synthetic.leiden(path('leiden'), path('enum.txt'), seed=seed)),
+        ('paths.starts', lambda: synthetic.pathpoints(path('paths'), sizes['sequences'], seed=seed)),
+        ('spike.fasta2', lambda: synthetic.spike(path('spike.fasta2'), sizes['records'], sizes['variants'], seed=seed)),
+        ('rbms.txt', lambda: synthetic.rbms(path('rbms.txt'), sizes['rbms'], sizes['variants'], seed=seed)),
+        ('last18.pats', lambda: synthetic.patterns(path('last18.pats'), path('rbms.txt'))),
+        ('cm.lon', lambda: synthetic.clustermap(path('cm'), sizes['local_optima'], seed=seed)),
+    ]
+    for name, make in steps:
+        if not os.path.exists(path(name)):
+            print('generating '+name, flush=True)
+            make()
+
+
+def cases(datadir, workdir, jobs, knn):
+    """(name, command, cwd, paths (glob patterns) removed before each run)"""
+    py = sys.executable
+    data = lambda name: os.path.join(datadir, name)
+    work = lambda name: os.path.join(workdir, name)
+    return [
+        ('seqstore', [py, os.path.join(SCRIPTS, 'seqstore.py'), '-i', data('enum.txt'), '-o', work('enum.store')], workdir,
+         [work('enum.store')]),
+        ('neighbors', [py, os.path.join(SCRIPTS, 'neighbors.py'), '-s', work('enum.store'), '-o', work('enum.graph'), '-j', str(jobs)], workdir,
+         [work('enum.graph')]),
+        ('landscape', [py, os.path.join(SCRIPTS, 'landscape.py'), '-s', work('enum.store'), '-g', work('enum.graph'), '-o', work('enum')], workdir, []),
+        ('dijkstra', [py, os.path.join(SCRIPTS, 'shortest_mutpaths.py'), '-i', work('enum.graph'), '-e', work('enum.store'), '-m', data('a2a.energy'),
+                      '-s', data('paths.starts'), '-g', data('paths.goals'), '-r', work('paths.txt'), '-j', str(jobs)], workdir,
+         [work('enum.graph/weights-*.npy')]),
+        ('leiden', [py, os.path.join(COMMUNITIES, 'Leiden_community_graph.py'), '-n', data('leiden.nodes'), '-e', data('leiden.edges'),
+                    '-lo', data('leiden.lo'), '-pv', data('leiden.pv'), '-w', data('leiden.wt'), '-seq', work('enum.store'), '--sweep', work('leiden')], workdir,
+         [data('leiden.nodes.npz'), data('leiden.edges.npz')]),
+        ('windowstore', [py, os.path.join(GISAID, 'windowstore.py'), '-i', data('spike.fasta2'), '-o', work('spike.windows'), '-j', str(jobs)], workdir,
+         [work('spike.windows')]),
+        ('gisaid_scan', [py, os.path.join(GISAID, 'multiscan.py'), '-p', data('last18.pats'), '-f', data('spike.fasta2'), '-w', '450:520',
+                         '-o', work('last18'), '-j', str(jobs)], workdir, []),
+        ('hamming', [py, os.path.join(GISAID, 'hamming_index.py'), '-r', data('rbms.txt'), '-f', work('spike.windows'), '-k', '2', '-o', work('rbm-hits.tsv')], workdir, []),
+        ('clustermap', [py, os.path.join(SCRIPTS, 'clustermap.py'), '-i', data('cm.assign'), '-l', data('cm.lon'), '-c', data('cm.clusters'),
+                        '-g', data('cm.good'), '-w', data('cm.wt')] + (['-k', str(knn)] if knn else []), workdir, []),
+    ]
+
+
+def measure(command, cwd, log):
+    """Runs a command, returns (seconds, peak RSS in MB, return code)"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    _, status, usage = os.wait4(proc.pid, 0)
+    seconds = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return seconds, usage.ru_maxrss / 1024, proc.returncode
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def run(size, datadir, output, only=None, repeat=1, jobs=1, knn=None, seed=0):
+    sizes = SIZES[size]
+    datadir = os.path.join(datadir, size)
+    generate(datadir, sizes, seed)
+    workdir = os.path.join(datadir, 'work')
+    os.makedirs(workdir, exist_ok=True)
+    results = {}
+    with open(os.path.join(workdir, 'log.txt'), 'w') as log:
+        for name, command, cwd, clean in cases(datadir, workdir, jobs, knn):
+            if only and name not in only:
+                continue
+            missing = missing_modules(name)
+            if missing:
+                print(name.ljust(12)+'  skipped (missing '+', '.join(missing)+')', flush=True)
+                continue
+            runs = []
+            for _ in range(repeat):
+                for pattern in clean:
+                    for path in glob.glob(pattern):
+                        remove(path)
+                log.write('### '+name+': '+' '.join(command)+'\n')
+                log.flush()
+                runs.append(measure(command, cwd, log))
+            seconds = [r[0] for r in runs]
+            results[name] = {'command': command, 'seconds': seconds, 'best': min(seconds),
+                             'max_rss_mb': max(r[1] for r in runs), 'returncode': max((r[2] for r in runs), key=abs)}
+            status = '' if results[name]['returncode'] == 0 else '  FAILED (see '+log.name+')'
+            print(name.ljust(12)+'%10.2f s %10.1f MB' % (results[name]['best'], results[name]['max_rss_mb'])+status, flush=True)
+    report = {'environment': environment(), 'size': size, 'sizes': sizes, 'jobs': jobs, 'repeat': repeat, 'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def compare(before, after):
+    """Prints the time and memory ratios (after / before) of the cases of two result files"""
+    with open(before) as f:
+        a = json.load(f)
+    with open(after) as f:
+        b = json.load(f)
+    if a['sizes'] != b['sizes']:
+        print('WARNING: different input sizes ('+a['size']+', '+b['size']+')')
+    print('case'.ljust(12)+'before s'.rjust(10)+'after s'.rjust(10)+'ratio'.rjust(8)+'before MB'.rjust(11)+'after MB'.rjust(10)+'ratio'.rjust(8))
+    for name in a['results']:
+        if name not in b['results']:
+            continue
+        ra, rb = a['results'][name], b['results'][name]
+        print(name.ljust(12)+'%10.2f%10.2f%8.2f%11.1f%10.1f%8.2f' % (ra['best'], rb['best'], rb['best'] / ra['best'],
+                                                                      ra['max_rss_mb'], rb['max_rss_mb'], rb['max_rss_mb'] / ra['max_rss_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the pipeline stages on synthetic data')
+    parser.add_argument('-s', '--size', choices=list(SIZES), default='small', help = 'Input sizes')
+    parser.add_argument('-d', '--data', default=os.path.join(HERE, 'data'), help = 'Directory of the generated inputs (one sub-directory per size)')
+    parser.add_argument('-o', '--output', default='benchmark.json', help = 'Results file (JSON)')
+    parser.add_argument('-c', '--cases', default=None, help = 'Comma separated cases to run (default : all)')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help = 'Number of runs of each case (the best time is reported)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help = 'Number of processes of the scripts supporting it')
+    parser.add_argument('-k', '--knn', type=int, default=None, help = 'clustermap.py nearest neighbors mode (-k)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help = 'Compare two result files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args.size, args.data, args.output, args.cases.split(',') if args.cases else None, args.repeat, args.jobs, args.knn, args.seed)
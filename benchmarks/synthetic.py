@@ -0,0 +1,222 @@
+"""Synthetic inputs for the benchmarks, in the formats of the real files.
+
+    enumeration   Amino Acid sequence | ddG value (or a toulbar2 like report)
+    neighbors     ddG value | neighbors (legacy neighbors file)
+    leiden        nodes, edges, local optima, PVs and L strain files
+    a2a           21 x 21 AA to AA energy and probability matrices
+    spike         fasta-2line spike sequences, with variants in the RBD
+    rbms          27 residue RBMs (format : motif | ddG value)
+    patterns      gapped patterns of the last residues of RBMs
+    clustermap    local optima, cluster assignment, representatives, L strain
+
+Enumerated sequences vary on a few positions only, with a few residues
+allowed at each of them, so that (as in the real enumeration) most
+sequences have single substitution neighbors.
+
+Usage:
+    python3 synthetic.py enumeration -n 100000 -o enum.txt
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'scripts'))
+sys.path.insert(0, os.path.join(HERE, '..', 'GISAID-scan'))
+import seqstore
+import neighbors as nbgraph
+import motifs
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+SPIKE_LENGTH = 1273
+
+
+def random_residues(rng, n, length):
+    return ''.join(rng.choice(list(AMINO_ACIDS), size=n * length))
+
+
+def enumeration_sequences(n, length=24, choices=3, seed=0):
+    """n distinct sequences, varying on the fewest positions holding about 3n combinations"""
+    rng = np.random.default_rng(seed)
+    nvar = min(length, max(1, math.ceil(math.log(3 * n) / math.log(choices))))
+    if choices ** nvar < n:
+        raise ValueError('at most '+str(choices ** nvar)+' sequences of length '+str(length)+' with '+str(choices)+' residues per position')
+    base = np.array(list(random_residues(rng, 1, length)))
+    variable = np.sort(rng.choice(length, size=nvar, replace=False))
+    allowed = np.array([rng.choice(list(AMINO_ACIDS), size=choices, replace=False) for _ in variable])
+    codes = rng.choice(choices ** nvar, size=n, replace=False)
+    seqs = np.tile(base, (n, 1))
+    for k in range(nvar):
+        seqs[:, variable[k]] = allowed[k][codes // choices ** k % choices]
+    return [''.join(s) for s in seqs]
+
+
+def enumeration(path, n, length=24, choices=3, seed=0, report=False):
+    """Writes an enumeration (format : Amino Acid sequence | ddG value), or a report with complex and monomer energies"""
+    rng = np.random.default_rng(seed)
+    seqs = enumeration_sequences(n, length, choices, seed)
+    ddg = rng.normal(0, 2, size=n)
+    with open(path, 'w') as f:
+        if report:
+            complex_ = rng.normal(-100, 5, size=n)
+            for s, c, d in zip(seqs, complex_, ddg):
+                f.write(s+' '+str(round(c, 3))+' '+str(round(c - d, 3))+' '+str(round(d, 3))+'\n')
+        else:
+            for s, d in zip(seqs, ddg):
+                f.write(s+' '+str(round(d, 3))+'\n')
+
+
+def neighbors(path, enum_path):
+    """Writes the legacy neighbors file (format : ddG value | neighbors) of an enumeration"""
+    store = seqstore.open_store(enum_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        indptr, indices = nbgraph.build_graph(store.path, tmp)
+    with open(path, 'w') as f:
+        for i in range(len(store)):
+            f.write(' '.join([str(store.ddg[i])] + [str(j) for j in indices[indptr[i]:indptr[i+1]]])+'\n')
+
+
+def a2a(energy_path, proba_path, seed=0):
+    """Writes random AA to AA probability matrices and their energies (-log)"""
+    rng = np.random.default_rng(seed)
+    n = len(seqstore.AA_order)
+    proba = rng.random((n, n))
+    proba /= proba.sum(axis=1, keepdims=True)
+    np.savetxt(proba_path, proba)
+    np.savetxt(energy_path, -np.log(proba))
+
+
+def leiden(prefix, enum_path, nlo=59, npv=8, seed=0):
+    """Writes prefix + .nodes, .edges, .lo, .pv and .wt for Leiden_community_graph.py"""
+    rng = np.random.default_rng(seed)
+    store = seqstore.open_store(enum_path)
+    with tempfile.TemporaryDirectory() as tmp:
+        indptr, indices = nbgraph.build_graph(store.path, tmp)
+    src = nbgraph.edge_sources(indptr)
+    n = len(store)
+    np.savetxt(prefix+'.nodes', np.column_stack((np.arange(n), store.ddg, rng.uniform(1, 10, size=n))), fmt=['%d', '%.3f', '%.2f'])
+    np.savetxt(prefix+'.edges', np.column_stack((src, indices, rng.random(len(indices)))), fmt=['%d', '%d', '%.4f'])
+    lo = rng.choice(n, size=min(nlo, n), replace=False)
+    np.savetxt(prefix+'.lo', lo, fmt='%d')
+    with open(prefix+'.pv', 'w') as f:
+        for c, i in enumerate(lo[:npv]):
+            f.write(str(c+1)+':'+str(i)+'\n')
+    with open(prefix+'.wt', 'w') as f:
+        f.write('0:'+str(rng.integers(n))+'\n')
+
+
+def pathpoints(prefix, n, nstarts=8, ngoals=8, seed=0):
+    """Writes prefix + .starts and .goals (format : Cluster ID ':' Sequence index)"""
+    rng = np.random.default_rng(seed)
+    points = rng.choice(n, size=nstarts + ngoals, replace=False)
+    with open(prefix+'.starts', 'w') as f:
+        for c, i in enumerate(points[:nstarts]):
+            f.write(chr(ord('A') + c % 26)+str(c // 26 or '')+':'+str(i)+'\n')
+    with open(prefix+'.goals', 'w') as f:
+        for c, i in enumerate(points[nstarts:]):
+            f.write(str(c+1)+':'+str(i)+'\n')
+
+
+def spike_variants(nvariants, seed=0, start=380, end=520, mutations=4):
+    """A random spike sequence and nvariants sequences with a few substitutions in [start, end)"""
+    rng = np.random.default_rng(seed)
+    base = random_residues(rng, 1, SPIKE_LENGTH)
+    variants = [base]
+    for _ in range(nvariants - 1):
+        s = list(base)
+        for p in rng.choice(np.arange(start, end), size=rng.integers(1, mutations + 1), replace=False):
+            s[p] = AMINO_ACIDS[rng.integers(len(AMINO_ACIDS))]
+        variants.append(''.join(s))
+    return variants
+
+
+def spike(path, nrecords, nvariants=1000, short=0.05, seed=0):
+    """Writes nrecords fasta-2line spike records drawn from nvariants (Zipf frequencies), a fraction of them truncated"""
+    rng = np.random.default_rng(seed)
+    variants = spike_variants(nvariants, seed)
+    freq = 1 / np.arange(1, nvariants + 1)
+    draws = rng.choice(nvariants, size=nrecords, p=freq / freq.sum())
+    truncated = rng.random(nrecords) < short
+    with open(path, 'w') as f:
+        for i, (v, t) in enumerate(zip(draws, truncated)):
+            seq = variants[v][:rng.integers(1000, 1260)] if t else variants[v]
+            f.write('>hCoV-19/synthetic/'+str(i)+'/2021|EPI_ISL_'+str(i)+'|2021-01-01\n'+seq+'\n')
+
+
+def rbms(path, n, nvariants=1000, hits=0.5, seed=0):
+    """Writes n RBMs (format : 27 residues motif | ddG value), a fraction of them read on spike variants"""
+    rng = np.random.default_rng(seed)
+    positions = [motifs.residue_number(i) - 1 for i in motifs.motif_positions()] # sequence indices
+    variants = spike_variants(nvariants, seed)
+    with open(path, 'w') as f:
+        for k in range(n):
+            if rng.random() < hits:
+                v = variants[rng.integers(nvariants)]
+                motif = ''.join(v[p] for p in positions)
+            else:
+                motif = random_residues(rng, 1, len(positions))
+            f.write(motif+' '+str(round(rng.normal(0, 2), 3))+'\n')
+
+
+def patterns(path, rbm_path, suffix_len=18):
+    """Writes the gapped patterns of the last suffix_len residues of RBMs (generate-patterns.py)"""
+    mask = motifs.suffix_mask(suffix_len)
+    with open(path, 'w') as f:
+        for pat in motifs.unique(motifs.gapped(motifs.read_motifs(rbm_path, suffix_len), mask)):
+            f.write(pat+'\n')
+
+
+def clustermap(prefix, n, nclusters=59, length=24, seed=0):
+    """Writes prefix + .lon, .assign, .clusters, .good and .wt for clustermap.py"""
+    rng = np.random.default_rng(seed)
+    seqs = enumeration_sequences(n + 1, length, 4, seed)
+    wt = seqs.pop()
+    assign = rng.integers(1, nclusters + 1, size=n)
+    assign[:nclusters] = np.arange(1, nclusters + 1) # every cluster is used
+    with open(prefix+'.lon', 'w') as f:
+        for s in seqs:
+            f.write(s+' '+str(round(rng.normal(0, 2), 3))+'\n')
+    with open(prefix+'.assign', 'w') as f:
+        for i, c in enumerate(assign):
+            f.write(str(i)+' '+str(c)+'\n')
+    with open(prefix+'.clusters', 'w') as f:
+        for i in range(nclusters): # first member of each cluster
+            f.write(str(i)+' '+seqs[i]+' 0\n')
+    np.savetxt(prefix+'.good', rng.choice(nclusters, size=min(8, nclusters), replace=False), fmt='%d')
+    with open(prefix+'.wt', 'w') as f:
+        f.write(wt+' 0\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate synthetic benchmark inputs')
+    parser.add_argument('kind', choices=['enumeration', 'report', 'neighbors', 'a2a', 'leiden', 'pathpoints', 'spike', 'rbms', 'patterns', 'clustermap'])
+    parser.add_argument('-o', '--output', required=True, help = 'Output file (or prefix for leiden, pathpoints, clustermap and a2a)')
+    parser.add_argument('-n', '--size', type=int, default=10000, help = 'Number of sequences, records or RBMs')
+    parser.add_argument('-e', '--enumeration', help = 'Enumeration file (neighbors, leiden) or RBM file (patterns)')
+    parser.add_argument('-l', '--length', type=int, default=24, help = 'Sequence length of enumerations')
+    parser.add_argument('-v', '--variants', type=int, default=1000, help = 'Number of distinct spike variants')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.kind in ('enumeration', 'report'):
+        enumeration(args.output, args.size, args.length, seed=args.seed, report=args.kind == 'report')
+    elif args.kind == 'neighbors':
+        neighbors(args.output, args.enumeration)
+    elif args.kind == 'a2a':
+        a2a(args.output+'.energy', args.output+'.proba', args.seed)
+    elif args.kind == 'leiden':
+        leiden(args.output, args.enumeration, seed=args.seed)
+    elif args.kind == 'pathpoints':
+        pathpoints(args.output, args.size, seed=args.seed)
+    elif args.kind == 'spike':
+        spike(args.output, args.size, args.variants, seed=args.seed)
+    elif args.kind == 'rbms':
+        rbms(args.output, args.size, args.variants, seed=args.seed)
+    elif args.kind == 'patterns':
+        patterns(args.output, args.enumeration)
+    elif args.kind == 'clustermap':
+        clustermap(args.output, args.size, length=args.length, seed=args.seed)
@@ -1,33 +1,222 @@
-from pyrosetta import *
-from pyrosetta.rosetta.protocols.rosetta_scripts import *
+"""Runs a RosettaScripts protocol (e.g. get_ace2rbd_interface.xml) on PDB files.
 
+Single mode processes one PDB. Batch mode processes a directory or a list
+of PDB files, or mutation sets applied to one base PDB, with a pool of
+processes: each process initializes PyRosetta, parses the protocol (and
+loads the base pose) once. Inputs whose output already exists are skipped,
+outputs being written under a temporary name first.
+
+Usage:
+    python3 interface.py -i complex.pdb -p get_ace2rbd_interface.xml -o interface.pdb
+    python3 interface.py -b variants/ -p get_ace2rbd_interface.xml -o interfaces/ -j 16
+    python3 interface.py -i complex.pdb -m mutations.txt -p get_ace2rbd_interface.xml -o interfaces/ -j 16
+
+Mutation files hold one variant per line: name | chain:residue number:AA,...
+(e.g. "N501Y B:501:Y"). --mock replaces PyRosetta by a local mock (the PDB
+is copied with the applied mutations as REMARK lines) to test batching
+without Rosetta.
+"""
 import argparse
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+_worker = None
+
+
+class Rosetta:
+    """PyRosetta calls used by this script (imported when first used)"""
+
+    def __init__(self, flags=None):
+        import pyrosetta
+        pyrosetta.init('-beta @'+flags if flags else '-beta')
+        self.pyrosetta = pyrosetta
+
+    def pose_from_pdb(self, pdb):
+        return self.pyrosetta.pose_from_pdb(pdb)
+
+    def protocol(self, protocol_file):
+        from pyrosetta.rosetta.protocols.rosetta_scripts import RosettaScriptsParser
+        return RosettaScriptsParser().generate_mover(protocol_file)
+
+    def mutate(self, pose, chain, resnum, aa):
+        from pyrosetta.toolbox import mutate_residue
+        seqpos = pose.pdb_info().pdb2pose(chain, resnum)
+        if seqpos == 0:
+            raise ValueError('no residue '+str(resnum)+' in chain '+chain)
+        mutate_residue(pose, seqpos, aa)
+
+
+class MockPose:
+    def __init__(self, lines):
+        self.lines = lines
+        self.remarks = []
+
+    def clone(self):
+        pose = MockPose(self.lines)
+        pose.remarks = list(self.remarks)
+        return pose
+
+    def dump_pdb(self, outfile):
+        with open(outfile, 'w') as f:
+            f.writelines('REMARK '+r+'\n' for r in self.remarks)
+            f.writelines(self.lines)
+
+
+class MockMover:
+    def __init__(self, protocol_file):
+        self.name = os.path.basename(protocol_file)
+
+    def apply(self, pose):
+        pose.remarks.append('mock '+self.name)
+
+
+class MockRosetta:
+    """Stand-in for Rosetta with the same calls, for testing without PyRosetta"""
+
+    def __init__(self, flags=None):
+        self.flags = flags
+
+    def pose_from_pdb(self, pdb):
+        with open(pdb) as f:
+            return MockPose(f.readlines())
+
+    def protocol(self, protocol_file):
+        if not os.path.isfile(protocol_file):
+            raise FileNotFoundError(protocol_file)
+        return MockMover(protocol_file)
+
+    def mutate(self, pose, chain, resnum, aa):
+        pose.remarks.append('mutation '+chain+':'+str(resnum)+':'+aa)
+
+
+def parse_mutations(spec):
+    """'B:501:Y,B:484:K' -> [('B', 501, 'Y'), ('B', 484, 'K')]"""
+    mutations = []
+    for m in spec.split(','):
+        chain, resnum, aa = m.split(':')
+        mutations.append((chain, int(resnum), aa))
+    return mutations
+
+
+def read_mutation_sets(filename):
+    """(name, mutations) for each line (format : name | chain:residue number:AA,...)"""
+    sets = []
+    with open(filename) as f:
+        for n, line in enumerate(f, 1):
+            tokens = line.split()
+            if tokens and not tokens[0].startswith('#'):
+                try:
+                    sets.append((tokens[0], parse_mutations(tokens[1]) if len(tokens) > 1 else []))
+                except ValueError:
+                    raise ValueError(filename+' line '+str(n)+': mutations must be chain:residue number:AA, got '+repr(line.strip()))
+    return sets
+
+
+def pdb_inputs(batch):
+    """PDB files of a directory, or listed in a file (one path per line)"""
+    if os.path.isdir(batch):
+        return sorted(os.path.join(batch, f) for f in os.listdir(batch) if f.endswith('.pdb'))
+    base = os.path.dirname(batch)
+    with open(batch) as f:
+        return [os.path.join(base, line.strip()) for line in f if line.strip()]
+
+
+def _init_worker(protocol_file, flags, base_pdb, mock):
+    """Initializes Rosetta, parses the protocol and loads the base pose once per process"""
+    global _worker
+    rosetta = (MockRosetta if mock else Rosetta)(flags)
+    protocol = rosetta.protocol(protocol_file)
+    base = rosetta.pose_from_pdb(base_pdb) if base_pdb else None
+    _worker = (rosetta, protocol, base)
+
+
+def _run_task(task):
+    """Runs the protocol for one (input pdb or mutations, output) task, returns (output, status, seconds)"""
+    rosetta, protocol, base = _worker
+    source, outfile = task
+    start = time.time()
+    tmp = outfile+'.tmp.pdb'
+    try:
+        if base is not None:
+            pose = base.clone()
+            for chain, resnum, aa in source:
+                rosetta.mutate(pose, chain, resnum, aa)
+        else:
+            pose = rosetta.pose_from_pdb(source)
+        protocol.apply(pose)
+        pose.dump_pdb(tmp)
+        os.replace(tmp, outfile)
+    except Exception as e: # one bad input does not stop the batch
+        return outfile, 'failed: '+str(e), time.time() - start
+    finally:
+        if os.path.exists(tmp): # partial output of a failed task
+            os.remove(tmp)
+    return outfile, 'done', time.time() - start
+
+
+def run_batch(tasks, protocol_file, flags=None, base_pdb=None, jobs=1, mock=False):
+    """Runs the protocol on (input, output) tasks, skipping existing outputs; yields (output, status, seconds)"""
+    todo = []
+    for source, outfile in tasks:
+        if os.path.exists(outfile):
+            yield outfile, 'skipped', 0.0
+        else:
+            todo.append((source, outfile))
+    if not todo:
+        return
+    if jobs > 1:
+        with Pool(min(jobs, len(todo)), initializer=_init_worker, initargs=(protocol_file, flags, base_pdb, mock)) as pool:
+            yield from pool.imap_unordered(_run_task, todo)
+    else:
+        _init_worker(protocol_file, flags, base_pdb, mock)
+        for task in todo:
+            yield _run_task(task)
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run rosetta protocol')
+    parser.add_argument('-p',  '--protocol',
+                        help='Protocol in XML format')
+    parser.add_argument('-i',  '--input',
+                        help='Input pdb (base pdb with -m)')
+    parser.add_argument('-f',  '--flags',
+                        help='flags file')
+    parser.add_argument('-o', '--output', help='Output pdb file (output directory in batch mode)')
+    parser.add_argument('-b', '--batch', help='Batch mode: directory of pdb files, or file listing them')
+    parser.add_argument('-m', '--mutations', help='Batch mode: mutation sets applied to the input pdb (format : name | chain:residue number:AA,...)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Batch mode: number of processes')
+    parser.add_argument('--mock', action='store_true', help='Use a mock of Rosetta (tests batching without PyRosetta)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+    if args.mutations and not args.input:
+        parser.error('-m/--mutations needs the base pdb (-i/--input)')
 
-parser = argparse.ArgumentParser(
-    description='Run rosetta protocol')
-parser.add_argument('-p',  '--protocol',
-                    help='Protocol in XML format')
-parser.add_argument('-i',  '--input',
-                    help='Input pdb')
-parser.add_argument('-f',  '--flags',
-                    help='flags file')
-
-parser.add_argument('-o', '--output', help='Output pdb file')
-
-args = parser.parse_args()
-inpdb = args.input
-flags = args.flags
-protocol_file = args.protocol
-outfile = args.output
-
-if flags:
-    init('-beta @'+flags)
-else:
-    init('-beta')
-    
-pose = pose_from_pdb(inpdb)
-parser = RosettaScriptsParser()
-protocol = parser.generate_mover(protocol_file)
-protocol.apply(pose)
-pose.dump_pdb(outfile)
+    if args.batch or args.mutations:
+        os.makedirs(args.output, exist_ok=True)
+        if args.mutations:
+            tasks = [(mutations, os.path.join(args.output, name+'.pdb')) for name, mutations in read_mutation_sets(args.mutations)]
+        else:
+            tasks = [(pdb, os.path.join(args.output, os.path.basename(pdb))) for pdb in pdb_inputs(args.batch)]
+        counts = {}
+        profiler.start('batch') # tasks run in the worker processes with -j > 1
+        for outfile, status, seconds in run_batch(tasks, args.protocol, args.flags, args.input if args.mutations else None, args.jobs, args.mock):
+            print(outfile+'\t'+status+'\t'+str(round(seconds, 2)), flush=True)
+            counts[status.split(':')[0]] = counts.get(status.split(':')[0], 0) + 1
+        profiler.stop()
+        print(', '.join(str(n)+' '+s for s, n in counts.items()))
+    else:
+        with profiler.stage('setup'):
+            _init_worker(args.protocol, args.flags, None, args.mock)
+            rosetta, protocol, base = _worker
+            pose = rosetta.pose_from_pdb(args.input)
+        with profiler.stage('protocol'):
+            protocol.apply(pose)
+        with profiler.stage('write'):
+            pose.dump_pdb(args.output)
@@ -0,0 +1,184 @@
+"""Mutation probabilities of CoViD_rates.ipynb as an importable module.
+
+Codon to codon transition matrices are Kronecker products of the nucleotide
+transition matrix (codon positions mutate independently), and nucleotide
+transition matrices for many time steps come from a single eigen
+decomposition of the rate matrix. AA to AA probability and energy (-log)
+matrices are cached on disk, one directory per model (rates, codon usage,
+time step), in the text format read by shortest_mutpaths.py and
+neighbors.py.
+
+Usage:
+    python3 mutrates.py -t 1/2025 -c a2a-cache
+prints the AA to AA energy file of the model (default: GTR rates, SARS-CoV-2
+codon usage, one DNA mutation over 27 codons).
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from fractions import Fraction
+
+import numpy as np
+from scipy.linalg import expm
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import profiling
+
+# We use DNA codes (instead of RNA: T vs U) everywhere
+NAindex = {'A':0, 'T':1, 'C':2, 'G':3}
+codons = {
+        'ATA':'I', 'ATC':'I', 'ATT':'I', 'ATG':'M',
+        'ACA':'T', 'ACC':'T', 'ACG':'T', 'ACT':'T',
+        'AAC':'N', 'AAT':'N', 'AAA':'K', 'AAG':'K',
+        'AGC':'S', 'AGT':'S', 'AGA':'R', 'AGG':'R',
+        'CTA':'L', 'CTC':'L', 'CTG':'L', 'CTT':'L',
+        'CCA':'P', 'CCC':'P', 'CCG':'P', 'CCT':'P',
+        'CAC':'H', 'CAT':'H', 'CAA':'Q', 'CAG':'Q',
+        'CGA':'R', 'CGC':'R', 'CGG':'R', 'CGT':'R',
+        'GTA':'V', 'GTC':'V', 'GTG':'V', 'GTT':'V',
+        'GCA':'A', 'GCC':'A', 'GCG':'A', 'GCT':'A',
+        'GAC':'D', 'GAT':'D', 'GAA':'E', 'GAG':'E',
+        'GGA':'G', 'GGC':'G', 'GGG':'G', 'GGT':'G',
+        'TCA':'S', 'TCC':'S', 'TCG':'S', 'TCT':'S',
+        'TTC':'F', 'TTT':'F', 'TTA':'L', 'TTG':'L',
+        'TAC':'Y', 'TAT':'Y', 'TAA':'_', 'TAG':'_',
+        'TGC':'C', 'TGT':'C', 'TGA':'_', 'TGG':'W',
+    }
+codon_index = {c: i for i, c in enumerate(codons)}
+
+AA_order = "IMTNKSRLPHQVADEGFYCW_" # codons order with STOP at the end
+AA_index = {a: i for i, a in enumerate(AA_order)}
+
+DEFAULT_T = 1.0/(27*3*25) # one DNA mutation over 27 codons
+
+
+def norm_rate(rate):
+    """Rate matrix with diagonal set so that rows sum to 0"""
+    rate = np.array(rate, dtype=float)
+    np.fill_diagonal(rate, 0)
+    np.fill_diagonal(rate, -rate.sum(axis=1))
+    return rate
+
+# GTR model (https://www.ncbi.nlm.nih.gov/pmc/articles/PMC7560444/)
+m_rate_GTR = norm_rate([[0 ,    12.05, 8.25, 8.97],
+                        [10.64,  0   , 6   , 3.64],
+                        [11.87,  9.78, 0   , 5.72],
+                        [12.13 , 5.57, 5.38, 0   ]])
+
+# RSCU values (https://virologyj.biomedcentral.com/articles/10.1186/s12985-020-01395-x)
+SARS_Cov_CU = {
+    'AGA': 2.67, 'TAA': 2.4, 'GGT': 2.34, 'GCT': 2.18, 'TCT': 1.97, 'GTT': 1.95, 'CCT': 1.94, 'ACT': 1.78,
+    'CTT': 1.74, 'TCA': 1.66, 'ACA': 1.64, 'TTA': 1.63, 'CCA': 1.59, 'TGT': 1.55, 'ATT': 1.52, 'CGT': 1.46,
+    'AGT': 1.44, 'GAA': 1.44, 'TTT': 1.41, 'CAT': 1.39, 'CAA': 1.39, 'AAT': 1.35, 'AAA': 1.31, 'GAT': 1.28,
+    'TAT': 1.22, 'GCA': 1.1, 'TTG': 1.07, 'ATG': 1.0, 'TGG': 1.0, 'ATA': 0.93, 'GTA': 0.91, 'GGA': 0.83,
+    'AGG': 0.81, 'TAC': 0.78, 'GGC': 0.72, 'GAC': 0.72, 'AAG': 0.69, 'CTA': 0.66, 'AAC': 0.65, 'CAG': 0.61,
+    'CAC': 0.61, 'CTC': 0.6, 'TTC': 0.59, 'CGC': 0.58, 'GTG': 0.57, 'GCC': 0.57, 'GAG': 0.56, 'GTC': 0.56,
+    'ATC': 0.56, 'TCC': 0.46, 'TGC': 0.45, 'ACC': 0.38, 'AGC': 0.36, 'TAG': 0.3, 'TGA': 0.3, 'CCC': 0.29,
+    'CTG': 0.29, 'CGA': 0.29, 'ACG': 0.2, 'CGG': 0.19, 'CCG': 0.17, 'GCG': 0.15, 'GGG': 0.12, 'TCG': 0.11,
+}
+
+# position of each codon (codons order) in the Kronecker product of nucleotide matrices (NAindex order)
+_kron_order = np.array([16*NAindex[c[0]] + 4*NAindex[c[1]] + NAindex[c[2]] for c in codons])
+# codon to AA membership matrix
+_codon_aa = np.zeros((64, len(AA_order)))
+_codon_aa[np.arange(64), [AA_index[a] for a in codons.values()]] = 1
+
+
+def rate2trans(rate, t):
+    """converts a mutation rate matrix into a transition matrix for steps t"""
+    return expm(rate*t)
+
+
+def rate2trans_many(rate, ts):
+    """Transition matrices (T x 4 x 4) for all steps ts, from one eigen decomposition of the rate matrix"""
+    ts = np.atleast_1d(np.asarray(ts, dtype=float))
+    w, v = np.linalg.eig(rate)
+    if np.linalg.cond(v) > 1e8: # not diagonalizable in practice
+        return np.array([expm(rate*t) for t in ts])
+    vinv = np.linalg.inv(v)
+    return np.real(np.einsum('ij,tj,jk->tik', v, np.exp(np.outer(ts, w)), vinv))
+
+
+def codon2codon(rate, t):
+    """Computes a codon to codon transition probability matrix for each pair of codons"""
+    return codon2codon_many(rate, [t])[0]
+
+
+def codon2codon_many(rate, ts):
+    """Codon to codon transition matrices (T x 64 x 64) for all steps ts"""
+    tp = rate2trans_many(rate, ts)
+    kron = np.einsum('tab,tcd,tef->tacebdf', tp, tp, tp).reshape(len(tp), 64, 64)
+    return kron[:, _kron_order][:, :, _kron_order]
+
+
+def codon_bias(cu=None):
+    """Frequency of each codon (codons order) given its AA: RSCU values normalized over the synonymous codons"""
+    cu = SARS_Cov_CU if cu is None else cu
+    raw = np.array([cu[c] for c in codons])
+    return raw / (_codon_aa @ (_codon_aa.T @ raw))
+
+
+def AA2AA(rate, t, cu=None):
+    """Computes an AA to AA transition probability matrix for each pair of
+    AAs (including STOP aka '_'). We assume that the hidden codon used by an
+    AA appears with it's codon bias marginal probability."""
+    return AA2AA_many(rate, [t], cu)[0]
+
+
+def AA2AA_many(rate, ts, cu=None):
+    """AA to AA transition matrices (T x 21 x 21) for all steps ts"""
+    weighted = _codon_aa * codon_bias(cu)[:, None]
+    return weighted.T @ codon2codon_many(rate, ts) @ _codon_aa
+
+
+def model_key(rate, t, cu=None):
+    """Hash of the model parameters (rates, time step, codon usage)"""
+    cu = SARS_Cov_CU if cu is None else cu
+    h = hashlib.sha1(np.ascontiguousarray(rate, dtype=np.float64).tobytes())
+    h.update(repr(float(t)).encode())
+    h.update(json.dumps(sorted(cu.items())).encode())
+    return h.hexdigest()[:16]
+
+
+def cached_a2a(rate=m_rate_GTR, ts=(DEFAULT_T,), cu=None, cachedir='a2a-cache'):
+    """Paths of the AA to AA probability and energy files of each step ts, computed once.
+
+    Each model has its directory cachedir/<key> with a2a_proba.txt,
+    a2a_energy.txt (np.loadtxt format) and params.json.
+    """
+    dirs = [os.path.join(cachedir, model_key(rate, t, cu)) for t in ts]
+    missing = [i for i, d in enumerate(dirs) if not os.path.isfile(os.path.join(d, 'a2a_energy.txt'))]
+    if missing:
+        a2a = AA2AA_many(rate, [ts[i] for i in missing], cu)
+        for i, proba in zip(missing, a2a):
+            os.makedirs(dirs[i], exist_ok=True)
+            np.savetxt(os.path.join(dirs[i], 'a2a_proba.txt'), proba)
+            np.savetxt(os.path.join(dirs[i], 'a2a_energy.txt'), -np.log(proba))
+            with open(os.path.join(dirs[i], 'params.json'), 'w') as f:
+                json.dump({'rate': np.asarray(rate).tolist(), 't': float(ts[i]), 'codon_usage': SARS_Cov_CU if cu is None else cu}, f, indent=1)
+    return [(os.path.join(d, 'a2a_proba.txt'), os.path.join(d, 'a2a_energy.txt')) for d in dirs]
+
+
+def load_a2a(rate=m_rate_GTR, t=DEFAULT_T, cu=None, cachedir='a2a-cache'):
+    """AA to AA (probabilities, energies) matrices of a model, from the cache"""
+    proba, energy = cached_a2a(rate, [t], cu, cachedir)[0]
+    return np.loadtxt(proba), np.loadtxt(energy)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compute and cache AA to AA mutation probability and energy matrices')
+    parser.add_argument('-t', '--steps', default='1/2025', help = 'Comma separated time steps, as numbers or fractions (default : 1/(27*3*25))')
+    parser.add_argument('-r', '--rates', default=None, help = 'Nucleotide rate matrix file (4 x 4, ATCG order, default : GTR model)')
+    parser.add_argument('-c', '--cache', default='a2a-cache', help = 'Cache directory')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    rate = norm_rate(np.loadtxt(args.rates)) if args.rates else m_rate_GTR
+    ts = [float(Fraction(t)) for t in args.steps.split(',')]
+    with profiler.stage('matrices'):
+        matrices = cached_a2a(rate, ts, cachedir=args.cache)
+    for t, (proba, energy) in zip(ts, matrices):
+        print(str(t)+'\t'+energy+'\t'+proba)
@@ -4,18 +4,25 @@ import matplotlib.pyplot as plt
 import matplotlib as mpl
 from matplotlib.colors import LinearSegmentedColormap
 import random
+import inspect
 import numpy as np
 from sklearn.manifold import TSNE
 import argparse
+from scipy.sparse import csr_matrix
+import seqstore
+import profiling
 
 parser = argparse.ArgumentParser(description = 'Plot T-SNE cluster map')
 parser.add_argument('-i', '--input', required=True, help = 'Cluster of each local minimum')
-parser.add_argument('-l', '--lon', required=True, help = 'Input file containing all local optima RBD interface residues (format : sequences | energy)')
+parser.add_argument('-l', '--lon', required=True, help = 'Input file containing all local optima RBD interface residues (format : sequences | energy) or sequence store directory')
 parser.add_argument('-c', '--clusters', required=True, help = 'Input file containing all cluster representatives (format : line ID (number-1) in lon | seq | ddg)')
 parser.add_argument('-g', '--goodclust', required=True, help = 'Input file containing IDs of the cluster representatives that worked (format : Cluster ID)')
 parser.add_argument('-w', '--wildtype', required=True, help = 'Input file containing L strain RBD interface residues (format : sequence | energy)')
+parser.add_argument('-k', '--knn', type=int, default=None, help = 'Only give the k nearest neighbors of each sequence to T-SNE (sparse distances, for large inputs; at least 3*perplexity+2, e.g. 20)')
+profiling.add_argument(parser)
 
 args = parser.parse_args()
+profiler = profiling.from_args(args)
 
 lonfile = args.lon
 cfile = args.clusters
@@ -23,35 +30,60 @@ gfile = args.goodclust
 wfile = args.wildtype
 afile = args.input
 
-def hamming(a,b):
-    cpt = 0
-    for i in range(0,len(a)-1):
-        if (b[i]!=a[i]):
-            cpt+=1
-    if (a[len(a)-1]!=0) and (a[len(a)-1]!=0):
-        if (a[len(a)-1]!=b[len(b)-1]):
-            cpt+=20
-    return cpt
-
-def true_hamming(a,b):
-    cpt = 0
-    for i in range(0,len(a)-1):
-        if (b[i]!=a[i]):
-            cpt+=1
-    return cpt
-
-
-tsne = TSNE(perplexity = 6, early_exaggeration = 12, metric=hamming, square_distances = True, learning_rate = 50, n_iter = 1000)
-
-AAs = {'A':0,'R':1,'N':2,'D':3,'C':4,'Q':5,'E':6,'G':7,'H':8, 'I':9, 'L':10, 'K':11, 'M':12, 'F':13, 'P':14, 'S':15, 'T':16, 'W':17, 'Y':18, 'V':19}
-
-
-    
-sequences = []
-with open(lonfile,'r') as f:
-    lines = f.read().splitlines()
-    for line in lines:
-        sequences.append(line.split()[0])
+def onehot(codes):
+    """N x (21 L) one-hot encoding of a residue matrix"""
+    n, length = codes.shape
+    nletters = len(seqstore.AA_order)
+    hot = np.zeros((n, length*nletters), dtype=np.float32)
+    hot[np.repeat(np.arange(n), length), (np.arange(length)*nletters + codes).ravel()] = 1
+    return hot
+
+def hamming_rows(hot, length, clusters, start, stop):
+    """Rows start:stop of the distance matrix: Hamming distance of the residues, plus 20
+    if the pair i < j is in different clusters and i is in a cluster (not 0)"""
+    d = length - hot[start:stop] @ hot.T
+    rows = np.arange(start, stop)[:, None]
+    cols = np.arange(len(clusters))[None, :]
+    first = np.where(rows < cols, clusters[rows], clusters[cols]) # cluster of the lower index
+    d += 20 * ((first != 0) & (clusters[rows] != clusters[cols]))
+    return d
+
+def hamming_matrix(codes, clusters, chunk=1024):
+    """Dense N x N matrix of hamming_rows() distances"""
+    hot = onehot(codes)
+    d = np.empty((len(codes), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), chunk):
+        stop = min(start + chunk, len(codes))
+        d[start:stop] = hamming_rows(hot, codes.shape[1], clusters, start, stop)
+    return d
+
+def hamming_knn(codes, clusters, k, chunk=1024):
+    """Sparse N x N matrix (CSR) of the hamming_rows() distances to the k nearest neighbors of each vector"""
+    hot = onehot(codes)
+    n = len(codes)
+    indices = np.empty((n, k), dtype=np.int64)
+    data = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, chunk):
+        stop = min(start + chunk, n)
+        d = hamming_rows(hot, codes.shape[1], clusters, start, stop)
+        d[np.arange(stop - start), np.arange(start, stop)] = np.inf # not its own neighbor
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+        nearest = np.take_along_axis(nearest, np.argsort(np.take_along_axis(d, nearest, axis=1), axis=1, kind='stable'), axis=1) # sorted rows
+        indices[start:stop] = nearest
+        data[start:stop] = np.take_along_axis(d, nearest, axis=1)
+    return csr_matrix((data.ravel(), indices.ravel(), np.arange(0, n*k + 1, k)), shape=(n, n))
+
+
+# distances are precomputed in bulk (see hamming_matrix), init='pca' needs vectors
+# sklearn >= 1.5 renamed n_iter to max_iter, square_distances was removed (distances are always squared)
+tsne_params = inspect.signature(TSNE).parameters
+tsne_args = {'max_iter' if 'max_iter' in tsne_params else 'n_iter': 1000}
+if 'square_distances' in tsne_params:
+    tsne_args['square_distances'] = True
+tsne = TSNE(perplexity = 6, early_exaggeration = 12, metric='precomputed', init='random', learning_rate = 50, **tsne_args)
+
+profiler.start('parse')
+lon = seqstore.open_store(lonfile)
 
 seq2clust = {}
 clustIDs = []
@@ -104,22 +136,17 @@ with open(wfile,'r') as f:
     for line in lines:
         wt_sequence = line.split()[0]
 
-seq2vec = []
-for i,s in enumerate(sequences):
-    v = []
-    for a in s:
-        v.append(AAs[a])
-    v.append(seq2clust[i])
-    seq2vec.append(v)
+# sequences then L strain, with their cluster (0 for L)
+codes = np.vstack((lon.residues, seqstore.encode([wt_sequence])))
+seq_clusters = np.array([seq2clust[i] for i in range(len(lon))] + [0])
 
-v = []
-for a in wt_sequence:
-    v.append(AAs[a])
-v.append(0)
-seq2vec.append(v)
-
-    
-ts_embedding = tsne.fit_transform(seq2vec)
+profiler.start('distances')
+if args.knn:
+    distances = hamming_knn(codes, seq_clusters, args.knn)
+else:
+    distances = hamming_matrix(codes, seq_clusters)
+profiler.start('layout')
+ts_embedding = tsne.fit_transform(distances)
 
 clusters_x = []
 clusters_y = []
@@ -135,6 +162,7 @@ for g in gIDs:
 
 nb_seq = len(ts_embedding)
 
+profiler.start('plot')
 fig, ax = plt.subplots()
 mycycler = plt.cycler("color", plt.cm.tab20b.colors)
 
@@ -159,6 +187,7 @@ ax.annotate('L', xy = (ts_embedding[nb_seq-1,0],ts_embedding[nb_seq-1,1]), xytex
 plt.legend(loc='upper left', fontsize = 'small')
 plt.axis('off')
 plt.savefig('clustermap.svg')
+profiler.stop()
 
 
 
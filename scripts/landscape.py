@@ -0,0 +1,125 @@
+"""Local optima (minima of ddG) and their basins on the Hamming-1 neighbor graph.
+
+Sequences are ranked by (ddG, index), so that ties are broken and every
+sequence has a single lowest neighbor. A sequence is a local minimum when
+it ranks below all its neighbors, which is found for all sequences at once
+by a minimum reduction of the neighbor ranks over the CSR rows. Each other
+sequence points to its lowest neighbor (steepest descent); following these
+pointers by pointer jumping (pointer = pointer[pointer], until nothing
+changes) gives the minimum at the bottom of the basin of every sequence in
+a logarithmic number of passes over the arrays.
+
+Outputs (prefix given by -o):
+
+    .lon           local optima (format : Amino Acid sequence | ddG value), for clustermap.py -l
+    .loi           their indices (format : Sequence index), for Leiden_community_graph.py -lo
+    .minima.tsv    index, sequence, ddG and basin size of each local optimum
+    .basins.npy    int64, local optimum (sequence index) of each sequence
+
+Usage:
+    python landscape.py -s enum.store -g enum.graph -o enum
+"""
+import argparse
+import os
+
+import numpy as np
+
+import seqstore
+import neighbors as nbgraph
+import profiling
+
+
+def ranks(energies):
+    """Rank of each sequence by increasing ddG (ties broken by index)"""
+    order = np.argsort(energies, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank, order
+
+
+def steepest_neighbors(indptr, indices, energies, chunk=1 << 22):
+    """Lowest neighbor of each sequence, or the sequence itself if it is a local minimum"""
+    rank, order = ranks(energies)
+    n = len(indptr) - 1
+    lowest = rank.copy()
+    rows = 0
+    while rows < n:
+        # rows whose edges fit in the chunk (at least one row)
+        stop = max(rows + 1, int(np.searchsorted(indptr, indptr[rows] + chunk, side='right')) - 1)
+        stop = min(stop, n)
+        ptr = np.asarray(indptr[rows:stop+1])
+        nonempty = np.flatnonzero(np.diff(ptr) > 0)
+        if len(nonempty):
+            edge_ranks = rank[np.asarray(indices[ptr[0]:ptr[-1]])]
+            mins = np.minimum.reduceat(edge_ranks, ptr[nonempty] - ptr[0])
+            block = lowest[rows:stop]
+            block[nonempty] = np.minimum(block[nonempty], mins)
+        rows = stop
+    return order[lowest]
+
+
+def local_minima(indptr, indices, energies, chunk=1 << 22):
+    """Indices of the sequences lower than all their neighbors"""
+    steepest = steepest_neighbors(indptr, indices, energies, chunk)
+    return np.flatnonzero(steepest == np.arange(len(steepest)))
+
+
+def basins(steepest):
+    """Local minimum reached by steepest descent from each sequence (pointer jumping)"""
+    basin = np.array(steepest, dtype=np.int64)
+    while True:
+        jumped = basin[basin]
+        if np.array_equal(jumped, basin):
+            return basin
+        basin = jumped
+
+
+def landscape(indptr, indices, energies, chunk=1 << 22):
+    """Returns (local minima indices, basin of each sequence, basin size of each local minimum)"""
+    basin = basins(steepest_neighbors(indptr, indices, energies, chunk))
+    minima = np.flatnonzero(basin == np.arange(len(basin)))
+    sizes = np.bincount(basin, minlength=len(basin))[minima]
+    return minima, basin, sizes
+
+
+def open_graph(graph_path, store):
+    """(indptr, indices, energies) of a graph directory (ddG of the store) or legacy neighbors file (its own ddG)"""
+    if nbgraph.is_graph(graph_path):
+        energies = store.ddg
+    else:
+        graph_path = nbgraph.open_neighbors(graph_path) # legacy file, converted once
+        energies = np.load(os.path.join(graph_path, 'energies.npy'), mmap_mode='r')
+    indptr, indices = nbgraph.load_graph(graph_path)
+    if len(indptr) - 1 != len(energies):
+        raise ValueError(graph_path+': '+str(len(indptr) - 1)+' nodes but '+str(len(energies))+' sequences')
+    return indptr, indices, np.asarray(energies)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Find the local optima of the ddG landscape and their basins')
+    parser.add_argument('-s', '--sequences', required=True, help = 'Sequence store directory or enumeration file (format : Amino Acid sequence | ddG value)')
+    parser.add_argument('-g', '--graph', required=True, help = 'Neighbor graph directory (see neighbors.py) or neighbors file (format : ddG value | neighbors)')
+    parser.add_argument('-o', '--output', required=True, help = 'Output prefix (.lon, .loi, .minima.tsv and .basins.npy files)')
+    parser.add_argument('-b', '--min-basin', type=int, default=1, help = 'Only write local optima whose basin holds at least this number of sequences')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    with profiler.stage('parse'):
+        store = seqstore.open_store(args.sequences)
+        indptr, indices, energies = open_graph(args.graph, store)
+    with profiler.stage('search'):
+        minima, basin, sizes = landscape(indptr, indices, energies)
+
+    with profiler.stage('write'):
+        np.save(args.output+'.basins.npy', basin)
+        kept = sizes >= args.min_basin
+        minima, sizes = minima[kept], sizes[kept]
+        seqs = store.sequences(minima)
+        with open(args.output+'.lon', 'w') as lon, open(args.output+'.loi', 'w') as loi, open(args.output+'.minima.tsv', 'w') as tsv:
+            tsv.write('index\tsequence\tddg\tbasin_size\n')
+            for i, s, size in zip(minima.tolist(), seqs, sizes.tolist()):
+                lon.write(s+' '+str(energies[i])+'\n')
+                loi.write(str(i)+'\n')
+                tsv.write(str(i)+'\t'+s+'\t'+str(energies[i])+'\t'+str(size)+'\n')
+    print(str(len(minima))+' local optima (of '+str(int(kept.size))+') written, basins of '+str(len(basin))+' sequences in '+args.output+'.basins.npy')
@@ -0,0 +1,93 @@
+"""Python client of landscape_server.py.
+
+A Client keeps one HTTP connection open and sends batches of queries (see
+landscape_server.py for their format); the helpers wrap the usual ones.
+
+    client = Client('http://127.0.0.1:8765')
+    i = client.lookup(['NITNLCPFGEVFNATRFASVYAWN'])[0]
+    client.neighbors([i]), client.community([i]), client.path(i, 40), client.hamming(seq, 2)
+
+Usage (queries as JSON lines, results written as JSON lines):
+    python landscape_client.py -u http://127.0.0.1:8765 -q queries.jsonl -b 256
+"""
+import argparse
+import http.client
+import json
+import sys
+from urllib.parse import urlsplit
+
+
+class Client:
+    def __init__(self, url='http://127.0.0.1:8765', timeout=60):
+        url = urlsplit(url)
+        self.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+
+    def request(self, method, path, data=None):
+        body = None if data is None else json.dumps(data).encode()
+        headers = {} if body is None else {'Content-Type': 'application/json'}
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            self.connection.close() # server closed the idle connection, retry once
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(str(response.status)+': '+result.get('error', ''))
+        return result
+
+    def query(self, queries):
+        """Results of a batch of queries (list of dicts), in the same order"""
+        return self.request('POST', '/query', list(queries))
+
+    def info(self):
+        return self.request('GET', '/info')
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, sequences):
+        """Id of each sequence (None if it is not stored)"""
+        return [r.get('id') for r in self.query({'op': 'lookup', 'sequence': s} for s in sequences)]
+
+    def sequences(self, ids):
+        return self.query({'op': 'sequence', 'id': int(i)} for i in ids)
+
+    def neighbors(self, ids):
+        return self.query({'op': 'neighbors', 'id': int(i)} for i in ids)
+
+    def community(self, ids):
+        return self.query({'op': 'community', 'id': int(i)} for i in ids)
+
+    def path(self, source, target, limit=None):
+        query = {'op': 'path', 'id': int(source), 'target': int(target)}
+        if limit is not None:
+            query['limit'] = float(limit)
+        return self.query([query])[0]
+
+    def hamming(self, sequence, k=1):
+        return self.query([{'op': 'hamming', 'sequence': sequence, 'k': int(k)}])[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Send queries to a landscape_server.py service')
+    parser.add_argument('-u', '--url', default='http://127.0.0.1:8765', help = 'Service URL')
+    parser.add_argument('-q', '--queries', default=None, help = 'Queries, one JSON object per line (default : standard input, or server info if none)')
+    parser.add_argument('-b', '--batch', type=int, default=256, help = 'Queries per request')
+    args = parser.parse_args()
+
+    client = Client(args.url)
+    if args.queries is None and sys.stdin.isatty():
+        print(json.dumps(client.info()))
+        sys.exit(0)
+    batch = []
+    with (open(args.queries) if args.queries else sys.stdin) as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) == args.batch:
+                sys.stdout.write(''.join(json.dumps(r)+'\n' for r in client.query(batch)))
+                batch = []
+    if batch:
+        sys.stdout.write(''.join(json.dumps(r)+'\n' for r in client.query(batch)))
@@ -0,0 +1,252 @@
+"""Resident query service over the sequence store, neighbor graph and communities.
+
+The store, graph, edge weights (AA to AA matrix) and Leiden membership are
+loaded once; queries are then answered without reloading anything. A
+sequence is found by its 64 bits hash (as in neighbors.py) in a sorted hash
+array, and the Hamming ball of a sequence by looking up the hashes of all
+its variants, computed arithmetically from its own hash and restricted to
+the residues present at each position in the store.
+
+Queries are JSON objects posted in batches (a JSON list) to /query over
+HTTP; each designates a sequence by "id" or "sequence":
+
+    {"op": "lookup", "sequence": "..."}           id (null if absent)
+    {"op": "sequence", "id": 12}                  sequence and ddG
+    {"op": "neighbors", "id": 12}                 single substitution neighbors, with ddG and edge weight
+    {"op": "community", "id": 12}                 community and community size
+    {"op": "path", "id": 12, "target": 40}        shortest path (Dijkstra on the edge weights, one search per source of a batch)
+    {"op": "path", ..., "limit": 20.0}            same, searching only the paths shorter than limit (faster)
+    {"op": "hamming", "sequence": "...", "k": 2}  ids and distances of the sequences within distance k
+
+The results are returned in a list of the same order; a failed query gives
+{"error": "..."} without failing the batch. GET /info describes the data.
+See landscape_client.py for a Python client.
+
+Usage:
+    python landscape_server.py -s enum.store -g enum.graph -m a2a_energy.txt -c leiden.memberships.npy -p 8765
+"""
+import argparse
+import json
+import signal
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import seqstore
+import neighbors as nbgraph
+import pathsearch
+import profiling
+
+MAX_BALL = 1 << 22 # candidate variants of a Hamming ball query
+
+
+class Landscape:
+    """Data of the service, loaded once, and the answer to each query"""
+
+    def __init__(self, store_path, graph_path=None, matrix=None, communities=None, run=0, seed=0):
+        start = time.time()
+        self.store = seqstore.open_store(store_path)
+        self.residues = self.store.residues
+        self.ddg = self.store.ddg
+        self.weights = np.random.default_rng(seed).integers(1, 2**63, size=self.store.length, dtype=np.uint64) | np.uint64(1)
+        hashes = nbgraph.row_hashes(self.residues, self.weights)
+        self.order = np.argsort(hashes, kind='stable')
+        self.hashes = hashes[self.order]
+        self.alternatives = [np.flatnonzero(np.bincount(self.residues[:, p], minlength=len(seqstore.AA_order))).astype(np.uint64)
+                             for p in range(self.store.length)] # residues present at each position
+        self.indptr = self.indices = self.edge_weights = self.csgraph = None
+        if graph_path:
+            self.indptr, self.indices = nbgraph.load_graph(graph_path)
+            if matrix is not None:
+                self.edge_weights = np.asarray(nbgraph.cached_edge_weights(graph_path, self.store, self.indptr, self.indices, matrix))
+            else:
+                self.edge_weights = np.ones(len(self.indices))
+            self.csgraph = pathsearch.csr_graph(self.indptr, self.indices, self.edge_weights) # reused by every path search
+        self.membership = self.sizes = None
+        if communities:
+            membership = np.load(communities, mmap_mode='r') if communities.endswith('.npy') else np.loadtxt(communities, dtype=np.int64)
+            self.membership = np.asarray(membership[:, run] if membership.ndim == 2 else membership)
+            if len(self.membership) != len(self.store):
+                raise ValueError(communities+': '+str(len(self.membership))+' memberships but '+str(len(self.store))+' sequences')
+            self.sizes = np.bincount(self.membership)
+        self.load_seconds = time.time() - start
+
+    def info(self):
+        return {'sequences': len(self.store), 'length': self.store.length, 'store': self.store.path,
+                'edges': None if self.indices is None else len(self.indices),
+                'communities': None if self.sizes is None else int((self.sizes > 0).sum()), 'load_seconds': self.load_seconds}
+
+    def encode(self, sequence):
+        if len(sequence) != self.store.length:
+            raise ValueError('sequence length is '+str(len(sequence))+', not '+str(self.store.length))
+        return seqstore.encode([sequence])[0]
+
+    def find(self, codes, hashes, k):
+        """Ids of the stored sequences with the given hashes, within distance k of codes (hash collisions removed)"""
+        lo = np.searchsorted(self.hashes, hashes, side='left')
+        hi = np.searchsorted(self.hashes, hashes, side='right')
+        hit = hi > lo
+        found = np.unique(np.concatenate([self.order[a:b] for a, b in zip(lo[hit], hi[hit])] + [np.zeros(0, dtype=np.int64)]))
+        distances = (np.asarray(self.residues[found]) != codes).sum(axis=1)
+        return found[distances <= k], distances[distances <= k]
+
+    def lookup(self, sequence):
+        codes = self.encode(sequence)
+        ids, _ = self.find(codes, np.array([codes.astype(np.uint64) @ self.weights]), 0)
+        return int(ids[0]) if len(ids) else None
+
+    def hamming(self, sequence, k):
+        """Stored sequences within Hamming distance k, as (ids, distances) sorted by distance"""
+        codes = self.encode(sequence)
+        h = codes.astype(np.uint64) @ self.weights
+        deltas = [] # hash change of each substitution, per position
+        for p, alt in enumerate(self.alternatives):
+            alt = alt[alt != codes[p]]
+            deltas.append((alt - np.uint64(codes[p])) * self.weights[p]) # wrapping arithmetic
+        # variants with d substitutions extend those with d - 1 at a later position
+        level, last = np.array([h]), np.array([-1])
+        hashes = [level]
+        count = 1
+        for d in range(1, k + 1):
+            grown, positions = [], []
+            for p, delta in enumerate(deltas):
+                base = level[last < p]
+                grown.append(np.add.outer(base, delta).ravel())
+                positions.append(np.full(len(base) * len(delta), p))
+            level, last = np.concatenate(grown), np.concatenate(positions)
+            count += len(level)
+            if count > MAX_BALL:
+                raise ValueError('more than '+str(MAX_BALL)+' variants within distance '+str(k))
+            hashes.append(level)
+        ids, distances = self.find(codes, np.concatenate(hashes), k)
+        order = np.lexsort((ids, distances))
+        return ids[order], distances[order]
+
+    def resolve(self, query, key='id'):
+        """Sequence id designated by query[key], or by query['sequence']"""
+        if key in query:
+            i = int(query[key])
+            if not 0 <= i < len(self.store):
+                raise ValueError('no sequence '+str(i))
+            return i
+        if key == 'id' and 'sequence' in query:
+            i = self.lookup(query['sequence'])
+            if i is None:
+                raise ValueError('unknown sequence '+query['sequence'])
+            return i
+        raise ValueError('missing '+key)
+
+    def answer(self, query, searches=None):
+        """Result of one query (a dict), {'error': message} if it cannot be answered.
+
+        searches keeps the (dist, pred) arrays of the path searches of a batch,
+        so that paths from the same source are found by a single search.
+        """
+        try:
+            op = query.get('op')
+            if op == 'lookup':
+                return {'id': self.lookup(query['sequence'])}
+            if op == 'sequence':
+                i = self.resolve(query)
+                return {'id': i, 'sequence': self.store.sequence(i), 'ddg': float(self.ddg[i])}
+            if op == 'hamming':
+                ids, distances = self.hamming(query['sequence'], int(query.get('k', 1)))
+                return {'ids': ids.tolist(), 'distances': distances.tolist()}
+            if op in ('neighbors', 'path') and self.indptr is None:
+                raise ValueError('no neighbor graph loaded')
+            if op == 'neighbors':
+                i = self.resolve(query)
+                begin, end = self.indptr[i], self.indptr[i+1]
+                ids = np.asarray(self.indices[begin:end])
+                return {'id': i, 'ids': ids.tolist(), 'ddg': np.asarray(self.ddg[ids]).tolist(), 'weights': self.edge_weights[begin:end].tolist()}
+            if op == 'community':
+                if self.membership is None:
+                    raise ValueError('no communities loaded')
+                i = self.resolve(query)
+                c = int(self.membership[i])
+                return {'id': i, 'community': c, 'size': int(self.sizes[c])}
+            if op == 'path':
+                source, target = self.resolve(query), self.resolve(query, 'target')
+                if searches is None:
+                    searches = {}
+                limit = float(query.get('limit', np.inf))
+                if (source, limit) not in searches:
+                    searches[source, limit] = pathsearch.dijkstra(self.indptr, self.indices, self.edge_weights, source, csgraph=self.csgraph, limit=limit)
+                dist, pred = searches[source, limit]
+                path = pathsearch.path_to(pred, source, target)
+                return {'distance': float(dist[target]) if path else None, 'path': path}
+            raise ValueError('unknown op '+repr(op))
+        except Exception as e: # one bad query does not fail the batch
+            return {'error': type(e).__name__+': '+str(e)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # persistent connections
+    disable_nagle_algorithm = True # headers and body are written separately
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/info':
+            self.send_json(200, self.server.landscape.info())
+        else:
+            self.send_json(404, {'error': 'unknown path '+self.path})
+
+    def do_POST(self):
+        if self.path != '/query':
+            self.send_json(404, {'error': 'unknown path '+self.path})
+            return
+        try:
+            queries = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as e:
+            self.send_json(400, {'error': 'invalid JSON: '+str(e)})
+            return
+        if isinstance(queries, dict):
+            queries = [queries]
+        searches = {}
+        self.send_json(200, [self.server.landscape.answer(q, searches) if isinstance(q, dict) else {'error': 'query must be an object'} for q in queries])
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(landscape, host='127.0.0.1', port=8765, verbose=False):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.landscape = landscape
+    server.verbose = verbose
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Serve sequence, neighbor, community, path and Hamming ball queries over HTTP')
+    parser.add_argument('-s', '--sequences', required=True, help = 'Sequence store directory or enumeration file (format : Amino Acid sequence | ddG value)')
+    parser.add_argument('-g', '--graph', default=None, help = 'Neighbor graph directory (see neighbors.py), for neighbors and path queries')
+    parser.add_argument('-m', '--matrix', default=None, help = 'AA to AA energy matrix (21 x 21) weighting the edges of path queries (default : 1 for every edge)')
+    parser.add_argument('-c', '--communities', default=None, help = 'Community of each sequence: Leiden sweep .memberships.npy (see --run), .npy or text file (one community per line)')
+    parser.add_argument('-r', '--run', type=int, default=0, help = 'Column (sweep run) of a memberships file')
+    parser.add_argument('--host', default='127.0.0.1', help = 'Address to listen on (local only by default)')
+    parser.add_argument('-p', '--port', type=int, default=8765)
+    parser.add_argument('-v', '--verbose', action='store_true', help = 'Log every request')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    with profiler.stage('load'):
+        landscape = Landscape(args.sequences, args.graph, np.loadtxt(args.matrix) if args.matrix else None, args.communities, args.run)
+    server = serve(landscape, args.host, args.port, args.verbose)
+    print('loaded in %.1f s, serving on http://%s:%d' % (landscape.load_seconds, args.host, server.server_address[1]), flush=True)
+    signal.signal(signal.SIGTERM, signal.default_int_handler) # stopped like Ctrl-C, the profile is written at exit
+    profiler.start('serve')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
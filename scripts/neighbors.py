@@ -0,0 +1,240 @@
+"""Hamming-1 neighbor graph of an enumerated sequence set, stored as CSR arrays.
+
+Two sequences are neighbors when they differ by a single substitution. For
+each position p, every sequence gets a hash of its residues with p masked:
+neighbors at p are the sequences sharing that key, found by sorting the keys
+(no pairwise comparison). Positions are processed in parallel.
+
+A graph is a directory holding:
+
+    indptr.npy     int64 (N+1), neighbors of i are indices[indptr[i]:indptr[i+1]]
+    indices.npy    int32, sorted neighbor ids of each sequence (both directions)
+    meta.json      number of nodes and edges, source store
+
+Usage:
+    python neighbors.py -s enum.store -o enum.graph -j 48
+"""
+import argparse
+import hashlib
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+import seqstore
+import profiling
+
+_residues = None
+_hashes = None
+_weights = None
+
+
+def _init_worker(store_path, hash_file, weights):
+    global _residues, _hashes, _weights
+    _residues = seqstore.open_store(store_path).residues
+    _hashes = np.load(hash_file, mmap_mode='r')
+    _weights = weights
+
+
+def row_hashes(residues, weights, chunk=1 << 22):
+    """64 bits polynomial hash of each residue row (wrapping arithmetic)"""
+    h = np.zeros(len(residues), dtype=np.uint64)
+    for start in range(0, len(residues), chunk):
+        block = np.asarray(residues[start:start+chunk], dtype=np.uint64)
+        h[start:start+chunk] = block @ weights
+    return h
+
+
+def position_pairs(residues, hashes, weights, position):
+    """Returns (a, b) arrays of all neighbor pairs differing at position only (a < b not implied)"""
+    col = np.asarray(residues[:, position], dtype=np.uint64)
+    key = hashes - col * weights[position] # hash with this position masked
+    order = np.argsort(key, kind='stable')
+    skey = key[order]
+    lsrc = []
+    ldst = []
+    k = 1
+    while k < len(order):
+        same = skey[k:] == skey[:-k]
+        if not same.any():
+            break
+        a = order[:-k][same]
+        b = order[k:][same]
+        # keys may collide: keep pairs that truly differ only at this position
+        ra = residues[a]
+        rb = residues[b]
+        diff = ra != rb
+        ok = diff[:, position] & (diff.sum(axis=1) == 1)
+        lsrc.append(a[ok])
+        ldst.append(b[ok])
+        k += 1
+    if not lsrc:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(lsrc), np.concatenate(ldst)
+
+
+def _worker_pairs(position):
+    return position_pairs(_residues, _hashes, _weights, position)
+
+
+def to_csr(src, dst, n):
+    """Builds symmetric CSR arrays from undirected pairs"""
+    rows = np.concatenate([src, dst]).astype(np.int64)
+    cols = np.concatenate([dst, src]).astype(np.int64)
+    order = np.argsort(rows * n + cols, kind='stable')
+    indices = cols[order].astype(np.int32)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, indices
+
+
+def build_graph(store_path, outdir, jobs=1, seed=0):
+    """Computes the Hamming-1 graph of a sequence store and saves it in outdir"""
+    store = seqstore.open_store(store_path)
+    residues = store.residues
+    n, length = residues.shape
+    weights = np.random.default_rng(seed).integers(1, 2**63, size=length, dtype=np.uint64) | np.uint64(1)
+    os.makedirs(outdir, exist_ok=True)
+    hash_file = os.path.join(outdir, 'hashes.tmp.npy')
+    np.save(hash_file, row_hashes(residues, weights))
+
+    if jobs > 1:
+        with Pool(jobs, initializer=_init_worker, initargs=(store.path, hash_file, weights)) as pool:
+            pairs = pool.map(_worker_pairs, range(length))
+    else:
+        _init_worker(store.path, hash_file, weights)
+        pairs = [_worker_pairs(p) for p in range(length)]
+    os.remove(hash_file)
+
+    src = np.concatenate([a for a, b in pairs])
+    dst = np.concatenate([b for a, b in pairs])
+    del pairs
+    indptr, indices = to_csr(src, dst, n)
+    save_graph(outdir, indptr, indices, source=store.path)
+    return indptr, indices
+
+
+def save_graph(outdir, indptr, indices, source=None):
+    os.makedirs(outdir, exist_ok=True)
+    np.save(os.path.join(outdir, 'indptr.npy'), indptr)
+    np.save(os.path.join(outdir, 'indices.npy'), indices)
+    with open(os.path.join(outdir, 'meta.json'), 'w') as f:
+        json.dump({'n': len(indptr) - 1, 'nedges': len(indices), 'source': source}, f, indent=1)
+
+
+def is_graph(path):
+    return os.path.isfile(os.path.join(path, 'indptr.npy'))
+
+
+def load_graph(path, mmap_mode='r'):
+    """Returns the memory-mapped (indptr, indices) arrays of a graph directory"""
+    indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode=mmap_mode)
+    indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode=mmap_mode)
+    return indptr, indices
+
+
+def read_neighbors(neighbors_file):
+    """Reads a legacy neighbors file (format : ddG value | neighbors) into (energies, indptr, indices)"""
+    energies = []
+    counts = []
+    ids = []
+    with open(neighbors_file, 'r') as nfile:
+        for line in nfile:
+            line = line.split()
+            energies.append(float(line[0]))
+            counts.append(len(line) - 1)
+            ids.extend(line[1:])
+    indptr = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return np.array(energies), indptr, np.array(ids, dtype=np.int32)
+
+
+def open_neighbors(neighbors_file):
+    """Graph directory of a legacy neighbors file, converted once and cached next to it (+ '.graph').
+
+    The ddG values of the file are kept in the graph directory as energies.npy.
+    """
+    outdir = neighbors_file + '.graph'
+    meta = os.path.join(outdir, 'meta.json')
+    if is_graph(outdir) and os.path.isfile(meta) and os.path.getmtime(meta) >= os.path.getmtime(neighbors_file):
+        return outdir
+    energies, indptr, indices = read_neighbors(neighbors_file)
+    os.makedirs(outdir, exist_ok=True)
+    np.save(os.path.join(outdir, 'energies.npy'), energies)
+    save_graph(outdir, indptr, indices, source=os.path.abspath(neighbors_file))
+    return outdir
+
+
+def edge_sources(indptr):
+    """Source node of each CSR entry"""
+    return np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+
+
+def edge_weights(residues, indptr, indices, matrix, chunk=1 << 22):
+    """Gathers matrix[aa1, aa2] for the substitution carried by each CSR edge.
+
+    Returns (weights, invalid) where invalid holds the ids of the edges that
+    are not a single substitution: these are weighted on their first mutated
+    position (or the diagonal when both sequences are identical).
+    """
+    matrix = np.asarray(matrix)
+    sources = edge_sources(indptr)
+    weights = np.empty(len(indices), dtype=np.float64)
+    invalid = []
+    for start in range(0, len(indices), chunk):
+        src = sources[start:start+chunk]
+        dst = np.asarray(indices[start:start+chunk])
+        r1 = residues[src]
+        r2 = residues[dst]
+        diff = r1 != r2
+        pos = diff.argmax(axis=1) # first mutated position
+        rows = np.arange(len(src))
+        weights[start:start+chunk] = matrix[r1[rows, pos], r2[rows, pos]]
+        invalid.append(np.flatnonzero(diff.sum(axis=1) != 1) + start)
+    return weights, np.concatenate(invalid) if invalid else np.zeros(0, dtype=np.int64)
+
+
+def weights_file(graph_path, matrix, store_path):
+    """Cache file of the edge weights of a graph (directory or legacy neighbors file) for a given matrix"""
+    key = hashlib.sha1(np.ascontiguousarray(matrix, dtype=np.float64).tobytes())
+    key.update(os.path.abspath(store_path).encode())
+    if is_graph(graph_path):
+        return os.path.join(graph_path, 'weights-'+key.hexdigest()[:16]+'.npy')
+    return graph_path+'.weights-'+key.hexdigest()[:16]+'.npy'
+
+
+def cached_edge_weights(graph_path, store, indptr, indices, matrix):
+    """Edge weights computed by edge_weights, saved next to the graph and reused while up to date"""
+    cache = weights_file(graph_path, matrix, store.path)
+    source = os.path.join(graph_path, 'indices.npy') if is_graph(graph_path) else graph_path
+    newest = max(os.path.getmtime(source), os.path.getmtime(os.path.join(store.path, 'meta.json')))
+    if os.path.isfile(cache) and os.path.getmtime(cache) >= newest:
+        return np.load(cache, mmap_mode='r')
+    weights, invalid = edge_weights(store.residues, indptr, indices, matrix)
+    if len(invalid):
+        sources = edge_sources(indptr)
+        examples = ', '.join(str(sources[k])+'-'+str(indices[k]) for k in invalid[:10])
+        print('WARNING: '+str(len(invalid))+' edges are not a single mutation between neighbors ! (e.g. '+examples+')')
+    np.save(cache, weights)
+    return weights
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Build the Hamming-1 neighbor graph of enumerated sequences')
+    parser.add_argument('-s', '--sequences', required=True, help = 'Sequence store directory or enumeration file (format : Amino Acid sequence | ddG value)')
+    parser.add_argument('-o', '--output', required=True, help = 'Output graph directory (CSR arrays)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help = 'Number of worker processes')
+    parser.add_argument('-m', '--matrix', action='append', default=[], help = 'AA to AA matrix (21 x 21, AA_order) used to precompute and cache edge weights, can be repeated')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    with profiler.stage('graph build'):
+        indptr, indices = build_graph(args.sequences, args.output, args.jobs)
+    print(str(len(indptr)-1)+' sequences, '+str(len(indices)//2)+' neighbor pairs')
+    for matrix_file in args.matrix:
+        matrix = np.loadtxt(matrix_file)
+        with profiler.stage('edge weights'):
+            cached_edge_weights(args.output, seqstore.open_store(args.sequences), indptr, indices, matrix)
+        print(matrix_file+' edge weights: '+weights_file(args.output, matrix, seqstore.open_store(args.sequences).path))
@@ -0,0 +1,304 @@
+"""Shortest mutational paths on CSR neighbor graphs (see neighbors.py).
+
+Graphs are given as (indptr, indices, weights) arrays, weights being aligned
+with indices (weight of the edge from i to indices[k], indptr[i] <= k < indptr[i+1]).
+
+k_shortest_paths() gives the K best loopless paths (Yen's algorithm). The
+distances to the goal, computed once per goal on the reversed graph, are
+an exact A* heuristic for all the spur searches, which only keep the nodes
+they explore (dicts instead of arrays over the whole graph).
+
+barriers() gives, from one source, the energy barrier of every node: the
+lowest possible maximum ddG along a path from the source. Minimax paths
+all lie in a minimum spanning forest of the graph weighted by the highest
+ddG of the two ends of each edge (barrier_tree(), Kruskal's algorithm),
+so barriers and witness paths are read from that forest.
+"""
+import os
+from heapq import heappush, heappop, heapify, nsmallest
+from multiprocessing import Pool
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra as csgraph_dijkstra, minimum_spanning_tree, breadth_first_order
+
+import neighbors as nbgraph
+
+_search = None
+_ksearch = None
+
+
+def csr_graph(indptr, indices, weights):
+    """scipy matrix over the graph arrays, without copying them.
+
+    int32 indices and float64 weights (as saved by neighbors.py) are used
+    in place, memory-mapped or not; only indptr (one entry per node) is
+    converted to the int32 index type of scipy.
+    """
+    n = len(indptr) - 1
+    graph = csr_matrix((np.asarray(weights, dtype=np.float64), np.asarray(indices), np.asarray(indptr)), shape=(n, n), copy=False)
+    if not (np.shares_memory(graph.indices, indices) and np.shares_memory(graph.data, weights)):
+        print('WARNING: the graph arrays were copied (indices '+str(indices.dtype)+', weights '+str(weights.dtype)+'), int32 and float64 are used in place')
+    return graph
+
+
+def reverse_files(weights_path):
+    """Cache files (indptr, indices, weights) of the reversed graph of a weights file"""
+    directory, name = os.path.split(weights_path)
+    prefix = os.path.join(directory, name.replace('weights', 'reverse', 1)[:-len('.npy')])
+    return [prefix+'.'+array+'.npy' for array in ('indptr', 'indices', 'weights')]
+
+
+def cached_reverse(graph_path, weights_path):
+    """Memory-mapped (indptr, indices, weights) of the reversed graph, saved next to the weights file once"""
+    files = reverse_files(weights_path)
+    if not all(os.path.isfile(f) and os.path.getmtime(f) >= os.path.getmtime(weights_path) for f in files):
+        indptr, indices = nbgraph.load_graph(graph_path)
+        reverse = csr_graph(indptr, indices, np.load(weights_path, mmap_mode='r')).T.tocsr()
+        for f, array in zip(files, (reverse.indptr.astype(np.int64), reverse.indices, reverse.data)):
+            np.save(f, array)
+        del reverse
+    return tuple(np.load(f, mmap_mode='r') for f in files)
+
+
+def dijkstra(indptr, indices, weights, source, goals=None, csgraph=None, limit=np.inf):
+    """Single-source Dijkstra, returns (dist, pred) arrays over all nodes.
+
+    Unreached nodes have an infinite distance and a -1 predecessor. When
+    goals are given, the search stops as soon as all of them are settled:
+    distances of the goals (and of all settled nodes) are then exact.
+    csgraph may be given to reuse the scipy matrix of the graph between searches.
+    Without goals, the search can be bounded to the nodes within distance limit.
+    """
+    if goals is None:
+        if csgraph is None:
+            csgraph = csr_graph(indptr, indices, weights)
+        dist, pred = csgraph_dijkstra(csgraph, indices=source, return_predecessors=True, limit=limit)
+        pred[pred < 0] = -1
+        return dist, pred.astype(np.int64)
+    return dijkstra_to_goals(indptr, indices, weights, source, goals)
+
+
+def dijkstra_to_goals(indptr, indices, weights, source, goals):
+    """Heap based Dijkstra exiting once every goal is settled"""
+    n = len(indptr) - 1
+    dist = np.full(n, np.inf)
+    pred = np.full(n, -1, dtype=np.int64)
+    settled = np.zeros(n, dtype=bool)
+    remaining = set(int(g) for g in goals)
+    dist[source] = 0
+    candidates = [(0.0, source)]
+
+    while candidates and remaining:
+        dx, x = heappop(candidates) # retrieve the root of the heap
+        if settled[x]:
+            continue
+        settled[x] = True
+        remaining.discard(x)
+        begin, end = indptr[x], indptr[x+1]
+        for y, w in zip(indices[begin:end].tolist(), weights[begin:end].tolist()):
+            if settled[y]:
+                continue
+            dy = dx + w
+            if dy < dist[y]:
+                dist[y] = dy
+                pred[y] = x
+                heappush(candidates, (dy, y)) # place (or update) y in the heap
+    return dist, pred
+
+
+def path_to(pred, source, goal):
+    """Node list from source to goal following predecessors ([] if goal is unreached)"""
+    path = [goal]
+    x = goal
+    while x != source:
+        x = pred[x]
+        if x < 0:
+            return []
+        path.append(int(x))
+    path.reverse()
+    return path
+
+
+def _init_search(graph_path, weights_path, goals, early_exit):
+    """Opens the memory-mapped graph and weights once per process"""
+    global _search
+    indptr, indices = nbgraph.load_graph(graph_path)
+    weights = np.load(weights_path, mmap_mode='r')
+    csgraph = None if early_exit else csr_graph(indptr, indices, weights)
+    _search = (indptr, indices, weights, csgraph, list(goals), early_exit)
+
+
+def _search_from(source):
+    indptr, indices, weights, csgraph, goals, early_exit = _search
+    dist, pred = dijkstra(indptr, indices, weights, source, goals if early_exit else None, csgraph)
+    return [(dist[g], path_to(pred, source, g)) for g in goals]
+
+
+def paths_from_starts(graph_path, weights_path, starts, goals, early_exit=False, jobs=1):
+    """Yields, for each start in order, the list of (distance, path) to each goal.
+
+    With jobs > 1, starts are spread over a process pool; workers memory-map
+    the graph and weights files instead of receiving them, and their scipy
+    matrix uses these arrays in place (only indptr is converted, see csr_graph).
+    """
+    if jobs > 1:
+        with Pool(jobs, initializer=_init_search, initargs=(graph_path, weights_path, goals, early_exit)) as pool:
+            yield from pool.imap(_search_from, starts)
+    else:
+        _init_search(graph_path, weights_path, goals, early_exit)
+        for source in starts:
+            yield _search_from(source)
+
+
+def distances_to(indptr, indices, weights, goal, reverse=None):
+    """Returns (dist, succ): distance of every node to goal and next node on a shortest path (-1 if none).
+
+    reverse may be given to reuse the reversed scipy matrix of the graph between goals.
+    """
+    if reverse is None:
+        reverse = csr_graph(indptr, indices, weights).T.tocsr()
+    dist, succ = csgraph_dijkstra(reverse, indices=goal, return_predecessors=True)
+    succ[succ < 0] = -1
+    return dist, succ.astype(np.int64)
+
+
+def edge_weight(indptr, indices, weights, x, y):
+    begin, end = indptr[x], indptr[x+1]
+    return float(weights[begin + np.flatnonzero(np.asarray(indices[begin:end]) == y)[0]])
+
+
+def _spur_search(indptr, indices, weights, source, goal, to_goal, blocked_nodes, blocked_edges):
+    """A* from source to goal avoiding blocked nodes and the edges from source to blocked_edges"""
+    cost = {source: 0.0}
+    pred = {source: -1}
+    closed = set()
+    candidates = [(to_goal[source], 0.0, source)]
+    while candidates:
+        fx, dx, x = heappop(candidates)
+        if x in closed:
+            continue
+        if x == goal:
+            path = [x]
+            while pred[x] >= 0:
+                x = pred[x]
+                path.append(x)
+            path.reverse()
+            return dx, path
+        closed.add(x)
+        begin, end = indptr[x], indptr[x+1]
+        for y, w in zip(indices[begin:end].tolist(), weights[begin:end].tolist()):
+            if y in closed or y in blocked_nodes or to_goal[y] == np.inf:
+                continue
+            if x == source and y in blocked_edges:
+                continue
+            dy = dx + w
+            if dy < cost.get(y, np.inf):
+                cost[y] = dy
+                pred[y] = x
+                heappush(candidates, (dy + to_goal[y], dy, y))
+    return np.inf, []
+
+
+def k_shortest_paths(indptr, indices, weights, source, goal, k, tree=None):
+    """The k shortest loopless paths from source to goal, as a list of (distance, path) (Yen's algorithm).
+
+    tree is distances_to(goal), which can be shared between sources.
+    """
+    to_goal, succ = tree if tree is not None else distances_to(indptr, indices, weights, goal)
+    if to_goal[source] == np.inf:
+        return []
+    path = [source]
+    while path[-1] != goal:
+        path.append(int(succ[path[-1]]))
+    prefix_costs = [np.cumsum([0.0] + [edge_weight(indptr, indices, weights, x, y) for x, y in zip(path, path[1:])])]
+    found = [(float(prefix_costs[0][-1]), path)]
+    candidates = []
+    seen = {tuple(path)}
+    while len(found) < k:
+        last = found[-1][1]
+        costs = prefix_costs[-1]
+        for i in range(len(last) - 1):
+            root = last[:i+1]
+            blocked_edges = {p[i+1] for d, p in found if len(p) > i + 1 and p[:i+1] == root}
+            spur_cost, spur_path = _spur_search(indptr, indices, weights, last[i], goal, to_goal, set(root[:-1]), blocked_edges)
+            if spur_path and tuple(root[:-1] + spur_path) not in seen:
+                candidate = root[:-1] + spur_path
+                seen.add(tuple(candidate))
+                heappush(candidates, (costs[i] + spur_cost, candidate))
+        if not candidates:
+            break
+        distance, path = heappop(candidates)
+        found.append((float(distance), path))
+        prefix_costs.append(np.cumsum([0.0] + [edge_weight(indptr, indices, weights, x, y) for x, y in zip(path, path[1:])]))
+        if len(candidates) > k - len(found): # only the best remaining candidates can be ranked
+            candidates = nsmallest(k - len(found), candidates)
+            heapify(candidates)
+    return found
+
+
+def _init_ksearch(graph_path, weights_path, starts, k):
+    global _ksearch
+    indptr, indices = nbgraph.load_graph(graph_path)
+    weights = np.load(weights_path, mmap_mode='r')
+    reverse = csr_graph(*cached_reverse(graph_path, weights_path)) # shared by the workers, as the graph
+    _ksearch = (indptr, indices, weights, reverse, list(starts), k)
+
+
+def _ksearch_to(goal):
+    indptr, indices, weights, reverse, starts, k = _ksearch
+    tree = distances_to(indptr, indices, weights, goal, reverse) # shared by all start points
+    return [k_shortest_paths(indptr, indices, weights, source, goal, k, tree) for source in starts]
+
+
+def k_paths_from_starts(graph_path, weights_path, starts, goals, k, jobs=1):
+    """Returns, for each start, the list of the k shortest (distance, path) to each goal.
+
+    Searches are grouped by goal (the distances to a goal are computed once),
+    goals being spread over a process pool when jobs > 1. The reversed graph
+    is cached next to the weights file, so that workers memory-map it too.
+    """
+    cached_reverse(graph_path, weights_path)
+    if jobs > 1:
+        with Pool(jobs, initializer=_init_ksearch, initargs=(graph_path, weights_path, starts, k)) as pool:
+            by_goal = pool.map(_ksearch_to, goals)
+    else:
+        _init_ksearch(graph_path, weights_path, starts, k)
+        by_goal = [_ksearch_to(g) for g in goals]
+    return [[by_goal[j][i] for j in range(len(goals))] for i in range(len(starts))]
+
+
+def barrier_tree(indptr, indices, energies):
+    """Minimum spanning forest of the graph, edges being weighted by the highest ddG of their ends.
+
+    Weights are ddG ranks (ties broken by index, starting at 1 as scipy
+    ignores zero weights), which keeps the same minimax paths.
+    """
+    n = len(indptr) - 1
+    rank = np.empty(n, dtype=np.float64)
+    rank[np.argsort(energies, kind='stable')] = np.arange(1, n + 1)
+    weights = np.maximum(rank[nbgraph.edge_sources(indptr)], rank[np.asarray(indices)])
+    return minimum_spanning_tree(csr_matrix((weights, np.asarray(indices), np.asarray(indptr)), shape=(n, n)))
+
+
+def barriers(tree, energies, source):
+    """Returns (barrier, pred): lowest maximum ddG over the paths from source to each node
+    (infinite if unreached), and predecessor on a minimax path (-1 for the source and unreached nodes).
+    """
+    energies = np.asarray(energies, dtype=np.float64)
+    order, pred = breadth_first_order(tree, source, directed=False, return_predecessors=True)
+    pred[pred < 0] = -1
+    pred = pred.astype(np.int64)
+    n = len(energies)
+    barrier = np.full(n, np.inf)
+    barrier[order] = energies[order]
+    up = np.arange(n) # ancestor, the max of the nodes from each node up to it is in barrier
+    up[order[1:]] = pred[order[1:]]
+    barrier[order] = np.maximum(barrier[order], barrier[up[order]])
+    while True: # pointer jumping up to the source
+        upper = up[up]
+        if np.array_equal(upper, up):
+            return barrier, pred
+        barrier = np.maximum(barrier, barrier[up])
+        up = upper
+
@@ -0,0 +1,145 @@
+"""Per-stage time and memory report of a script run (--profile option).
+
+Scripts wrap their stages (parse, graph build, search, layout, write...)
+in profiler.stage(name), or start them with profiler.start(name), which
+ends the previous one. With --profile FILE, each stage records its wall
+and CPU time, the resident memory before and after it, its peak resident
+memory and the number of Python objects tracked by the garbage collector
+after it; the report is written as JSON when the script exits. Without
+--profile, stages cost nothing.
+
+Peak memory per stage uses the Linux VmHWM counter, reset at the start of
+each stage (/proc/self/clear_refs); elsewhere only the peak of the whole
+run is known. Worker processes are accounted in children_max_rss_mb (the
+largest finished child), not in the stage peaks.
+
+Stages are not nested. Reports of two runs (e.g. on growing enumerations)
+can be compared with:
+    python profiling.py small.json large.json
+"""
+import argparse
+import atexit
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def add_argument(parser):
+    """Adds the shared --profile option to an argparse parser"""
+    parser.add_argument('--profile', default=None, metavar='FILE', help = 'Write the time, peak memory and object counts of each stage to this JSON file')
+
+
+def _status():
+    """(current RSS, peak RSS) in MB from /proc/self/status, or None"""
+    try:
+        with open('/proc/self/status') as f:
+            values = dict(line.split(':', 1) for line in f if line.startswith(('VmRSS', 'VmHWM')))
+        return int(values['VmRSS'].split()[0]) / 1024, int(values['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _reset_peak():
+    """Resets the peak RSS counter (Linux), returns False when it cannot be"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Profiler:
+    """Records named stages, and writes them to output (JSON) at exit if output is given"""
+
+    def __init__(self, output=None, script=None):
+        self.output = output
+        self.enabled = output is not None
+        self.script = script or os.path.basename(sys.argv[0])
+        self.stages = []
+        self.started = time.perf_counter()
+        self.pid = os.getpid()
+        self.current = None
+        if self.enabled:
+            atexit.register(self.write)
+
+    def start(self, name):
+        """Ends the current stage (if any) and starts stage name (for scripts without functions)"""
+        if not self.enabled:
+            return
+        self.stop()
+        status = _status()
+        self.current = (name, status, _reset_peak(), time.perf_counter(), time.process_time())
+
+    def stop(self):
+        """Ends the current stage"""
+        if not self.enabled or self.current is None:
+            return
+        name, status, resettable, start, cpu = self.current
+        seconds, cpu = time.perf_counter() - start, time.process_time() - cpu
+        self.current = None
+        after = _status()
+        self.stages.append({'stage': name, 'seconds': seconds, 'cpu_seconds': cpu,
+                            'rss_before_mb': status[0] if status else None, 'rss_after_mb': after[0] if after else None,
+                            'peak_rss_mb': after[1] if after and resettable else None, 'objects': len(gc.get_objects())})
+
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def report(self):
+        return {'script': self.script, 'argv': sys.argv[1:], 'python': platform.python_version(),
+                'seconds': time.perf_counter() - self.started,
+                'max_rss_mb': max([_max_rss()] + [s['peak_rss_mb'] for s in self.stages if s['peak_rss_mb']]), # peaks are reset by stages
+                'children_max_rss_mb': _max_rss(resource.RUSAGE_CHILDREN), 'stages': self.stages}
+
+    def write(self):
+        if not self.enabled or os.getpid() != self.pid: # not from forked workers
+            return
+        self.stop()
+        with open(self.output, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+def from_args(args, script=None):
+    """Profiler of a script, enabled by its --profile option"""
+    return Profiler(getattr(args, 'profile', None), script)
+
+
+def compare(before, after):
+    """Prints the time and peak memory of the stages of two reports, side by side"""
+    with open(before) as f:
+        a = json.load(f)
+    with open(after) as f:
+        b = json.load(f)
+    stages_b = {s['stage']: s for s in b['stages']}
+    print('stage'.ljust(20)+'before s'.rjust(10)+'after s'.rjust(10)+'ratio'.rjust(8)+'before MB'.rjust(11)+'after MB'.rjust(10))
+    for s in a['stages']:
+        if s['stage'] not in stages_b:
+            continue
+        t = stages_b[s['stage']]
+        ratio = t['seconds'] / s['seconds'] if s['seconds'] else float('nan')
+        print(s['stage'].ljust(20)+'%10.2f%10.2f%8.2f' % (s['seconds'], t['seconds'], ratio)
+              +str(s['peak_rss_mb'] and round(s['peak_rss_mb'], 1)).rjust(11)+str(t['peak_rss_mb'] and round(t['peak_rss_mb'], 1)).rjust(10))
+    print('total'.ljust(20)+'%10.2f%10.2f' % (a['seconds'], b['seconds'])+('%11.1f%10.1f' % (a['max_rss_mb'], b['max_rss_mb'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare the stages of two --profile reports')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+    compare(args.before, args.after)
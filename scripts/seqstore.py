@@ -0,0 +1,310 @@
+"""Packed, memory-mapped store for enumerated RBD sequences.
+
+A store is a directory with one .npy file per column, so that every script
+can memory-map it instead of parsing the text enumeration:
+
+    residues.npy   uint8 N x L matrix, residue indices in AA_order
+    ddg.npy        float64 ddG (or dG) of each sequence
+    complex.npy    float64 complex energy (toulbar2 reports only)
+    monomer.npy    float64 monomer energy (toulbar2 reports only)
+    meta.json      number of sequences, length, alphabet and source file
+
+The toulbar2 report can be filtered while it is streamed (ddG cutoff,
+sequences with given residues dropped, k best ddG values kept), replacing
+the cut/grep/sort passes that made the working enumerations; memory use is
+bounded by the chunk size (and k), whatever the size of the report.
+
+Usage:
+    python seqstore.py -i ddg_mono385_betterdg_noCYS.txt -o enum.store
+    python seqstore.py -i complex_negative.txt -o complex.store
+    python seqstore.py -i complex_negative.txt -o best.store --max-ddg 0 --drop C -k 1000000
+"""
+import argparse
+import json
+import os
+from itertools import islice
+
+import numpy as np
+
+import profiling
+
+AA_order = "IMTNKSRLPHQVADEGFYCW_" # codons order with STOP at the end
+
+STORE_SUFFIX = '.store'
+CHUNK_LINES = 1 << 20
+
+_encode_table = np.full(256, 255, dtype=np.uint8)
+for _i, _a in enumerate(AA_order):
+    _encode_table[ord(_a)] = _i
+_decode_table = np.frombuffer(AA_order.encode(), dtype=np.uint8)
+
+
+def encode(seqs):
+    """Encodes a list of equal length AA strings (or bytes) into a uint8 matrix"""
+    seqs = [s.encode() if isinstance(s, str) else s for s in seqs]
+    if not seqs:
+        return np.zeros((0, 0), dtype=np.uint8)
+    length = len(seqs[0])
+    raw = np.frombuffer(b''.join(seqs), dtype=np.uint8)
+    if raw.size != length * len(seqs):
+        raise ValueError('sequences do not all have length '+str(length))
+    res = _encode_table[raw].reshape(len(seqs), length)
+    if (res == 255).any():
+        bad = bytes(raw[(_encode_table[raw] == 255)][:1]).decode(errors='replace')
+        raise ValueError('unknown residue '+repr(bad)+' (alphabet is '+AA_order+')')
+    return res
+
+
+def decode(residues):
+    """Decodes one residue row into a string, or a matrix into a list of strings"""
+    residues = np.asarray(residues)
+    chars = _decode_table[residues]
+    if chars.ndim == 1:
+        return chars.tobytes().decode()
+    return [row.tobytes().decode() for row in chars]
+
+
+class SequenceStore:
+    """Read-only view over a store directory (columns are memory-mapped)"""
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.residues = np.load(os.path.join(path, 'residues.npy'), mmap_mode=mmap_mode)
+        self.columns = {}
+        for name in self.meta['columns']:
+            self.columns[name] = np.load(os.path.join(path, name+'.npy'), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return self.residues.shape[0]
+
+    @property
+    def length(self):
+        return self.residues.shape[1]
+
+    @property
+    def ddg(self):
+        return self.columns['ddg']
+
+    def sequence(self, i):
+        return decode(self.residues[i])
+
+    def sequences(self, indices=None):
+        if indices is None:
+            return decode(self.residues)
+        return decode(self.residues[np.asarray(indices)])
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def _count_lines(filename):
+    n = 0
+    last = b''
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            n += block.count(b'\n')
+            last = block
+    if last and not last.endswith(b'\n'):
+        n += 1
+    return n
+
+
+def _is_sequence(token):
+    return all(c in AA_order for c in token)
+
+
+def _sniff(filename):
+    """Returns (sequence length, number of energy columns) from the first data line"""
+    with open(filename) as f:
+        for line in f:
+            tokens = line.split()
+            if tokens and _is_sequence(tokens[0]):
+                return len(tokens[0]), len(tokens) - 1
+    raise ValueError(filename+': no sequence found')
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def _parse_chunk(lines, length, ncols, first_line=1):
+    """Parses data lines into (residues, energies, rejected line numbers).
+
+    Header, comment and footer lines are skipped. Lines starting with a
+    sequence that cannot be read (other length, missing or non numeric
+    values) are rejected: skipping them would shift the index of all the
+    following sequences.
+    """
+    seqs = []
+    values = []
+    rejected = []
+    for number, line in enumerate(lines, first_line):
+        tokens = line.split()
+        if len(tokens) > ncols and len(tokens[0]) == length and all(_is_number(t) for t in tokens[len(tokens)-ncols:]):
+            seqs.append(tokens[0])
+            values.extend(tokens[len(tokens)-ncols:])
+        elif tokens and _is_sequence(tokens[0]) and (len(tokens[0]) == length or len(tokens) > ncols):
+            rejected.append(number)
+    energies = np.array(values, dtype=np.float64).reshape(len(seqs), ncols)
+    if not seqs: # chunk of header or footer lines only
+        return np.zeros((0, length), dtype=np.uint8), energies, rejected
+    return encode(seqs), energies, rejected
+
+
+def _filter(res, ene, max_ddg=None, drop=None):
+    """Rows whose ddG (last energy column) is at most max_ddg and without any residue of drop"""
+    keep = np.ones(len(res), dtype=bool)
+    if max_ddg is not None:
+        keep &= ene[:, -1] <= max_ddg
+    if drop:
+        keep &= ~np.isin(res, encode([drop])[0]).any(axis=1)
+    return keep
+
+
+def _shrink(path, n):
+    """Keeps the first n rows of a .npy file, copying them by chunks"""
+    full = np.load(path, mmap_mode='r')
+    if len(full) == n:
+        return
+    tmp = path+'.tmp.npy'
+    trimmed = np.lib.format.open_memmap(tmp, mode='w+', dtype=full.dtype, shape=(n,)+full.shape[1:])
+    for start in range(0, n, CHUNK_LINES):
+        stop = min(start + CHUNK_LINES, n)
+        trimmed[start:stop] = full[start:stop]
+    trimmed.flush()
+    del trimmed, full
+    os.replace(tmp, path)
+
+
+class _TopK:
+    """The k rows of lowest ddG seen so far (ties go to the earliest rows)"""
+
+    def __init__(self, k, length, ncols):
+        self.k = k
+        self.res = np.zeros((0, length), dtype=np.uint8)
+        self.ene = np.zeros((0, ncols))
+        self.order = np.zeros(0, dtype=np.int64)
+
+    def push(self, res, ene, order):
+        self.res = np.concatenate((self.res, res))
+        self.ene = np.concatenate((self.ene, ene))
+        self.order = np.concatenate((self.order, order))
+        if len(self.order) > self.k:
+            best = np.lexsort((self.order, self.ene[:, -1]))[:self.k]
+            self.res, self.ene, self.order = self.res[best], self.ene[best], self.order[best]
+
+    def rows(self):
+        """Kept rows in input order"""
+        order = np.argsort(self.order)
+        return self.res[order], self.ene[order]
+
+
+def convert(infile, outdir, chunk_lines=CHUNK_LINES, max_ddg=None, drop=None, top=None):
+    """One-time conversion of a text enumeration into a store directory.
+
+    Accepts the 'sequence | ddG' enumeration format and the toulbar2
+    'complex_negative.txt' report (sequence | complex | monomer | dG).
+    The input is streamed, memory use is bounded by chunk_lines (and top).
+    Lines are kept if their ddG is at most max_ddg and their sequence has
+    none of the residues of drop (e.g. 'C'); with top, only the top
+    sequences of lowest ddG are kept. Kept sequences stay in input order.
+    """
+    length, nvalues = _sniff(infile)
+    if os.path.isfile(os.path.join(outdir, 'meta.json')): # not a store until the conversion succeeds
+        os.remove(os.path.join(outdir, 'meta.json'))
+    if nvalues >= 3:
+        columns = ['complex', 'monomer', 'ddg'] # last 3 values of a toulbar2 report line
+    else:
+        columns = ['ddg']
+    os.makedirs(outdir, exist_ok=True)
+    if top is None:
+        nmax = _count_lines(infile)
+        residues = np.lib.format.open_memmap(os.path.join(outdir, 'residues.npy'), mode='w+', dtype=np.uint8, shape=(nmax, length))
+        energies = [np.lib.format.open_memmap(os.path.join(outdir, name+'.npy'), mode='w+', dtype=np.float64, shape=(nmax,)) for name in columns]
+    else:
+        best = _TopK(top, length, len(columns))
+
+    n = 0
+    nread = 0
+    nlines = 0
+    nrejected = 0
+    rejected = [] # first rejected line numbers
+    with open(infile) as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            res, ene, bad = _parse_chunk(lines, length, len(columns), nlines + 1)
+            nlines += len(lines)
+            nrejected += len(bad)
+            rejected.extend(bad[:max(0, 10 - len(rejected))])
+            keep = _filter(res, ene, max_ddg, drop)
+            if top is None:
+                res, ene = res[keep], ene[keep]
+                residues[n:n+len(res)] = res
+                for i, column in enumerate(energies):
+                    column[n:n+len(res)] = ene[:, i]
+                n += len(res)
+            else:
+                best.push(res[keep], ene[keep], nread + np.flatnonzero(keep))
+            nread += len(res)
+    if nrejected:
+        raise ValueError(infile+': '+str(nrejected)+' sequence lines could not be read (length '+str(length)+' and '+str(len(columns))
+                         +' values expected), e.g. lines '+', '.join(str(l) for l in rejected))
+
+    if top is None:
+        del residues, energies
+        for name in ['residues'] + columns: # header or filtered out lines: shrink the files
+            _shrink(os.path.join(outdir, name+'.npy'), n)
+    else:
+        res, ene = best.rows()
+        n = len(res)
+        np.save(os.path.join(outdir, 'residues.npy'), res)
+        for i, name in enumerate(columns):
+            np.save(os.path.join(outdir, name+'.npy'), np.ascontiguousarray(ene[:, i]))
+    meta = {'n': n, 'length': length, 'alphabet': AA_order, 'columns': columns, 'source': os.path.abspath(infile)}
+    if max_ddg is not None or drop or top is not None:
+        meta['filters'] = {'read': nread, 'max_ddg': max_ddg, 'drop': drop, 'top': top}
+    with open(os.path.join(outdir, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return SequenceStore(outdir)
+
+
+def open_store(path):
+    """Opens a store directory, or a text enumeration through its cached store.
+
+    For a text file, the store is kept next to it (path + '.store') and is
+    rebuilt only when the text file is newer than the cached store.
+    """
+    if is_store(path):
+        return SequenceStore(path)
+    cached = path + STORE_SUFFIX
+    if is_store(cached) and os.path.getmtime(os.path.join(cached, 'meta.json')) >= os.path.getmtime(path):
+        return SequenceStore(cached)
+    return convert(path, cached)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert a sequence enumeration into a memory-mapped sequence store')
+    parser.add_argument('-i', '--input', required=True, help = 'Input file (format : Amino Acid sequence | ddG value, or toulbar2 complex_negative.txt report)')
+    parser.add_argument('-o', '--output', help = 'Output store directory (default : input file + .store)')
+    parser.add_argument('-c', '--chunk', type=int, default=CHUNK_LINES, help = 'Number of lines parsed at once')
+    parser.add_argument('--max-ddg', type=float, default=None, help = 'Keep sequences whose ddG (dG of toulbar2 reports) is at most this value')
+    parser.add_argument('--drop', default=None, help = 'Drop sequences containing any of these residues (e.g. C)')
+    parser.add_argument('-k', '--top', type=int, default=None, help = 'Keep only the k sequences of lowest ddG (kept in input order)')
+    profiling.add_argument(parser)
+    args = parser.parse_args()
+    profiler = profiling.from_args(args)
+
+    if not args.output and (args.max_ddg is not None or args.drop or args.top is not None):
+        parser.error('filtered stores need an output directory (-o)')
+    with profiler.stage('parse'):
+        store = convert(args.input, args.output or args.input + STORE_SUFFIX, args.chunk, args.max_ddg, args.drop, args.top)
+    print(str(len(store))+' sequences of length '+str(store.length)+' stored in '+store.path)
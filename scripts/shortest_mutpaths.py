@@ -1,118 +1,63 @@
 import argparse
+import os
 from math import exp
-from heapq import *
 import numpy as np
 from scipy.linalg import expm
+import seqstore
+import neighbors as nbgraph
+import pathsearch
+import profiling
 
 parser = argparse.ArgumentParser(description = 'Prepare for Dijkstra')
-parser.add_argument('-i', '--input', required=True, help = 'Input file with energies and neighbors IDs (format : ddG value | neighbors)')
-parser.add_argument('-e', '--enumeration', required=True, help = 'Input file with sequences enumerated (format : Amino Acid sequence | ddG value)')
-parser.add_argument('-m', '--mutprobas', required=True, help = 'File containing mutational probabilities (converted into energies) (format : Mutational probability converted into energy of a sequence to each of its neighbors)')
+parser.add_argument('-i', '--input', required=True, help = 'Input file with energies and neighbors IDs (format : ddG value | neighbors) or neighbor graph directory (see neighbors.py)')
+parser.add_argument('-e', '--enumeration', required=True, help = 'Input file with sequences enumerated (format : Amino Acid sequence | ddG value) or sequence store directory')
+parser.add_argument('-m', '--mutprobas', default=None, help = 'File containing mutational probabilities (converted into energies), required unless -b is given (format : Mutational probability converted into energy of a sequence to each of its neighbors)')
 parser.add_argument('-s', '--start', required=True, help = 'Starting point ID (format : Cluster ID \':\' Sequence index)')
 parser.add_argument('-g', '--goal', required=True, help = 'Goal ID (format : Cluster ID \':\' Sequence index)')
 parser.add_argument('-r', '--results', required=True, help = 'Output file')
+parser.add_argument('-j', '--jobs', type=int, default=1, help = 'Number of processes sharing the start points (the graph is memory-mapped by each of them)')
+parser.add_argument('-x', '--early-exit', action='store_true', help = 'Stop each search once all goals are reached instead of exploring the whole graph')
+parser.add_argument('-k', '--k-paths', type=int, default=None, help = 'Write the K shortest paths of each start/goal pair, with their rank (Yen\'s algorithm)')
+parser.add_argument('-b', '--barrier', action='store_true', help = 'Write the energy barrier (lowest maximum ddG along a path) of each start/goal pair and a path reaching it, instead of shortest paths')
+profiling.add_argument(parser)
 
 #parser.add_argument('-e', '--energies', required=True, help = '')
 args = parser.parse_args()
+if not args.barrier and args.mutprobas is None:
+    parser.error('-m/--mutprobas is required unless -b/--barrier is given')
+if args.k_paths and args.early_exit:
+    parser.error('-x/--early-exit cannot be used with -k/--k-paths (the K paths are searched from a full tree of each goal)')
+profiler = profiling.from_args(args)
 
 neighbors_file = args.input
 start = args.start
 goal = args.goal
 mutprobasfile = args.mutprobas
 results = args.results
-energies = []
-sequences = []
-AA_order = "IMTNKSRLPHQVADEGFYCW_" # codons order with STOP at the end
-
-with open(args.enumeration, 'r') as f:
-    lines = f.read().splitlines()
-    for line in lines:
-        sequences.append(line.split()[0])
-        
-
-a2a_energy = np.loadtxt(mutprobasfile)
-
-# Find the mutation proba "energy" for two neighbor sequences
-def getA2Aenergy(s1, s2):
-    seq1 = sequences[s1]
-    seq2 = sequences[s2]
-    findmut = False
-    for i1, aa1 in enumerate(seq1):
-        if aa1!=seq2[i1]:
-            if not findmut:
-                mut1 = aa1
-                mut2 = seq2[i1]
-                findmut = True
-            else:
-                print("WARNING: there is more than one mutation between neighbors !")
-    for i, aa in enumerate(AA_order):
-        if aa == mut1:
-            imut1 = i
-        if aa == mut2:
-            imut2 = i
-    return a2a_energy[imut1, imut2]
-
+with profiler.stage('parse'):
+    store = seqstore.open_store(args.enumeration)
+    a2a_energy = np.loadtxt(mutprobasfile) if not args.barrier else None # barriers only use the ddG values
 
 def create_graph(neighbors_file):
-    cpt = 0
-    neighbors = []
-    
-    with open(neighbors_file,'r') as nfile:
-        lines = nfile.read().splitlines()
-        for line in lines:
-            line = line.split()
-            intline = list(map(int,line[1:]))
-            neighbors.append(intline) # for each sequence, store distance/ID tuple of each neighbor in a dictionnary
-            energies.append(float(line[0]))
-            cpt+=1
-
-
-        dis_neigh = {}
-
-        for cpt,neigh in enumerate(neighbors):
-            dis_neigh[cpt] = [(getA2Aenergy(cpt,x), x) for x in neigh]
-        return(dis_neigh)
-
-# Shortest path using Dijkstra algorithm
-
-def dijkstra (u, v):
-    visited = set()
-    d = {u: 0}
-    p = {}
-    candidates = [(0, u)] 
-
-    while candidates != []:
-
-        dx, x = heappop(candidates) # retrieve the root of the heap
-        if x in visited:
-            continue
-
-        visited.add(x)
-
-        for w, y in neighbors(x):
-            if y in visited:
-                continue
-            dy = dx + w
-            if y not in d or d[y] > dy:
-                d[y] = dy
-                heappush(candidates, (dy, y)) # place (or update) y in the heap
-                p[y] = x
-
-    path = [v]
-    x = v
-    while x != u:
-        x = p[x]
-        path.insert(0, x)
-    
-    return d[v], path
-
-
+    """Returns the graph directory and edge weights file of the neighbor graph"""
+    global energies
+    if nbgraph.is_graph(neighbors_file):
+        graph_path = neighbors_file
+        energies = store.ddg
+    else:
+        graph_path = nbgraph.open_neighbors(neighbors_file) # legacy file, converted once
+        energies = np.load(os.path.join(graph_path, 'energies.npy'), mmap_mode='r')
+    if args.barrier: # no mutation proba weights
+        return graph_path, None
 
-def neighbors(v):
-    return graph[v]
+    indptr, indices = nbgraph.load_graph(graph_path)
+    # mutation proba "energy" of each edge, cached next to the graph
+    nbgraph.cached_edge_weights(graph_path, store, indptr, indices, a2a_energy)
+    return graph_path, nbgraph.weights_file(graph_path, a2a_energy, store.path)
 
 
-graph = create_graph(neighbors_file)
+with profiler.stage('graph build'):
+    graph_path, weights_path = create_graph(neighbors_file)
 
 
 startpoints = {}
@@ -130,15 +75,49 @@ with open(goal,'r') as sf:
         endpoints[l[0]] = l[1]
 
 
-with open(results,'w') as f:
-    for s in startpoints:
-        for g in endpoints:
-            print(s)
-            print(g)
-            distance, path = dijkstra(int(startpoints[s]),int(endpoints[g]))
-            print(distance)
-            best_dis_neigh = [(energies[x],x) for x in path]
-            f.write("start: "+s+" end: cluster "+g+" distance: "+str(distance)+"\n")
-            for (e,i) in best_dis_neigh:
-                f.write(str(e)+" "+str(i)+"\n")
-   
+starts = [int(startpoints[s]) for s in startpoints]
+goals = [int(endpoints[g]) for g in endpoints]
+
+with profiler.stage('search'): # paths are written as they are found
+    if args.barrier:
+        # one spanning tree for all start points, barriers of all nodes from each start at once
+        indptr, indices = nbgraph.load_graph(graph_path)
+        tree = pathsearch.barrier_tree(indptr, indices, energies)
+        with open(results,'w') as f:
+            for s, source in zip(startpoints, starts):
+                barrier, pred = pathsearch.barriers(tree, energies, source)
+                for g, target in zip(endpoints, goals):
+                    path = pathsearch.path_to(pred, source, target)
+                    print(s)
+                    print(g)
+                    print(barrier[target])
+                    f.write("start: "+s+" end: cluster "+g+" barrier: "+str(barrier[target])+"\n")
+                    for i in path:
+                        f.write(str(energies[i])+" "+str(i)+"\n")
+    elif args.k_paths:
+        # K shortest paths, searches are grouped by goal and goals are spread over args.jobs processes
+        ksearches = pathsearch.k_paths_from_starts(graph_path, weights_path, starts, goals, args.k_paths, args.jobs)
+        with open(results,'w') as f:
+            for s, found in zip(startpoints, ksearches):
+                for g, kpaths in zip(endpoints, found):
+                    for rank, (distance, path) in enumerate(kpaths or [(np.inf, [])]):
+                        print(s)
+                        print(g)
+                        print(rank+1, distance)
+                        f.write("start: "+s+" end: cluster "+g+" rank: "+str(rank+1)+" distance: "+str(distance)+"\n")
+                        for i in path:
+                            f.write(str(energies[i])+" "+str(i)+"\n")
+    else:
+        # one search per start point gives the distances to all goals, start points are spread over args.jobs processes
+        searches = pathsearch.paths_from_starts(graph_path, weights_path, starts, goals, args.early_exit, args.jobs)
+
+        with open(results,'w') as f:
+            for s, found in zip(startpoints, searches):
+                for g, (distance, path) in zip(endpoints, found):
+                    print(s)
+                    print(g)
+                    print(distance)
+                    best_dis_neigh = [(energies[x],x) for x in path]
+                    f.write("start: "+s+" end: cluster "+g+" distance: "+str(distance)+"\n")
+                    for (e,i) in best_dis_neigh:
+                        f.write(str(e)+" "+str(i)+"\n")
@@ -1,20 +1,38 @@
 import argparse
+import os
+import sys
 import numpy as np
 import igraph as ig
 import leidenalg as la
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import seqstore
+import neighbors as nbgraph
+import profiling
+import communities
+from communities import local_opt_repartition
+
 parser =  argparse.ArgumentParser(description='Partition a graph using Leiden algorithm')
 
 parser.add_argument('-n', '--nodes', required=True, help='File containing sequence indices and their ddG values with the L strain sequence (format : Sequence index | ddG value | Node size) ')
-parser.add_argument('-e', '--edges', required=True, help='File containing edges with mutational probabilities (format : Sequence 1 index | Sequence 2 index | mutational probability between them)')
+parser.add_argument('-e', '--edges', required=True, help='File containing edges with mutational probabilities (format : Sequence 1 index | Sequence 2 index | mutational probability between them) or neighbor graph directory (see scripts/neighbors.py)')
+parser.add_argument('-ew', '--edge-weights', required=False, help='With a neighbor graph directory: AA to AA mutational probability matrix (21 x 21) or .npy file of probabilities aligned with the graph indices (default : 1 for every edge)')
 parser.add_argument('-lo', '--loi', required=True, help='File containing indices of 59 local optima sequences(PVs) (format : Sequence index)')
 parser.add_argument('-pv', '--pvs', required=True, help='File containing indices of 8 active PVs (format : Cluster ID \':\' Sequence index)')
 parser.add_argument('-w','--wt', required=True, help='File containing indice of the L strain sequence (format : Cluster ID \':\' Sequence index)' )
-parser.add_argument('-seq', '--sequences',required=True, help='File containing all 4507188 PV sequences including the L strain (format : Amino Acid sequence | ddG value)')
+parser.add_argument('-seq', '--sequences',required=True, help='File containing all 4507188 PV sequences including the L strain (format : Amino Acid sequence | ddG value) or sequence store directory')
 parser.add_argument('-t', '--threshold', default=0, required=False, help='Prune edges with defined weight below given threshold')
+parser.add_argument('--sweep', required=False, help='Parameter sweep mode: output prefix of the memberships (.memberships.npy) and summary (.summary.tsv) files, no plot is made')
+parser.add_argument('--thresholds', default=None, help='Sweep: comma separated edge thresholds (default : --threshold)')
+parser.add_argument('--partition-types', default='modularity', help='Sweep: comma separated partition types among '+', '.join(communities.PARTITION_TYPES))
+parser.add_argument('--resolutions', default='1', help='Sweep: comma separated resolution parameters (for rbconfiguration, rber and cpm)')
+parser.add_argument('--seeds', default='0', help='Sweep: comma separated random seeds')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='Sweep: number of processes')
+profiling.add_argument(parser)
 
 
 args = parser.parse_args()
+profiler = profiling.from_args(args)
 
 nodes_file = args.nodes
 edges_file = args.edges
@@ -26,56 +44,23 @@ mut_threshold = float(args.threshold)
 
 
 # %%
-##for nodes##
-nodes = []
-nodes_size =[]
-
-
-##for edges##
-edges = []
-edges_proba= []
-self_edges= []
-
 # for local optima indices
 lo_indices = []
 pv_indices = []
 w_indices = []
 
 ## for sequences
-sequences = []
+sequences = None
 
 
 # %%
-def local_opt_repartition(lo_list, part):
-    lo_repart = []
-    for i in range(len(part.sizes())): #number of communities
-        lo_repart.append(0)
-    for i in lo_list:
-        lo_repart[part.membership[i]]+=1
-    return lo_repart # number of local optima per community
-
-
-# %%
-g = ig.Graph(directed=True)
-
-
-with open(nodes_file,'r') as nfile:
-    lines=nfile.read().splitlines()
-    for line in lines:
-        line=line.split()
-        nodes.append(line[0])
-        nodes_size.append(float(line[2]))
-    g.add_vertices(nodes)
-    
-with open(edges_file,'r') as efile:
-    lines=efile.read().splitlines()
-    for line in lines:
-        line=line.split()
-        if line[0]!=line[1] and float(line[2]) > mut_threshold: # delete self edges and prune with threshold
-            edges.append((line[0],line[1]))
-            edges_proba.append(float(line[2])) # filling edges probabilities list 
-    g.add_edges(edges)
-
+# integer vertex ids, parsed text is cached as .npz next to the nodes and edges files
+profiler.start('parse')
+node_ids, nodes_size = communities.load_nodes(nodes_file)
+if nbgraph.is_graph(edges_file):
+    edges_src, edges_dst, edges_proba = communities.load_csr_edges(edges_file, args.edge_weights, seq_file, node_ids)
+else:
+    edges_src, edges_dst, edges_proba = communities.load_edges(edges_file, node_ids)
 if lo_file:
     with open(lo_file, 'r') as lfile:
         lines=lfile.read().splitlines()
@@ -96,14 +81,22 @@ if w_file:
 
             
 if seq_file:
-    with open(seq_file, 'r') as seqfile:
-        lines=seqfile.read().splitlines()
-        for line in lines:
-            sequences.append(line.split()[0])
-g.es["weights"] = edges_proba  # adding weight attributes to the graph
+    sequences = seqstore.open_store(seq_file) # memory-mapped, decoded on demand
+
+if args.sweep:
+    profiler.start('partition')
+    thresholds = [float(t) for t in args.thresholds.split(',')] if args.thresholds else [mut_threshold]
+    runs = communities.sweep_runs(thresholds, args.partition_types.split(','), [float(r) for r in args.resolutions.split(',')], [int(s) for s in args.seeds.split(',')])
+    communities.sweep(args.sweep, len(node_ids), edges_src, edges_dst, edges_proba, runs, lo_indices, w_indices[0], jobs=args.jobs)
+    print(str(len(runs))+' runs written to '+args.sweep+'.memberships.npy and '+args.sweep+'.summary.tsv')
+    sys.exit(0)
+
+profiler.start('graph build')
+g = communities.build_graph(len(node_ids), edges_src, edges_dst, edges_proba, mut_threshold) # delete self edges and prune with threshold
 
 
 # %%
+profiler.start('partition')
 partition = la.find_partition(g, weights = 'weights', partition_type=la.ModularityVertexPartition, n_iterations=50)
 
 # %%
@@ -111,71 +104,67 @@ print('Nb partitions: '+str(len(partition.sizes())))
 print(partition.sizes())
 
 # %%
-aggregated_partition = partition.aggregate_partition() # one node per community
-
-# %%
-part_wt = partition.membership[w_indices[0]]
-aggregated_partition.graph.es['color'] = 'light gray'
-aggregated_partition.graph.delete_vertices(aggregated_partition.graph.vs.select(_degree_lt=3)) # removing from graph communities with less than 3 neighbors
+profiler.start('communities')
+membership = np.array(partition.membership)
+part_wt = membership[w_indices[0]]
+keep = communities.edge_mask(edges_src, edges_dst, edges_proba, mut_threshold)
+comm_weights = communities.community_matrix(membership, edges_src[keep], edges_dst[keep], edges_proba[keep]) # sum of weights between communities
+members_order, members_bounds = communities.community_members(membership)
 
 # %% [markdown]
-# Checking how many vertices are left
+# Community graph, simplified by removing self edges and undirected, without communities with less than 3 neighbors
 
 # %%
-print(len(aggregated_partition.graph.vs))
-
-# %% [markdown]
-# Community graph, simplified by removing self edges and undirected
-
-# %%
-comm_graph = aggregated_partition.graph.simplify().as_undirected()
+comm_graph, comm_vertex = communities.community_graph(comm_weights, min_degree=3)
+print(len(comm_graph.vs))
 
 # %% [markdown]
 # Counting edges from WT community to other communities and coloring them in red. Also modifying edge width by adding edge size proportional to log of sum of weights from WT community to others.
 # For the communities that are linked to the WT community we check if they contain PVs. If they do, we write a file with all of the sequences in that community.
 
 # %%
-nb_out_edges = 0 # number of edges from wt community to other communities
+pv_comms = membership[pv_indices] # community of each active PV
+comm_graph.es['color'] = 'light gray'
 comm_graph.es['edgewidth'] = 0.5
-if part_wt < len(comm_graph.vs):
-    for i in range(len(comm_graph.vs)):
-        if i != part_wt:
-            out_edge = comm_graph.es.select(_between=(aggregated_partition[part_wt], aggregated_partition[i]))
-            comm_graph.es.select(_between=(aggregated_partition[part_wt], aggregated_partition[i]))['color'] = 'indianred' # coloring edges that connect WT community in red
-            comm_graph.es.select(_between=(aggregated_partition[part_wt], aggregated_partition[i]))['edgewidth'] = np.log2(1+aggregated_partition.weight_from_comm(i,part_wt)) # edge size proportional to log of sum of weights from l strain com to others
-            if (len(out_edge)==1):
-                nb_out_edges+=1
-                for j in pv_indices:
-                    if part_wt == partition.membership[j]: # looking for the active PV that is in the community of the WT
-                        print(j)
-                        print(sequences[j])
-                    if i == partition.membership[j]: # looking for the active PV that is in the community linked to the WT community
-                        print(j)
-                        print(sequences[j])
-                        with open("pv_community_"+str(i)+".fasta",'w') as f:
-                            for k in partition[i]:
-                                f.write(">pv"+str(k)+'\n')
-                                f.write(sequences[k]+'\n')
-            elif (len(out_edge)>1):
-                print(len(out_edge))
+nb_out_edges = 0 # number of edges from wt community to other communities
+if comm_vertex[part_wt] >= 0:
+    for j in np.asarray(pv_indices)[pv_comms == part_wt]: # looking for the active PV that is in the community of the WT
+        print(j)
+        print(sequences.sequence(j))
+    for e in comm_graph.es[comm_graph.incident(comm_vertex[part_wt])]:
+        i = comm_graph.vs[e.target if e.source == comm_vertex[part_wt] else e.source]['community']
+        e['color'] = 'indianred' # coloring edges that connect WT community in red
+        e['edgewidth'] = np.log2(1+comm_weights[i, part_wt]) # edge size proportional to log of sum of weights from l strain com to others
+        nb_out_edges+=1
+        for j in np.asarray(pv_indices)[pv_comms == i]: # looking for the active PV that is in the community linked to the WT community
+            print(j)
+            print(sequences.sequence(j))
+        if (pv_comms == i).any():
+            with open("pv_community_"+str(i)+".fasta",'w') as f:
+                for k in members_order[members_bounds[i]:members_bounds[i+1]]:
+                    f.write(">pv"+str(k)+'\n')
+                    f.write(sequences.sequence(k)+'\n')
 print("Nb of edges from WT community to other communities : "+str(nb_out_edges))
     
 
 # %%
 comm_graph.vs['color']='gainsboro'
-comm_graph.vs[part_wt]['color']='red'
 comm_graph.vs['framewidth']=0.5
-for i in lo_indices:
-    if partition.membership[i] < len(comm_graph.vs) and partition.membership[i] != part_wt:
-        comm_graph.vs[partition.membership[i]]['color']='lightsteelblue'
+if comm_vertex[part_wt] >= 0:
+    comm_graph.vs[comm_vertex[part_wt]]['color']='red'
+for c in np.unique(membership[lo_indices]):
+    if comm_vertex[c] >= 0 and c != part_wt:
+        comm_graph.vs[comm_vertex[c]]['color']='lightsteelblue'
 
-for i in pv_indices:
-    if partition.membership[i] < len(comm_graph.vs):
-        comm_graph.vs[partition.membership[i]]['framewidth']=1.5
+for c in np.unique(pv_comms):
+    if comm_vertex[c] >= 0:
+        comm_graph.vs[comm_vertex[c]]['framewidth']=1.5
 
 # %%
+profiler.start('layout')
 layout = comm_graph.layout_kamada_kawai(maxiter=20000)
-ig.plot(comm_graph, "test_w.svg", opacity=0.6, vertex_size = 5*np.log10(partition.sizes()), edge_width=comm_graph.es['edgewidth'], edge_arrow_width=0.5, edge_arrow_size=0.5, edge_color = comm_graph.es['color'], layout = layout, vertex_frame_width=comm_graph.vs['framewidth'])
+profiler.start('plot')
+ig.plot(comm_graph, "test_w.svg", opacity=0.6, vertex_size = 5*np.log10(np.diff(members_bounds)[comm_graph.vs['community']]), edge_width=comm_graph.es['edgewidth'], edge_arrow_width=0.5, edge_arrow_size=0.5, edge_color = comm_graph.es['color'], layout = layout, vertex_frame_width=comm_graph.vs['framewidth'])
 #ig.plot(comm_graph, opacity=0.6, vertex_size = 5*np.log10(partition.sizes()), edge_width=0.5, edge_arrow_width=0.5, edge_arrow_size=0.5, edge_color = comm_graph.es['color'], layout = layout, vertex_frame_width=comm_graph.vs['framewidth'])
 
 
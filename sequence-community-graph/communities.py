@@ -0,0 +1,247 @@
+"""Graph loading helpers for Leiden_community_graph.py.
+
+Nodes and edges text files are parsed in chunks into NumPy arrays and cached
+next to them as .npz files, so that later runs (with another threshold for
+example) do not parse text again. Vertices are integer ids: edge endpoints
+are positions in the nodes file.
+
+community_matrix() and community_graph() replace per-community edge
+selections on the aggregated graph by one sparse aggregation.
+
+sweep() runs Leiden over a grid of thresholds, partition types, resolutions
+and seeds with a process pool, loading the graph only once.
+"""
+import csv
+import os
+import sys
+from itertools import islice, product
+from multiprocessing import Pool
+
+import numpy as np
+import igraph as ig
+import leidenalg as la
+from scipy.sparse import coo_matrix
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import seqstore
+import neighbors as nbgraph
+
+CHUNK_LINES = 1 << 20
+
+PARTITION_TYPES = {
+    'modularity': la.ModularityVertexPartition,
+    'rbconfiguration': la.RBConfigurationVertexPartition,
+    'rber': la.RBERVertexPartition,
+    'cpm': la.CPMVertexPartition,
+    'significance': la.SignificanceVertexPartition,
+    'surprise': la.SurpriseVertexPartition,
+}
+RESOLUTION_TYPES = ('rbconfiguration', 'rber', 'cpm') # types with a resolution parameter
+
+_sweep = None
+
+
+def load_table(filename, chunk_lines=CHUNK_LINES):
+    """Whitespace separated numeric table as a float64 matrix, cached as filename + '.npz'"""
+    cache = filename + '.npz'
+    stamp = np.array([os.path.getsize(filename), os.path.getmtime(filename)])
+    if os.path.isfile(cache):
+        with np.load(cache) as data:
+            if np.array_equal(data['stamp'], stamp):
+                return data['table']
+    chunks = []
+    with open(filename) as f:
+        while True:
+            lines = list(islice(f, chunk_lines))
+            if not lines:
+                break
+            chunks.append(np.loadtxt(lines, ndmin=2))
+    table = np.concatenate(chunks) if chunks else np.zeros((0, 0))
+    np.savez(cache, table=table, stamp=stamp)
+    return table
+
+
+def load_nodes(nodes_file):
+    """Returns (node ids, node sizes) from a nodes file (format : Sequence index | ddG value | Node size)"""
+    table = load_table(nodes_file)
+    return table[:, 0].astype(np.int64), table[:, 2]
+
+
+def load_edges(edges_file, node_ids=None):
+    """Returns (sources, targets, probabilities) with sources and targets as vertex positions.
+
+    edges_file is either a text edge list (format : Sequence 1 index |
+    Sequence 2 index | mutational probability) or a neighbor graph directory
+    (probabilities then come from load_csr_weights).
+    """
+    table = load_table(edges_file)
+    src = table[:, 0].astype(np.int64)
+    dst = table[:, 1].astype(np.int64)
+    if node_ids is not None:
+        src = vertex_positions(node_ids, src, edges_file)
+        dst = vertex_positions(node_ids, dst, edges_file)
+    return src, dst, table[:, 2]
+
+
+def vertex_positions(node_ids, ids, source='edges'):
+    """Positions in node_ids of the sequence indices ids, ValueError if one is not a node"""
+    if np.array_equal(node_ids, np.arange(len(node_ids))):
+        pos = ids
+        missing = (ids < 0) | (ids >= len(node_ids))
+    else:
+        order = np.argsort(node_ids)
+        pos = order[np.minimum(np.searchsorted(node_ids, ids, sorter=order), len(order) - 1)]
+        missing = node_ids[pos] != ids
+    if missing.any():
+        raise ValueError(source+': '+str(int(missing.sum()))+' edge ends are not in the nodes file (e.g. sequence index '+str(ids[np.argmax(missing)])+')')
+    return pos
+
+
+def load_csr_edges(graph_path, weights=None, seq_file=None, node_ids=None):
+    """Returns (sources, targets, probabilities) of a neighbor graph directory.
+
+    weights is a .npy file aligned with the graph indices, or an AA to AA
+    probability matrix looked up for each edge (needs the sequences); all
+    edges weigh 1 without it. With node_ids, sources and targets are vertex
+    positions, as in load_edges.
+    """
+    indptr, indices = nbgraph.load_graph(graph_path)
+    src = nbgraph.edge_sources(indptr)
+    if weights and weights.endswith('.npy'):
+        proba = np.load(weights)
+    elif weights:
+        # vectorized AA to AA lookup, cached next to the graph
+        proba = np.asarray(nbgraph.cached_edge_weights(graph_path, seqstore.open_store(seq_file), indptr, indices, np.loadtxt(weights)))
+    else:
+        proba = np.ones(len(indices))
+    dst = np.asarray(indices)
+    if node_ids is not None:
+        src = vertex_positions(node_ids, src, graph_path)
+        dst = vertex_positions(node_ids, dst, graph_path)
+    return src, dst, proba
+
+
+def edge_mask(src, dst, proba, threshold):
+    """Edges kept in the graph: no self edges, weight above threshold"""
+    return (src != dst) & (proba > threshold)
+
+
+def build_graph(nnodes, src, dst, proba, threshold=0):
+    """Directed igraph graph with a 'weights' edge attribute, pruned with edge_mask"""
+    keep = edge_mask(src, dst, proba, threshold)
+    g = ig.Graph(n=nnodes, edges=np.column_stack((src[keep], dst[keep])).tolist(), directed=True)
+    g.es['weights'] = proba[keep].tolist()
+    return g
+
+
+def community_matrix(membership, src, dst, weights):
+    """C x C sparse matrix (CSR) of summed edge weights from community to community"""
+    membership = np.asarray(membership)
+    ncomm = membership.max() + 1
+    return coo_matrix((weights, (membership[src], membership[dst])), shape=(ncomm, ncomm)).tocsr()
+
+
+def community_members(membership):
+    """Returns (order, bounds): members of community c are order[bounds[c]:bounds[c+1]]"""
+    membership = np.asarray(membership)
+    order = np.argsort(membership, kind='stable')
+    bounds = np.searchsorted(membership[order], np.arange(membership.max() + 2))
+    return order, bounds
+
+
+def community_graph(cmatrix, min_degree=3):
+    """Undirected simple graph of the communities with a degree of at least min_degree.
+
+    The degree is taken in the aggregated (directed, with self loops) graph.
+    Returns the graph, whose 'community' vertex attribute holds community ids,
+    and the vertex of each community (-1 for removed ones).
+    """
+    ncomm = cmatrix.shape[0]
+    nz = (cmatrix != 0).astype(np.int64)
+    degree = np.asarray(nz.sum(axis=0)).ravel() + np.asarray(nz.sum(axis=1)).ravel()
+    kept = np.flatnonzero(degree >= min_degree)
+    vertex = np.full(ncomm, -1, dtype=np.int64)
+    vertex[kept] = np.arange(len(kept))
+    sym = (nz + nz.T).tocoo()
+    links = (sym.row < sym.col) & (vertex[sym.row] >= 0) & (vertex[sym.col] >= 0) # no self edges, undirected
+    edges = np.column_stack((vertex[sym.row[links]], vertex[sym.col[links]]))
+    g = ig.Graph(n=len(kept), edges=edges.tolist(), directed=False)
+    g.vs['community'] = kept.tolist()
+    return g, vertex
+
+
+def local_opt_repartition(lo_list, part):
+    lo_repart = []
+    for i in range(len(part.sizes())): #number of communities
+        lo_repart.append(0)
+    for i in lo_list:
+        lo_repart[part.membership[i]]+=1
+    return lo_repart # number of local optima per community
+
+
+def find_partition(g, partition_type='modularity', resolution=None, seed=None, n_iterations=50):
+    """Leiden partition of g, using the 'weights' edge attribute when the type supports it"""
+    kwargs = {}
+    if partition_type in RESOLUTION_TYPES and resolution is not None:
+        kwargs['resolution_parameter'] = resolution
+    if partition_type != 'significance': # the only unweighted quality function
+        kwargs['weights'] = 'weights'
+    return la.find_partition(g, PARTITION_TYPES[partition_type], n_iterations=n_iterations, seed=seed, **kwargs)
+
+
+def sweep_runs(thresholds, partition_types, resolutions, seeds):
+    """Grid of (threshold, partition type, resolution, seed), resolution is None for types without one"""
+    runs = []
+    for threshold, ptype in product(thresholds, partition_types):
+        for resolution in (resolutions if ptype in RESOLUTION_TYPES else [None]):
+            for seed in seeds:
+                runs.append((threshold, ptype, resolution, seed))
+    return runs
+
+
+def _init_sweep(nnodes, src, dst, proba, lo_indices, n_iterations):
+    global _sweep
+    _sweep = (nnodes, src, dst, proba, lo_indices, n_iterations, {})
+
+
+def _sweep_run(run):
+    nnodes, src, dst, proba, lo_indices, n_iterations, graphs = _sweep
+    threshold, ptype, resolution, seed = run
+    if threshold not in graphs: # one graph per threshold and process
+        graphs[threshold] = build_graph(nnodes, src, dst, proba, threshold)
+    g = graphs[threshold]
+    partition = find_partition(g, ptype, resolution, seed, n_iterations)
+    membership = np.array(partition.membership, dtype=np.int32)
+    return membership, g.modularity(partition.membership, weights='weights'), local_opt_repartition(lo_indices, partition)
+
+
+def sweep(output, nnodes, src, dst, proba, runs, lo_indices, wt_index, n_iterations=50, jobs=1):
+    """Runs Leiden for each run of sweep_runs, the graph being loaded once.
+
+    Writes output + '.memberships.npy' (N x runs int32, one column per run, column-major)
+    and output + '.summary.tsv' (modularity, number of communities,
+    community of the WT and number of local optima per community).
+    """
+    memberships = np.lib.format.open_memmap(output+'.memberships.npy', mode='w+', dtype=np.int32, shape=(nnodes, len(runs)), fortran_order=True) # runs are written (and read) one column at a time
+    sweep_args = (nnodes, src, dst, proba, list(lo_indices), n_iterations)
+    if jobs > 1:
+        pool = Pool(jobs, initializer=_init_sweep, initargs=sweep_args)
+        results = pool.imap(_sweep_run, runs)
+    else:
+        pool = None
+        _init_sweep(*sweep_args)
+        results = map(_sweep_run, runs)
+
+    with open(output+'.summary.tsv', 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['run', 'threshold', 'partition_type', 'resolution', 'seed', 'modularity', 'communities', 'wt_community', 'local_optima_per_community'])
+        for i, (run, (membership, modularity, lo_repart)) in enumerate(zip(runs, results)):
+            memberships[:, i] = membership
+            threshold, ptype, resolution, seed = run
+            writer.writerow([i, threshold, ptype, '' if resolution is None else resolution, seed, modularity, len(lo_repart),
+                             membership[wt_index], ','.join(str(c)+':'+str(n) for c, n in enumerate(lo_repart) if n)])
+            f.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    memberships.flush()
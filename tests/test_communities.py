@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sequence-community-graph'))
+import communities
+import neighbors as nbgraph
+
+
+def test_vertex_positions():
+    node_ids = np.array([10, 3, 7])
+    assert communities.vertex_positions(node_ids, np.array([3, 10, 7, 3])).tolist() == [1, 0, 2, 1]
+    for missing in (5, 11, 0):
+        with pytest.raises(ValueError, match='sequence index '+str(missing)):
+            communities.vertex_positions(node_ids, np.array([3, missing]))
+    with pytest.raises(ValueError, match='sequence index 4'):
+        communities.vertex_positions(np.arange(4), np.array([1, 4]))
+
+
+def test_csr_edges_are_vertex_positions(tmp_path):
+    # path 0 - 1 - 2 - 3 on sequence indices
+    indptr, indices = nbgraph.to_csr(np.array([0, 1, 2]), np.array([1, 2, 3]), 4)
+    graph = str(tmp_path / 'enum.graph')
+    nbgraph.save_graph(graph, indptr, indices)
+    src, dst, proba = communities.load_csr_edges(graph, node_ids=np.array([3, 2, 1, 0]))
+    edges = {(int(a), int(b)) for a, b in zip(src, dst)}
+    assert edges == {(3, 2), (2, 3), (2, 1), (1, 2), (1, 0), (0, 1)}
+    assert (proba == 1).all()
+    with pytest.raises(ValueError, match='sequence index 3'):
+        communities.load_csr_edges(graph, node_ids=np.array([0, 1, 2]))
+
+
+def test_sweep_memberships_are_column_major(tmp_path):
+    # two cliques of 5 joined by one edge
+    pairs = [(a, b) for a in range(5) for b in range(a + 1, 5)] + [(a + 5, b + 5) for a in range(5) for b in range(a + 1, 5)] + [(4, 5)]
+    src, dst = np.array(pairs).T
+    runs = communities.sweep_runs([0.0], ['modularity'], [], [0, 1, 2])
+    output = str(tmp_path / 'leiden')
+    communities.sweep(output, 10, src, dst, np.ones(len(src)), runs, [0, 9], 0)
+    memberships = np.load(output+'.memberships.npy', mmap_mode='r')
+    assert memberships.shape == (10, 3) and memberships.flags.f_contiguous
+    for run in range(3):
+        column = memberships[:, run]
+        assert column.flags.c_contiguous # one run is read without strides
+        assert len(set(column[:5])) == 1 and len(set(column[5:])) == 1 and column[0] != column[5]
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GISAID-scan'))
+import hamming_index
+
+POSITIONS = np.array([0, 2, 3, 5, 6, 8])
+
+
+@pytest.fixture(scope='module')
+def index():
+    rng = np.random.default_rng(0)
+    windows = [''.join(rng.choice(list('ACD'), size=rng.integers(8, 16))) for _ in range(60)]
+    index = hamming_index.MotifIndex(POSITIONS)
+    for b in range(0, len(windows), 25): # several batches
+        index.add(windows[b:b+25])
+    return index.finalize(), windows
+
+
+def test_keys_and_occurrences(index):
+    index, windows = index
+    occurrences = {}
+    for w, window in enumerate(windows):
+        for offset in range(len(window) - POSITIONS[-1]):
+            occurrences.setdefault(''.join(window[offset + p] for p in POSITIONS), set()).add(w)
+    keys = [k.tobytes().decode() for k in index.keys]
+    assert sorted(keys) == sorted(occurrences)
+    for kid, key in enumerate(keys):
+        assert index.windows_of(kid).tolist() == sorted(occurrences[key])
+
+
+@pytest.mark.parametrize('k', [0, 1, 2])
+def test_query_matches_brute_force(index, k):
+    index, windows = index
+    rng = np.random.default_rng(k)
+    # keys with up to 3 random substitutions (E is not in the windows)
+    rbms = index.keys[rng.integers(len(index.keys), size=30)].copy()
+    substituted = rng.random(rbms.shape) < 0.3
+    rbms[substituted] = rng.choice(np.frombuffer(b'ACDE', dtype=np.uint8), size=substituted.sum())
+    rbms = hamming_index._unique_rows(rbms)[0]
+    distances = (rbms[:, None, :] != index.keys[None, :, :]).sum(axis=2)
+    rid, kid = np.nonzero(distances <= k)
+    assert len(rid) > (k > 0) * len(rbms) # some RBMs are close to several keys
+    found = sorted(zip(*[a.tolist() for a in index.query(rbms, k)]))
+    assert found == sorted(zip(rid.tolist(), kid.tolist(), distances[rid, kid].tolist()))
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+INTERFACE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'interface')
+sys.path.insert(0, INTERFACE)
+import interface
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    pdbs = tmp_path / 'pdbs'
+    pdbs.mkdir()
+    for name in ('a', 'b', 'c', 'd'):
+        (pdbs / (name+'.pdb')).write_text('ATOM '+name+'\n')
+    protocol = tmp_path / 'protocol.xml'
+    protocol.write_text('<ROSETTASCRIPTS/>\n')
+    return pdbs, str(protocol)
+
+
+def tasks(pdbs, outdir):
+    os.makedirs(outdir, exist_ok=True)
+    return [(pdb, os.path.join(outdir, os.path.basename(pdb))) for pdb in interface.pdb_inputs(str(pdbs))]
+
+
+def outputs(outdir):
+    return {f: open(os.path.join(outdir, f)).read() for f in sorted(os.listdir(outdir))}
+
+
+def test_existing_outputs_are_skipped(inputs, tmp_path):
+    pdbs, protocol = inputs
+    outdir = str(tmp_path / 'out')
+    todo = tasks(pdbs, outdir)
+    with open(todo[0][1], 'w') as f:
+        f.write('done before\n')
+    status = {os.path.basename(out): s for out, s, _ in interface.run_batch(todo, protocol, mock=True)}
+    assert status == {'a.pdb': 'skipped', 'b.pdb': 'done', 'c.pdb': 'done', 'd.pdb': 'done'}
+    assert outputs(outdir)['a.pdb'] == 'done before\n'
+    assert outputs(outdir)['b.pdb'] == 'REMARK mock protocol.xml\nATOM b\n'
+
+
+def test_failed_task_leaves_no_partial_output(inputs, tmp_path, monkeypatch):
+    pdbs, protocol = inputs
+    outdir = str(tmp_path / 'out')
+    todo = tasks(pdbs, outdir)[:1] + [(str(pdbs / 'missing.pdb'), os.path.join(outdir, 'missing.pdb'))]
+    def fail(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(interface.os, 'replace', fail) # fails after the .tmp.pdb is written
+    status = [s for _, s, _ in interface.run_batch(todo, protocol, mock=True)]
+    assert [s.split(':')[0] for s in status] == ['failed', 'failed']
+    assert os.listdir(outdir) == []
+
+
+def test_jobs_give_the_same_outputs(inputs, tmp_path):
+    pdbs, protocol = inputs
+    serial, parallel = str(tmp_path / 'serial'), str(tmp_path / 'parallel')
+    list(interface.run_batch(tasks(pdbs, serial), protocol, jobs=1, mock=True))
+    status = list(interface.run_batch(tasks(pdbs, parallel), protocol, jobs=3, mock=True))
+    assert all(s == 'done' for _, s, _ in status)
+    assert outputs(serial) == outputs(parallel)
+
+
+def test_mutation_sets(inputs, tmp_path):
+    pdbs, protocol = inputs
+    mutations = tmp_path / 'mutations.txt'
+    mutations.write_text('N501Y B:501:Y\nWT\n')
+    outdir = str(tmp_path / 'out')
+    todo = [(m, os.path.join(outdir, name+'.pdb')) for name, m in interface.read_mutation_sets(str(mutations))]
+    os.makedirs(outdir)
+    list(interface.run_batch(todo, protocol, base_pdb=str(pdbs / 'a.pdb'), jobs=2, mock=True))
+    assert outputs(outdir) == {'N501Y.pdb': 'REMARK mutation B:501:Y\nREMARK mock protocol.xml\nATOM a\n',
+                               'WT.pdb': 'REMARK mock protocol.xml\nATOM a\n'}
+
+
+def test_mutations_need_a_base_pdb(inputs, tmp_path):
+    pdbs, protocol = inputs
+    mutations = tmp_path / 'mutations.txt'
+    mutations.write_text('N501Y B:501:Y\n')
+    run = subprocess.run([sys.executable, os.path.join(INTERFACE, 'interface.py'), '-m', str(mutations), '-p', protocol,
+                          '-o', str(tmp_path / 'out'), '--mock'], capture_output=True, text=True)
+    assert run.returncode == 2
+    assert '-i/--input' in run.stderr
+    assert not os.path.exists(tmp_path / 'out')
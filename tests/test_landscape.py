@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import landscape
+import neighbors as nbgraph
+
+
+def tied_graph(seed, n=40):
+    """Random graph with isolated sequences and many equal ddG values"""
+    rng = np.random.default_rng(seed)
+    src, dst = np.nonzero(np.triu(rng.random((n, n)) < 0.08, 1))
+    indptr, indices = nbgraph.to_csr(src, dst, n)
+    return indptr, indices, rng.integers(0, 4, size=n).astype(float)
+
+
+def brute_force_steepest(indptr, indices, energies):
+    """Lowest of each sequence and its neighbors by (ddG, index)"""
+    return np.array([min([i] + indices[indptr[i]:indptr[i+1]].tolist(), key=lambda j: (energies[j], j))
+                     for i in range(len(indptr) - 1)])
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('chunk', [1, 3, 7, 1 << 22])
+def test_steepest_neighbors_and_basins(seed, chunk):
+    indptr, indices, energies = tied_graph(seed)
+    assert chunk == 1 << 22 or chunk < len(indices)
+    assert (np.diff(indptr) == 0).any() # rows without edges
+    expected = brute_force_steepest(indptr, indices, energies)
+    steepest = landscape.steepest_neighbors(indptr, indices, energies, chunk)
+    assert steepest.tolist() == expected.tolist()
+    basin = []
+    for i in range(len(expected)):
+        while expected[i] != i:
+            i = expected[i]
+        basin.append(i)
+    minima, found, sizes = landscape.landscape(indptr, indices, energies, chunk)
+    assert found.tolist() == basin
+    assert minima.tolist() == sorted(set(basin))
+    assert sizes.tolist() == [basin.count(m) for m in minima]
+    assert landscape.local_minima(indptr, indices, energies, chunk).tolist() == minima.tolist()
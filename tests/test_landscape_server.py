@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import seqstore
+import neighbors as nbgraph
+import pathsearch
+from landscape_server import Landscape, serve
+from landscape_client import Client
+
+LENGTH = 6
+
+
+@pytest.fixture(scope='module')
+def landscape(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('landscape')
+    rng = np.random.default_rng(1)
+    # few residues per position, so that Hamming balls and the graph are dense
+    codes = np.unique(rng.integers(0, 4, size=(600, LENGTH)), axis=0).astype(np.uint8)
+    with open(tmp / 'enum.txt', 'w') as f:
+        for seq, ddg in zip(seqstore.decode(codes), rng.normal(size=len(codes))):
+            f.write(seq+' '+str(round(ddg, 3))+'\n')
+    store = seqstore.convert(str(tmp / 'enum.txt'), str(tmp / 'enum.store'))
+    nbgraph.build_graph(store.path, str(tmp / 'enum.graph'))
+    matrix = rng.random((len(seqstore.AA_order), len(seqstore.AA_order))) + 0.1
+    membership = rng.integers(0, 5, size=len(store))
+    np.save(tmp / 'communities.npy', membership)
+    return Landscape(store.path, str(tmp / 'enum.graph'), matrix, str(tmp / 'communities.npy'))
+
+
+def test_lookup(landscape):
+    seqs = landscape.store.sequences()
+    for i in range(0, len(seqs), 7):
+        assert landscape.lookup(seqs[i]) == i
+    absent = next(s for s in seqstore.decode(np.full((1, LENGTH), 5, dtype=np.uint8)) if s not in seqs)
+    assert landscape.lookup(absent) is None
+
+
+@pytest.mark.parametrize('k', [0, 1, 2, 3])
+def test_hamming_matches_brute_force(landscape, k):
+    residues = np.asarray(landscape.residues)
+    rng = np.random.default_rng(k)
+    queries = [landscape.store.sequence(i) for i in rng.integers(len(residues), size=5)]
+    queries.append(seqstore.decode(np.array([0, 1, 2, 3, 0, 1], dtype=np.uint8))) # maybe not stored
+    for query in queries:
+        distances = (residues != seqstore.encode([query])[0]).sum(axis=1)
+        expected = np.lexsort((np.arange(len(distances)), distances))
+        expected = expected[distances[expected] <= k]
+        ids, found = landscape.hamming(query, k)
+        assert ids.tolist() == expected.tolist()
+        assert found.tolist() == distances[expected].tolist()
+
+
+def test_neighbors_and_paths(landscape):
+    indptr, indices, weights = landscape.indptr, landscape.indices, landscape.edge_weights
+    dist, _ = pathsearch.dijkstra(indptr, indices, weights, 0)
+    searches = {}
+    for target in range(1, len(dist), 11):
+        result = landscape.answer({'op': 'path', 'id': 0, 'target': target}, searches)
+        if np.isinf(dist[target]):
+            assert result == {'distance': None, 'path': []}
+            continue
+        path = result['path']
+        assert path[0] == 0 and path[-1] == target
+        assert result['distance'] == pytest.approx(dist[target])
+        assert sum(pathsearch.edge_weight(indptr, indices, weights, a, b) for a, b in zip(path, path[1:])) == pytest.approx(dist[target])
+    assert len(searches) == 1 # one search for all the paths of a source
+    result = landscape.answer({'op': 'neighbors', 'id': 3})
+    assert result['ids'] == indices[indptr[3]:indptr[4]].tolist()
+    residues = np.asarray(landscape.residues)
+    assert all((residues[j] != residues[3]).sum() == 1 for j in result['ids'])
+
+
+def test_community(landscape):
+    membership = landscape.membership
+    result = landscape.answer({'op': 'community', 'sequence': landscape.store.sequence(4)})
+    assert result == {'id': 4, 'community': int(membership[4]), 'size': int((membership == membership[4]).sum())}
+
+
+def test_failed_queries_do_not_fail_the_batch(landscape):
+    server = serve(landscape, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = Client('http://127.0.0.1:'+str(server.server_address[1]))
+        # Infinity is valid for json.loads and overflows int()
+        results = client.request('POST', '/query', json.loads('[{"op": "sequence", "id": Infinity}, {"op": "bogus"}, '
+                                                              '{"op": "path", "id": 1}, {"op": "hamming", "sequence": "AC"}, '
+                                                              '{"op": "sequence", "id": 2}]'))
+        assert ['error' in r for r in results] == [True, True, True, True, False]
+        assert results[-1]['sequence'] == landscape.store.sequence(2)
+        assert client.info()['sequences'] == len(landscape.store)
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import seqstore
+import neighbors as nbgraph
+
+LENGTH = 5
+
+
+@pytest.fixture(scope='module')
+def store(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('neighbors')
+    rng = np.random.default_rng(0)
+    codes = np.unique(rng.integers(0, 3, size=(150, LENGTH)), axis=0).astype(np.uint8)
+    codes = codes[rng.permutation(len(codes))]
+    with open(tmp / 'enum.txt', 'w') as f:
+        for seq, ddg in zip(seqstore.decode(codes), rng.normal(size=len(codes))):
+            f.write(seq+' '+str(round(ddg, 3))+'\n')
+    return seqstore.convert(str(tmp / 'enum.txt'), str(tmp / 'enum.store'))
+
+
+def brute_force_neighbors(residues):
+    """Sorted Hamming-1 neighbors of each sequence, by comparing all pairs"""
+    differences = (residues[:, None, :] != residues[None, :, :]).sum(axis=2)
+    return [np.flatnonzero(row == 1).tolist() for row in differences]
+
+
+def rows(indptr, indices):
+    return [sorted(indices[indptr[i]:indptr[i+1]].tolist()) for i in range(len(indptr) - 1)]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_graph_matches_brute_force(store, tmp_path, jobs):
+    indptr, indices = nbgraph.build_graph(store.path, str(tmp_path / 'enum.graph'), jobs=jobs)
+    expected = brute_force_neighbors(np.asarray(store.residues))
+    assert sum(map(len, expected)) > len(expected) # most sequences have neighbors
+    assert rows(indptr, indices) == expected
+    assert [r.tolist() for r in np.split(np.asarray(indices), indptr[1:-1])] == expected # rows are sorted
+    saved = nbgraph.load_graph(str(tmp_path / 'enum.graph'))
+    assert np.array_equal(saved[0], indptr) and np.array_equal(saved[1], indices)
+
+
+def test_hash_collisions_are_removed(store):
+    residues = np.asarray(store.residues)
+    # with equal weights the hash is the residue sum: sequences with permuted residues collide
+    weights = np.ones(LENGTH, dtype=np.uint64)
+    hashes = nbgraph.row_hashes(residues, weights)
+    assert len(np.unique(hashes)) < len(np.unique(residues, axis=0))
+    pairs = [nbgraph.position_pairs(residues, hashes, weights, p) for p in range(LENGTH)]
+    indptr, indices = nbgraph.to_csr(np.concatenate([a for a, b in pairs]), np.concatenate([b for a, b in pairs]), len(residues))
+    assert rows(indptr, indices) == brute_force_neighbors(residues)
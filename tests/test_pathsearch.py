@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+sys.path.insert(0, SCRIPTS)
+import neighbors as nbgraph
+import pathsearch
+
+
+def random_graph(n, p, seed):
+    """Undirected random graph whose paths all have distinct distances, as (indptr, indices, weights, adjacency, weight matrix)"""
+    rng = np.random.default_rng(seed)
+    src, dst = np.nonzero(np.triu(rng.random((n, n)) < p, 1))
+    indptr, indices = nbgraph.to_csr(src, dst, n)
+    upper = 2.0 ** rng.permutation(len(src)) # distinct edge sets have distinct sums
+    w = np.zeros((n, n))
+    w[src, dst] = w[dst, src] = upper
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    weights = w[rows, indices]
+    adjacency = {x: [int(y) for y in indices[indptr[x]:indptr[x+1]]] for x in range(n)}
+    return indptr, indices, weights, adjacency, w
+
+
+def simple_paths(adjacency, w, source, goal):
+    """All loopless paths from source to goal, by exhaustive search, sorted by (distance, path)"""
+    paths = []
+    def extend(path, distance):
+        if path[-1] == goal:
+            paths.append((distance, path))
+            return
+        for y in adjacency[path[-1]]:
+            if y not in path:
+                extend(path + [y], distance + w[path[-1], y])
+    extend([source], 0.0)
+    return sorted(paths)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_k_shortest_paths_match_exhaustive_search(seed):
+    indptr, indices, weights, adjacency, w = random_graph(8, 0.5, seed)
+    for source, goal in [(0, 7), (3, 5), (1, 2)]:
+        expected = simple_paths(adjacency, w, source, goal)
+        found = pathsearch.k_shortest_paths(indptr, indices, weights, source, goal, 12)
+        assert len(expected) > 1 and len(found) == min(12, len(expected))
+        for (distance, path), (d, p) in zip(found, expected):
+            assert distance == pytest.approx(d)
+            assert path == p
+
+
+def test_k_shortest_paths_unreachable():
+    indptr, indices = nbgraph.to_csr(np.array([0, 2]), np.array([1, 3]), 4)
+    assert pathsearch.k_shortest_paths(indptr, indices, np.ones(len(indices)), 0, 3, 3) == []
+    assert pathsearch.k_shortest_paths(indptr, indices, np.ones(len(indices)), 0, 1, 3) == [(1.0, [0, 1])]
+
+
+def test_k_paths_reject_early_exit(tmp_path):
+    run = subprocess.run([sys.executable, os.path.join(SCRIPTS, 'shortest_mutpaths.py'), '-i', 'graph', '-e', 'enum.store', '-m', 'a2a.txt',
+                          '-s', 'starts', '-g', 'goals', '-r', str(tmp_path / 'paths.txt'), '-k', '3', '-x'], capture_output=True, text=True)
+    assert run.returncode == 2
+    assert '-x/--early-exit' in run.stderr
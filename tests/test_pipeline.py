@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+GISAID = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GISAID-scan')
+sys.path.insert(0, GISAID)
+import pipeline
+
+
+def stub(outdir, inputs, params, jobs):
+    """Writes its name and the content of its inputs, and logs the run"""
+    text = params['name']+'('+','.join(open(os.path.join(inputs[i], 'out')).read() for i in sorted(inputs))+')'
+    with open(os.path.join(outdir, 'out'), 'w') as f:
+        f.write(text)
+    with open(params['log'], 'a') as f:
+        f.write(params['name']+'\n')
+
+
+def stages(log, source):
+    # a -> b -> c, d independent, e depends on c and d
+    deps = {'a': [], 'b': ['a'], 'c': ['b'], 'd': [], 'e': ['c', 'd']}
+    return [pipeline.Stage(name, stub, inputs, {'name': name, 'log': log}, files={'source': source} if name == 'a' else None)
+            for name, inputs in deps.items()]
+
+
+def runs(log):
+    with open(log) as f:
+        runs = f.read().split()
+    open(log, 'w').close()
+    return sorted(runs)
+
+
+def test_cached_and_forced_stages(tmp_path):
+    log, source, cache = str(tmp_path / 'log'), tmp_path / 'source.txt', str(tmp_path / 'cache')
+    source.write_text('v1\n')
+    dirs = pipeline.run(stages(log, str(source)), cache, cores=2)
+    assert runs(log) == ['a', 'b', 'c', 'd', 'e']
+    assert open(os.path.join(dirs['e'], 'out')).read() == 'e(c(b(a())),d())'
+
+    assert pipeline.run(stages(log, str(source)), cache, cores=2) == dirs
+    assert runs(log) == []
+
+    assert pipeline.run(stages(log, str(source)), cache, cores=2, force={'b'}) == dirs
+    assert runs(log) == ['b', 'c', 'e']
+
+    source.write_text('v2\n') # new input file content: a and its dependents
+    changed = pipeline.run(stages(log, str(source)), cache, cores=2)
+    assert runs(log) == ['a', 'b', 'c', 'e']
+    assert changed['d'] == dirs['d'] and changed['a'] != dirs['a']
+
+
+def test_stale_temporary_directories_are_removed(tmp_path):
+    log, source, cache = str(tmp_path / 'log'), tmp_path / 'source.txt', tmp_path / 'cache'
+    source.write_text('v1\n')
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True).stdout.strip()
+    cache.mkdir()
+    for name in ('a-0123.tmp-'+dead, 'b-0123.tmp-'+str(os.getpid())):
+        (cache / name).mkdir()
+    pipeline.run(stages(log, str(source)), str(cache))
+    assert not (cache / ('a-0123.tmp-'+dead)).exists()
+    assert (cache / ('b-0123.tmp-'+str(os.getpid()))).exists() # running
+    assert not [name for name in os.listdir(cache) if '.tmp-' in name and not name.startswith('b-0123')]
+
+
+def test_missing_inputs_are_reported(tmp_path):
+    rbms = tmp_path / 'rbms.txt'
+    rbms.write_text('A\n')
+    run = subprocess.run([sys.executable, os.path.join(GISAID, 'pipeline.py'), '-i', str(tmp_path / 'missing.fasta'), '-r', str(rbms),
+                          '-c', str(tmp_path / 'cache')], capture_output=True, text=True)
+    assert run.returncode == 2
+    assert '-i/--input: no such file' in run.stderr and 'Traceback' not in run.stderr
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import seqstore
+
+SEQS = ['ACDE', 'FGHI', 'KLMN', 'PQRS']
+DDG = [1.5, -2.0, 0.5, 3.0]
+
+
+def write_enumeration(path, header=('# enumeration', 'sequence ddG'), footer=()):
+    with open(path, 'w') as f:
+        for line in header:
+            f.write(line+'\n')
+        for s, e in zip(SEQS, DDG):
+            f.write(s+' '+str(e)+'\n')
+        for line in footer:
+            f.write(line+'\n')
+    return path
+
+
+def test_convert_header_only_chunk(tmp_path):
+    infile = write_enumeration(str(tmp_path / 'enum.txt'))
+    store = seqstore.convert(infile, str(tmp_path / 'enum.store'), chunk_lines=2)
+    assert store.sequences() == SEQS
+    assert np.allclose(store.ddg, DDG)
+
+
+def test_convert_top_with_empty_chunks(tmp_path):
+    infile = write_enumeration(str(tmp_path / 'enum.txt'), footer=('# end', '# of report'))
+    store = seqstore.convert(infile, str(tmp_path / 'top.store'), chunk_lines=2, top=2)
+    assert store.sequences() == ['FGHI', 'KLMN']
+    assert np.allclose(store.ddg, [-2.0, 0.5])
+    assert store.meta['filters']['read'] == len(SEQS)
+
+
+def test_convert_rejects_malformed_lines(tmp_path):
+    infile = str(tmp_path / 'enum.txt')
+    with open(infile, 'w') as f:
+        f.write('sequence ddG\nACDE 1.5\nFGH 2.0\nKLMN\nPQRS x\nTVWY 0.5\nEND\n')
+    with pytest.raises(ValueError, match='3 sequence lines .* lines 3, 4, 5'):
+        seqstore.convert(infile, str(tmp_path / 'enum.store'), chunk_lines=2)
+    assert not seqstore.is_store(str(tmp_path / 'enum.store'))
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'GISAID-scan'))
+import multiscan
+import windowstore
+
+SEQS = ['ACDEFGHIKLMNPQRSTVWY', 'ACDEFGHIKLMNPQRSTVWA', 'ACDEFGHIKLMNPQRSTVWY', 'ACDEFGHIKL']
+
+
+@pytest.fixture
+def store(tmp_path):
+    fasta = tmp_path / 'spike.fasta2'
+    fasta.write_text(''.join('>r'+str(i)+' spike\n'+s+'\n' for i, s in enumerate(SEQS)))
+    return windowstore.ingest(str(fasta), str(tmp_path / 'spike.windows'), min_length=5, start=4, end=18)
+
+
+def test_open_window_bounds_are_the_stored_ones(store):
+    assert store.windows() == ['FGHIKLMNPQRSTV', 'FGHIKL']
+    assert store.windows(multiscan.parse_window(':18')) == store.windows()
+    assert store.windows(multiscan.parse_window('6:')) == ['HIKLMNPQRSTV', 'HIKL']
+    assert store.windows(multiscan.parse_window(':')) == store.windows()
+    assert store.windows(multiscan.parse_window('8:12')) == ['KLMN', 'KL']
+    assert store.record_ids(0) == ['r0', 'r1', 'r2']
+    for window in ('2:10', '6:19'):
+        with pytest.raises(ValueError, match='not within the stored window 4:18'):
+            store.windows(multiscan.parse_window(window))